@@ -15,19 +15,27 @@
 """Create SGD AnyTOD data."""
 
 import collections
+from concurrent import futures
 import copy
 import dataclasses
 import enum
+import functools
 import json
 import os
 import random
 import string
 import time
-from typing import Generic, Iterator, Optional, TypeVar
+from typing import Generic, Iterable, Iterator, Optional, TypeVar
 
 from absl import app
 from absl import flags
+from absl import logging
 import ordered_set
+from task_oriented_dialogue.state_tracking.utils import cache_utils
+from task_oriented_dialogue.state_tracking.utils import history_utils
+from task_oriented_dialogue.state_tracking.utils import progress_utils
+from task_oriented_dialogue.state_tracking.utils import sgd_utils
+from task_oriented_dialogue.state_tracking.utils import tfrecord_utils
 import tensorflow as tf
 
 
@@ -49,6 +57,33 @@ _SHUFFLE = flags.DEFINE_bool(
     'shuffle', True, 'Should we shuffle training examples and indices?'
 )
 _FIX_TAGS = flags.DEFINE_bool('fix_tags', False, 'If true, use fixed tags.')
+_USE_CACHE = flags.DEFINE_bool(
+    'use_cache',
+    False,
+    'If true, cache the parsed input data next to it, to speed up later runs.',
+)
+_VERBOSE_EXAMPLES = flags.DEFINE_integer(
+    'verbose_examples', 0, 'Number of examples to log in full, for debugging.'
+)
+_NUM_SHARDS = flags.DEFINE_integer(
+    'num_shards',
+    1,
+    'Number of TFRecord shards to write per split. If greater than 1, shards '
+    'are named <split>.tfrecord-00000-of-<num_shards>.',
+)
+_NUM_WORKERS = flags.DEFINE_integer(
+    'num_workers',
+    1,
+    'Number of processes converting dialogues and serializing output '
+    'examples.',
+)
+_SEED = flags.DEFINE_integer(
+    'seed',
+    None,
+    'Seed of the shuffled orderings and training examples. Each dialogue is '
+    'shuffled with its own seed derived from it, so the output does not '
+    'depend on --num_workers. If None, a random seed is used.',
+)
 
 Slot = str
 Json = dict
@@ -56,18 +91,34 @@ Action = tuple[str, Optional[str]]
 
 T = TypeVar('T')
 
+# Number of dialogues converted per task of a worker process.
+_CHUNK_SIZE = 64
+
 
 class Ordering(Generic[T]):
   """Provides an ordering for a list of entities."""
 
-  def __init__(self, entities: list[T], shuffle_idxs: bool = True):
+  def __init__(
+      self,
+      entities: list[T],
+      shuffle_idxs: bool = True,
+      rng: Optional[random.Random] = None,
+  ):
     self._idx_to_entity = copy.deepcopy(entities)
     if shuffle_idxs:
-      random.shuffle(self._idx_to_entity)
+      (rng or random).shuffle(self._idx_to_entity)
     self._entity_to_idx = {e: i for i, e in enumerate(self._idx_to_entity)}
 
+  @classmethod
+  def from_ordered(cls, idx_to_entity: list[T]) -> 'Ordering[T]':
+    """Returns an ordering of entities already in order, without copying."""
+    ordering = cls.__new__(cls)
+    ordering._idx_to_entity = idx_to_entity
+    ordering._entity_to_idx = {e: i for i, e in enumerate(idx_to_entity)}
+    return ordering
+
   def __contains__(self, e: T) -> bool:
-    return e in self._idx_to_entity
+    return e in self._entity_to_idx
 
   def get_idx(self, e: T) -> int:
     return self._entity_to_idx[e]
@@ -82,27 +133,41 @@ class Ordering(Generic[T]):
     return self._idx_to_entity
 
 
-def _read_file(filename: str) -> str:
-  with tf.io.gfile.GFile(filename) as f:
-    return f.read()
-
+def load_sgd_data(
+    data_dir: str, use_cache: bool = False
+) -> tuple[list[Json], Json]:
+  """Load the JSONs for a SGD split.
+
+  Args:
+    data_dir: Directory of the SGD split.
+    use_cache: If True, the parsed JSONs are cached in a
+      `cache_utils.CACHE_DIRNAME` directory under `data_dir`, and loaded from
+      there as long as the split's files are unchanged.
+
+  Returns:
+    The dialogs and the schema of the split.
+  """
+  if use_cache:
+    source_paths = tf.io.gfile.glob(
+        os.path.join(data_dir, 'dialogues_*.json')
+    ) + [os.path.join(data_dir, 'schema.json')]
+    return cache_utils.load_cached(
+        name='sgd_anytod',
+        cache_dir=os.path.join(data_dir, cache_utils.CACHE_DIRNAME),
+        source_paths=source_paths,
+        load_fn=functools.partial(load_sgd_data, data_dir),
+    )
 
-def load_sgd_data(data_dir: str) -> tuple[list[Json], Json]:
-  """Load the JSONs for a SGD split."""
   dialogs = []
   filenames = tf.io.gfile.glob(os.path.join(data_dir, 'dialogues_*.json'))
 
   start_time = time.time()
-  # TODO(jeffreyzhao): Parallelize below.
-  json_strs = [
-      _read_file(f) for f in filenames
-  ]
+  json_lists = sgd_utils.load_json_files(filenames)
   print(
       f'Reading dialogues_*.json files took {time.time() - start_time} seconds.'
   )
 
-  for js in json_strs:
-    js = json.loads(js, object_hook=Json)
+  for js in json_lists:
     for d in js:
       dialogs.append(d)
   with tf.io.gfile.GFile(os.path.join(data_dir, 'schema.json')) as f:
@@ -110,16 +175,6 @@ def load_sgd_data(data_dir: str) -> tuple[list[Json], Json]:
   return dialogs, schema
 
 
-def _bytes_feature(value):
-  """Returns a bytes_list from a string / byte."""
-  return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
-
-
-def _int64_feature(value):
-  """Returns an int64_list from a bool / enum / int / uint."""
-  return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
-
-
 @dataclasses.dataclass
 class Example:
   """Example dataclass."""
@@ -133,157 +188,454 @@ class Example:
   metadata: Json
   policy_table: list[Json]
 
+  def features(self) -> tfrecord_utils.Features:
+    """Returns the tf.Example features of this Example."""
+    return {
+        'input': self.src,
+        'value': self.tgt,
+        'dialog_id': str(self.dialog_id),
+        'turn': self.turn,
+        'frame': self.frame,
+        'service': self.service,
+        'metadata': json.dumps(self.metadata),
+        'policy_table': json.dumps(self.policy_table),
+    }
+
   def build_tf_example(self) -> tf.train.Example:
     """Converts this Example dataclass into a tf.Example."""
-    policy_table_json_str = json.dumps(self.policy_table)
-
-    return tf.train.Example(
-        features=tf.train.Features(
-            feature={
-                'input': _bytes_feature(self.src.encode('utf-8')),
-                'value': _bytes_feature(self.tgt.encode('utf-8')),
-                'dialog_id': _bytes_feature(
-                    str(self.dialog_id).encode('utf-8')
-                ),
-                'turn': _int64_feature(self.turn),
-                'frame': _int64_feature(self.frame),
-                'service': _bytes_feature(self.service.encode('utf-8')),
-                'metadata': _bytes_feature(
-                    json.dumps(self.metadata).encode('utf-8')
-                ),
-                'policy_table': _bytes_feature(
-                    policy_table_json_str.encode('utf-8')
-                ),
-            }
-        )
+    return tfrecord_utils.to_tf_example(self.features())
+
+
+@dataclasses.dataclass(frozen=True)
+class _IntentSignature:
+  """Slot sets of an intent, and the system actions derived from them."""
+
+  required_slots: frozenset[Slot]
+  is_transactional: bool
+  # Actions CONFIRMing all required and optional slots.
+  confirm_actions: frozenset[Action]
+  # Actions OFFERing all offered slots.
+  offer_actions: frozenset[Action]
+  # Actions CONFIRMing all offered slots.
+  confirm_offered_actions: frozenset[Action]
+
+
+class ServicePolicy:
+  """Generic SGD policy of a service, compiled from its schema.
+
+  Intent signatures are indexed by lowercased intent name, and the slot sets
+  and actions which only depend on the schema are computed once, so each
+  recommendation only depends on the dialogue state.
+  """
+
+  def __init__(self, api: Json):
+    """Compiles the policy of the service with schema `api`."""
+    self._intent_signatures = {}
+    # As with a linear scan, the last intent matching a name wins.
+    for intent_sig in api['intents']:
+      required_slots = frozenset(intent_sig['required_slots'])
+      optional_slots = frozenset(intent_sig['optional_slots'])
+      offered_slots = frozenset(intent_sig['offered_slots'])
+      self._intent_signatures[intent_sig['name'].lower()] = _IntentSignature(
+          required_slots=required_slots,
+          is_transactional=intent_sig['is_transactional'],
+          confirm_actions=frozenset(
+              ('CONFIRM', slot) for slot in required_slots | optional_slots
+          ),
+          offer_actions=frozenset(('OFFER', slot) for slot in offered_slots),
+          confirm_offered_actions=frozenset(
+              ('CONFIRM', slot) for slot in offered_slots
+          ),
+      )
+    self._offer_intent_actions = frozenset(
+        ('OFFER_INTENT', intent['name'])
+        for intent in api['intents']
+        if intent['is_transactional']
     )
 
-
-def anytod_policy_function(belief_state, cur_intent, act_hist, api):
-  """Define generic policy function for SGD."""
-  if cur_intent == 'NONE':
-    return set([('GOODBYE', None), ('REQ_MORE', None)])
-
-  # This should not be expected for SGD since the first turn is always a user
-  # turn, more of a safety check.
-  if not act_hist:
-    return set()
-
-  last_turn_user_acts = act_hist[-1]
-
-  # Get the intent signature to obtain required/optional slots etc.
-  intent_signature = None
-  for intent_sig in api['intents']:
-    if intent_sig['name'].lower() == cur_intent.lower():
-      intent_signature = intent_sig
-  if not intent_signature:
-    raise ValueError(f'Intent {cur_intent} not found in schema.')
-
-  required_slots = set(intent_signature['required_slots'])
-  optional_slots = set(intent_signature['optional_slots'])
-  offered_slots = set(intent_signature['offered_slots'])
-  is_transactional = intent_signature['is_transactional']
-
-  # Identify filled and unfilled slots.
-  filled_slots = set(belief_state.keys())
-  last_turn_informed_slots = set()
-  for user_action in last_turn_user_acts:
-    if user_action[0] == 'INFORM':
-      last_turn_informed_slots.add(user_action[1])
-      filled_slots.add(user_action[1])
-  all_required_slots_filled = filled_slots >= required_slots
-  unfilled_required_slots = required_slots - filled_slots
-
-  # Set of recommended system actions to be returned.
-  sys_act_recs = set()
-
-  # Special case somewhat specific to the SGD dataset.
-  num_informs = len(last_turn_informed_slots)
-  has_negate = bool([act for act in last_turn_user_acts if act[0] == 'NEGATE'])
-  # If a user negates a system confirmation for a transactional API and
-  # informs exactly two slots, only those two slots are confirmed again.
-  if (
-      is_transactional
-      and has_negate
-      and all_required_slots_filled
-      and num_informs == 2
-  ):
-    sys_act_recs.update(
-        [('CONFIRM', slot) for slot in last_turn_informed_slots]
-    )
-    return sys_act_recs
-
-  # Else, general graph lookup.
-  for user_action in last_turn_user_acts:
-    act = user_action[0]
-    # If user is informing preferences and an API call can be made.
+  def __call__(
+      self,
+      belief_state: dict[Slot, str],
+      cur_intent: str,
+      act_hist: list[list[Action]],
+  ) -> set[Action]:
+    """Returns the system actions recommended in a dialogue state.
+
+    Args:
+      belief_state: The filled slots.
+      cur_intent: The active intent, or 'NONE'.
+      act_hist: The user and system actions of each previous turn, ending with
+        the last user turn.
+
+    Returns:
+      The recommended system actions.
+    """
+    if cur_intent == 'NONE':
+      return set([('GOODBYE', None), ('REQ_MORE', None)])
+
+    # This should not be expected for SGD since the first turn is always a
+    # user turn, more of a safety check.
+    if not act_hist:
+      return set()
+
+    last_turn_user_acts = act_hist[-1]
+
+    # Get the intent signature to obtain required/optional slots etc.
+    intent_signature = self._intent_signatures.get(cur_intent.lower())
+    if not intent_signature:
+      raise ValueError(f'Intent {cur_intent} not found in schema.')
+    required_slots = intent_signature.required_slots
+    is_transactional = intent_signature.is_transactional
+
+    # Identify filled and unfilled slots.
+    filled_slots = set(belief_state.keys())
+    last_turn_informed_slots = set()
+    for user_action in last_turn_user_acts:
+      if user_action[0] == 'INFORM':
+        last_turn_informed_slots.add(user_action[1])
+        filled_slots.add(user_action[1])
+    all_required_slots_filled = filled_slots >= required_slots
+    unfilled_required_slots = required_slots - filled_slots
+
+    # Set of recommended system actions to be returned.
+    sys_act_recs = set()
+
+    # Special case somewhat specific to the SGD dataset.
+    num_informs = len(last_turn_informed_slots)
+    has_negate = any(act[0] == 'NEGATE' for act in last_turn_user_acts)
+    # If a user negates a system confirmation for a transactional API and
+    # informs exactly two slots, only those two slots are confirmed again.
     if (
-        act in ['INFORM', 'INFORM_INTENT', 'AFFIRM_INTENT']
+        is_transactional
+        and has_negate
         and all_required_slots_filled
+        and num_informs == 2
     ):
-      # For transactional intents, the system confirms all slots, required and
-      # optional.
-      if is_transactional:
-        sys_act_recs.update(
-            [('CONFIRM', slot) for slot in required_slots.union(optional_slots)]
-        )
-      # For non-transactional intents, the system only offers offered slots
-      # that uniquely identify an entity.
-      else:
-        sys_act_recs.update([('OFFER', slot) for slot in offered_slots])
-        sys_act_recs.add(('INFORM_COUNT', None))
-    # There are more required slots to request.
-    elif act in ['INFORM', 'INFORM_INTENT', 'AFFIRM_INTENT']:
       sys_act_recs.update(
-          [('REQUEST', slot) for slot in unfilled_required_slots]
+          [('CONFIRM', slot) for slot in last_turn_informed_slots]
       )
-    # AFFIRM in a transactional API triggers an API call which may fail or
-    # succeed: currently, actions corresponding to both are recommended.
-    elif act == 'AFFIRM':
-      if is_transactional and all_required_slots_filled:
-        sys_act_recs.update([
-            ('NOTIFY_SUCCESS', None),
-            ('NOTIFY_FAILURE', None),
-            ('REQ_MORE', None),
-        ])
-        sys_act_recs.update([('CONFIRM', slot) for slot in offered_slots])
-      # Other than that, AFFIRM behaves similar to INFORM behavior as above.
-      elif all_required_slots_filled:
-        sys_act_recs.update([('OFFER', slot) for slot in offered_slots])
-        sys_act_recs.add(('INFORM_COUNT', None))
-      else:
+      return sys_act_recs
+
+    # Else, general graph lookup.
+    for user_action in last_turn_user_acts:
+      act = user_action[0]
+      # If user is informing preferences and an API call can be made.
+      if (
+          act in ('INFORM', 'INFORM_INTENT', 'AFFIRM_INTENT')
+          and all_required_slots_filled
+      ):
+        # For transactional intents, the system confirms all slots, required
+        # and optional.
+        if is_transactional:
+          sys_act_recs.update(intent_signature.confirm_actions)
+        # For non-transactional intents, the system only offers offered slots
+        # that uniquely identify an entity.
+        else:
+          sys_act_recs.update(intent_signature.offer_actions)
+          sys_act_recs.add(('INFORM_COUNT', None))
+      # There are more required slots to request.
+      elif act in ('INFORM', 'INFORM_INTENT', 'AFFIRM_INTENT'):
         sys_act_recs.update(
             [('REQUEST', slot) for slot in unfilled_required_slots]
         )
-    # User requesting a slot value.
-    elif act == 'REQUEST':
-      sys_act_recs.add(('INFORM', user_action[1]))
-    # User requesting alternate options. If alternate options exist, the
-    # system OFFERs them, else the call fails. Currently both sets of actions
-    # are recommended.
-    elif act == 'REQUEST_ALTS':
-      sys_act_recs.update([('OFFER', slot) for slot in offered_slots])
-      sys_act_recs.update([('NOTIFY_FAILURE', None), ('REQ_MORE', None)])
-      if not is_transactional:
-        sys_act_recs.add(('INFORM_COUNT', None))
-    # If the user negates the system confirmation (in transactional APIs).
-    elif act == 'NEGATE':
-      sys_act_recs.add(('REQ_MORE', None))
-    # User says bye.
-    elif act == 'GOODBYE':
-      sys_act_recs.add(('GOODBYE', None))
-    # User is done, system asks if they need something else.
-    elif act == 'THANK_YOU':
-      sys_act_recs.add(('REQ_MORE', None))
-    # SELECT may mean recommending a booking intent, or just the system asking
-    # if the user needs something else.
-    elif act == 'SELECT' and not is_transactional:
-      sys_act_recs.add(('REQ_MORE', None))
-      for intent in api['intents']:
-        if intent['is_transactional']:
-          sys_act_recs.add(('OFFER_INTENT', intent['name']))
-
-  return sys_act_recs
+      # AFFIRM in a transactional API triggers an API call which may fail or
+      # succeed: currently, actions corresponding to both are recommended.
+      elif act == 'AFFIRM':
+        if is_transactional and all_required_slots_filled:
+          sys_act_recs.update([
+              ('NOTIFY_SUCCESS', None),
+              ('NOTIFY_FAILURE', None),
+              ('REQ_MORE', None),
+          ])
+          sys_act_recs.update(intent_signature.confirm_offered_actions)
+        # Other than that, AFFIRM behaves similar to INFORM behavior as above.
+        elif all_required_slots_filled:
+          sys_act_recs.update(intent_signature.offer_actions)
+          sys_act_recs.add(('INFORM_COUNT', None))
+        else:
+          sys_act_recs.update(
+              [('REQUEST', slot) for slot in unfilled_required_slots]
+          )
+      # User requesting a slot value.
+      elif act == 'REQUEST':
+        sys_act_recs.add(('INFORM', user_action[1]))
+      # User requesting alternate options. If alternate options exist, the
+      # system OFFERs them, else the call fails. Currently both sets of
+      # actions are recommended.
+      elif act == 'REQUEST_ALTS':
+        sys_act_recs.update(intent_signature.offer_actions)
+        sys_act_recs.update([('NOTIFY_FAILURE', None), ('REQ_MORE', None)])
+        if not is_transactional:
+          sys_act_recs.add(('INFORM_COUNT', None))
+      # If the user negates the system confirmation (in transactional APIs).
+      elif act == 'NEGATE':
+        sys_act_recs.add(('REQ_MORE', None))
+      # User says bye.
+      elif act == 'GOODBYE':
+        sys_act_recs.add(('GOODBYE', None))
+      # User is done, system asks if they need something else.
+      elif act == 'THANK_YOU':
+        sys_act_recs.add(('REQ_MORE', None))
+      # SELECT may mean recommending a booking intent, or just the system
+      # asking if the user needs something else.
+      elif act == 'SELECT' and not is_transactional:
+        sys_act_recs.add(('REQ_MORE', None))
+        sys_act_recs.update(self._offer_intent_actions)
+
+    return sys_act_recs
+
+  def recommend_batch(
+      self,
+      states: Iterable[tuple[dict[Slot, str], str, list[list[Action]]]],
+  ) -> list[set[Action]]:
+    """Returns the recommended system actions of many dialogue states.
+
+    Args:
+      states: (belief_state, cur_intent, act_hist) tuples, see `__call__`.
+
+    Returns:
+      The recommended system actions of each state, in order.
+    """
+    return [
+        self(belief_state, cur_intent, act_hist)
+        for belief_state, cur_intent, act_hist in states
+    ]
+
+
+class ServiceStateTracker:
+  """Incrementally tracks the dialogue state of a single service.
+
+  User and system turns are added as they stream in, alternating and starting
+  with a user turn. The active intent is updated with each turn, so querying
+  the state takes constant time, e.g. to serve the policy online.
+
+  Attributes:
+    belief_state: The filled slots, as of the last user turn.
+    act_hist: The actions of each turn.
+    cur_intent: The active intent, or 'NONE'.
+  """
+
+  def __init__(self):
+    self.belief_state: dict[Slot, str] = {}
+    self.act_hist: list[list[Action]] = []
+    self.cur_intent = 'NONE'
+
+  def _add_turn(self, acts: list[Action]) -> None:
+    """Appends a turn's actions, updating the intent by its first intent act."""
+    prev_acts = self.act_hist[-1] if self.act_hist else []
+    for act in acts:
+      if act[0] in ('INFORM_INTENT', 'AFFIRM_INTENT'):
+        self.cur_intent = act[1]
+        break
+      elif act[0] == 'NEGATE_INTENT':
+        self.cur_intent = 'NONE'
+        break
+      elif act[0] in ('THANK_YOU', 'GOODBYE') and any(
+          a[0] == 'REQ_MORE' for a in prev_acts
+      ):
+        # This should be NEGATE, but we filter out this action. If the last
+        # turn had REQ_MORE, i.e. if the system asked if the user needs
+        # anything else, and they said no.
+        self.cur_intent = 'NONE'
+        break
+    self.act_hist.append(acts)
+
+  def add_user_turn(
+      self,
+      acts: list[Action],
+      belief_state: Optional[dict[Slot, str]] = None,
+  ) -> None:
+    """Adds a user turn, and its belief state if given."""
+    self._add_turn(acts)
+    if belief_state is not None:
+      self.belief_state = belief_state
+
+  def add_system_turn(self, acts: list[Action]) -> None:
+    self._add_turn(acts)
+
+  def recommend(self, policy: ServicePolicy) -> set[Action]:
+    """Returns the system actions recommended by `policy` in this state."""
+    return policy(self.belief_state, self.cur_intent, self.act_hist)
+
+
+def anytod_policy_function(belief_state, cur_intent, act_hist, api):
+  """Define generic policy function for SGD.
+
+  Compiles the policy for a single call; use a `ServicePolicy` to evaluate
+  many states of the same service.
+
+  Args:
+    belief_state: The filled slots.
+    cur_intent: The active intent, or 'NONE'.
+    act_hist: The user and system actions of each previous turn.
+    api: The schema of the service.
+
+  Returns:
+    The recommended system actions.
+  """
+  return ServicePolicy(api)(belief_state, cur_intent, act_hist)
+
+
+@dataclasses.dataclass(frozen=True)
+class _Prompt:
+  """Orderings of a frame's prompt and its rendered schema sections."""
+
+  slot_ord: Ordering[Slot]
+  # Orderings of the lowercased values of categorical slots only.
+  cat_val_ord: dict[Slot, Ordering[str]]
+  useract_ord: Ordering[Action]
+  sysact_ord: Ordering[Action]
+  bs_src: str
+  useract_src: str
+  sysact_src: str
+
+
+class _PromptCompiler:
+  """Renders the schema sections of the prompts of a service.
+
+  Descriptions are rendered once per slot index and cached, so compiling a
+  prompt only draws the permutations and joins rendered pieces. Without
+  shuffling, all prompts of the service are identical and compiled once.
+  """
+
+  # Types of the actions whose descriptions refer to a slot by its index.
+  _USERACT_SLOT_ACTS = ('INFORM', 'REQUEST')
+  _SYSACT_SLOT_ACTS = ('INFORM', 'REQUEST', 'CONFIRM', 'OFFER')
+
+  def __init__(
+      self,
+      slot_descs: dict[Slot, str],
+      cat_vals: dict[Slot, list[str]],
+      useract_descs: dict[Action, str],
+      sysact_descs: dict[Action, str],
+      shuffle: bool,
+  ):
+    """Initializes the compiler.
+
+    Args:
+      slot_descs: Descriptions of all slots, in schema order.
+      cat_vals: Possible values of the categorical slots, in schema order.
+      useract_descs: Descriptions of all user actions, in order.
+      sysact_descs: Descriptions of all system actions, in order.
+      shuffle: Whether to shuffle the orderings of each prompt.
+    """
+    self._slot_descs = slot_descs
+    self._cat_vals = {
+        slot: [v.lower() for v in vals] for slot, vals in cat_vals.items()
+    }
+    self._useract_descs = useract_descs
+    self._sysact_descs = sysact_descs
+    self._shuffle = shuffle
+    # (tag, action, slot index) -> rendered description.
+    self._rendered_descs = {}
+    self._fixed_prompt = None
+
+  def _ordering(
+      self, entities: Iterable[T], rng: Optional[random.Random]
+  ) -> Ordering[T]:
+    idx_to_entity = list(entities)
+    if self._shuffle:
+      (rng or random).shuffle(idx_to_entity)
+    return Ordering.from_ordered(idx_to_entity)
+
+  def _render_acts(
+      self,
+      tag: str,
+      act_ord: Ordering[Action],
+      descs: dict[Action, str],
+      slot_acts: tuple[str, ...],
+      slot_ord: Ordering[Slot],
+  ) -> str:
+    """Renders the descriptions of actions, e.g. "u0=...; u1=..."."""
+    pieces = []
+    for i, act in act_ord:
+      desc = descs[act]
+      if act[0] in slot_acts:
+        key = (tag, act, slot_ord.get_idx(act[1]))
+        rendered_desc = self._rendered_descs.get(key)
+        if rendered_desc is None:
+          rendered_desc = desc.format(slot_ind=f'p{key[2]}')
+          self._rendered_descs[key] = rendered_desc
+        desc = rendered_desc
+      pieces.append(f'{tag}{i}={desc}')
+    return '; '.join(pieces)
+
+  def compile(self, rng: Optional[random.Random] = None) -> _Prompt:
+    """Returns a prompt, drawing its permutations from `rng` if shuffled.
+
+    The permutations are drawn in the order slots, categorical values of each
+    slot, user actions and system actions.
+
+    Args:
+      rng: Random generator. If None, the global random generator is used.
+
+    Returns:
+      The prompt. It is shared with other calls, and must not be modified.
+    """
+    if self._fixed_prompt is not None:
+      return self._fixed_prompt
+    slot_ord = self._ordering(self._slot_descs, rng)
+    cat_val_ord = {
+        slot: self._ordering(vals, rng) for slot, vals in self._cat_vals.items()
+    }
+    useract_ord = self._ordering(self._useract_descs, rng)
+    sysact_ord = self._ordering(self._sysact_descs, rng)
+
+    bs_src = []
+    for i, slot in slot_ord:
+      bs_src_piece = [f'p{i}={self._slot_descs[slot]}']
+      if slot in cat_val_ord:
+        for j, cat_val in cat_val_ord[slot]:
+          bs_src_piece.append(f'{j}) {cat_val}')
+      bs_src.append(' '.join(bs_src_piece))
+
+    prompt = _Prompt(
+        slot_ord=slot_ord,
+        cat_val_ord=cat_val_ord,
+        useract_ord=useract_ord,
+        sysact_ord=sysact_ord,
+        bs_src='; '.join(bs_src),
+        useract_src=self._render_acts(
+            'u',
+            useract_ord,
+            self._useract_descs,
+            self._USERACT_SLOT_ACTS,
+            slot_ord,
+        ),
+        sysact_src=self._render_acts(
+            's',
+            sysact_ord,
+            self._sysact_descs,
+            self._SYSACT_SLOT_ACTS,
+            slot_ord,
+        ),
+    )
+    if not self._shuffle:
+      self._fixed_prompt = prompt
+    return prompt
+
+
+def _dialog_rng(seed: Optional[int], dialog_id: str) -> Optional[random.Random]:
+  """Returns the random generator shuffling a dialog's orderings."""
+  if seed is None:
+    return None
+  # String seeds are hashed deterministically, unlike hash().
+  return random.Random(f'{seed}/{dialog_id}')
+
+
+# Converter used by the current worker process, see `_init_worker`.
+_worker_converter = None
+
+
+def _init_worker(converter: 'Converter') -> None:
+  global _worker_converter
+  _worker_converter = converter
+
+
+def _convert_chunk_in_worker(
+    dialog_jsons: list[Json],
+) -> tuple[list['Example'], int, int]:
+  return _worker_converter.convert_chunk(dialog_jsons)
 
 
 class Converter:
@@ -297,13 +649,29 @@ class Converter:
       shuffle: bool,
       use_cat_slots: bool,
       fix_tags: bool,
+      seed: Optional[int] = None,
   ):
+    """Initializes the converter and gathers the actions of all dialogs.
+
+    Args:
+      dialog_jsons: The dialogs to convert.
+      schema: The schema of the dialogs' services.
+      mode: The format of the examples.
+      shuffle: Whether to shuffle the orderings of slots, values and actions.
+      use_cat_slots: Whether to list the values of categorical slots.
+      fix_tags: Whether to use fixed tags.
+      seed: If set, each dialog's orderings are shuffled with a seed derived
+        from this seed and the dialog ID, so they don't depend on the order in
+        which, or the process by which, dialogs are converted. If None, the
+        global random generator is used.
+    """
     self._dialog_jsons = dialog_jsons
     self._schema = schema
     self._mode = mode
     self._shuffle = shuffle
     self._use_cat_slots = use_cat_slots
     self._fix_tags = fix_tags
+    self._seed = seed
     self._total_turns = 0
     self._total_turns_correct = 0
 
@@ -324,10 +692,17 @@ class Converter:
             'description'
         ]
 
+    self._policies = {
+        service: ServicePolicy(service_json)
+        for service, service_json in self._services.items()
+    }
+
     self._build_acts()
     # TODO(jeffreyzhao): Inferring policy graph currently unused.
     # self._build_graph()
 
+    self._prompt_compilers = {}
+
   # # TODO(jeffreyzhao): AnyTOD natural language format.
   # def convert_to_anytodnl_format(dialog_json: Json, split: str, schema: Json):
   #   service_jsons = {}
@@ -546,6 +921,38 @@ class Converter:
         raise ValueError(f'Unknown action {act}')
     return ret, sysact_descs
 
+  def _get_prompt_compiler(self, service: str) -> _PromptCompiler:
+    """Returns the prompt compiler of a service, creating it on first use."""
+    if service not in self._prompt_compilers:
+      self._prompt_compilers[service] = _PromptCompiler(
+          self._slot_descs[service],
+          {
+              slot: vals
+              for slot, vals in self._slot_cat_vals[service].items()
+              if self._is_categ_slot(service, slot)
+          },
+          {
+              useract: self._frame_useract_descs[service][useract]
+              for useract in self._frame_useracts[service]
+          },
+          {
+              sysact: self._frame_sysact_descs[service][sysact]
+              for sysact in self._frame_sysacts[service]
+          },
+          self._shuffle,
+      )
+    return self._prompt_compilers[service]
+
+  def _is_categ_slot(self, service: str, slot: Slot) -> bool:
+    """Whether the possible values of a slot are listed in prompts."""
+    if not self._use_cat_slots:
+      return False
+    if service == 'Restaurants_1' and slot == 'cuisine':
+      # Has a lot of values that aren't listed in schema.
+      return False
+    poss_vals = self._slot_cat_vals[service][slot]
+    return bool(poss_vals) and not all([v.isdigit() for v in poss_vals])
+
   def _mode_is_zombie(self) -> bool:
     return 'zombie' in self._mode.value
 
@@ -629,25 +1036,18 @@ class Converter:
   def _convert_anytodog(self, dialog_json: Json) -> list[Example]:
     """Converts a single dialog JSON into per-turn per-frame examples."""
     examples = []
-    convo_hist = []
-    frame_act_hist = collections.defaultdict(list)
+    rng = _dialog_rng(self._seed, dialog_json['dialogue_id'])
+    convo_hist = history_utils.DialogueHistory()
+    trackers = collections.defaultdict(ServiceStateTracker)
+    # service -> (prompt, rendered turns of the tracker's action history),
+    # reused while the prompt, and hence its orderings, stay the same.
+    rendered_act_hists = {}
     # turn -> service -> frame_json
     frame_json_hist = collections.defaultdict(dict)
 
-    def _is_categ_slot(service, slot):
-      if not self._use_cat_slots:
-        return False
-      if service == 'Restaurants_1' and slot == 'cuisine':
-        # Has a lot of values that aren't listed in schema.
-        return False
-      poss_vals = self._slot_cat_vals[service][slot]
-      return poss_vals and not all([v.isdigit() for v in poss_vals])
-
     for turn, turn_json in enumerate(dialog_json['turns']):
       speaker, utt = turn_json['speaker'], turn_json['utterance']
-      convo_str = ' '.join(  # pylint: disable=unused-variable
-          f'[ {speaker} ] {utt}' for speaker, utt in convo_hist
-      )
+      convo_str = convo_hist.render()
 
       if speaker == 'SYSTEM':
         for frame, frame_json in enumerate(turn_json['frames']):
@@ -661,27 +1061,16 @@ class Converter:
           bs = {}
           for slot, val in last_user_frame_json['state']['slot_values'].items():
             bs[slot] = val[0]
-          all_slots = list(self._slot_descs[service].keys())
-          slot_ord = Ordering(all_slots, self._shuffle)
-          cat_val_ord = {
-              slot: Ordering([cv.lower() for cv in cat_vals], self._shuffle)
-              for slot, cat_vals in self._slot_cat_vals[service].items()
-          }
-          bs_src = []
+          prompt = self._get_prompt_compiler(service).compile(rng)
+          slot_ord = prompt.slot_ord
+          cat_val_ord = prompt.cat_val_ord
+          bs_src = prompt.bs_src
           bs_tgt = []
           for i, slot in slot_ord:
-            slot_desc = self._slot_descs[service][slot]
-            bs_src_piece = [f'p{i}={slot_desc}']
-
-            if _is_categ_slot(service, slot):
-              for j, cat_val in cat_val_ord[slot]:
-                bs_src_piece.append(f'{j}) {cat_val}')
-            bs_src.append(' '.join(bs_src_piece))
-
             val = bs.get(slot, None)
             if val:
               val = val.lower()
-              if _is_categ_slot(service, slot):
+              if slot in cat_val_ord:
                 if val == 'dontcare':
                   # Allow dontcare as a value for categorical slots.
                   # TODO(jeffreyzhao): May need to reconsider this.
@@ -696,29 +1085,25 @@ class Converter:
                   )
                   continue
               bs_tgt.append(f'p{i}={val}')
-          bs_src = '; '.join(bs_src)
           bs_tgt = '; '.join(bs_tgt)
 
-          all_useracts = list(self._frame_useracts[service])
-          useract_ord = Ordering(all_useracts, self._shuffle)
-          all_sysacts = list(self._frame_sysacts[service])
-          sysact_ord = Ordering(all_sysacts, self._shuffle)
-
-          useract_src = []
-          for i, useract in useract_ord:
-            useract_desc = self._frame_useract_descs[service][useract]
-            if useract[0] in ('INFORM', 'REQUEST'):
-              slot_ind = slot_ord.get_idx(useract[1])
-              useract_desc = useract_desc.format(slot_ind=f'p{slot_ind}')
-            useract_src.append(f'u{i}={useract_desc}')
-          useract_src = '; '.join(useract_src)
+          useract_ord = prompt.useract_ord
+          sysact_ord = prompt.sysact_ord
+          useract_src = prompt.useract_src
           tgt_useracts, _ = self._get_useracts(
               last_sys_frame_json, last_user_frame_json
           )
+          tracker = trackers[service]
           if self._mode_is_zombie_hist():
-            frame_act_hist[service].append(tgt_useracts)
-            act_hist_inds = []
-            for i, acts in enumerate(frame_act_hist[service]):
+            tracker.add_user_turn(tgt_useracts, bs)
+            cached_prompt, act_hist_inds = rendered_act_hists.get(
+                service, (None, [])
+            )
+            if cached_prompt is not prompt:
+              act_hist_inds = []
+            rendered_act_hists[service] = (prompt, act_hist_inds)
+            for i in range(len(act_hist_inds), len(tracker.act_hist)):
+              acts = tracker.act_hist[i]
               if i % 2 == 0:
                 useract_inds = [useract_ord.get_idx(ua) for ua in acts]
                 useract_inds.sort()
@@ -735,58 +1120,21 @@ class Converter:
             useract_tgt_inds.sort()
             useract_tgt = '; '.join(f'u{i}' for i in useract_tgt_inds)
 
-          sysact_src = []
-          for i, sysact in sysact_ord:
-            sysact_desc = self._frame_sysact_descs[service][sysact]
-            if sysact[0] in ('INFORM', 'REQUEST', 'CONFIRM', 'OFFER'):
-              slot_ind = slot_ord.get_idx(sysact[1])
-              sysact_desc = sysact_desc.format(slot_ind=f'p{slot_ind}')
-            sysact_src.append(f's{i}={sysact_desc}')
+          sysact_src = prompt.sysact_src
           tgt_sysacts, _ = self._get_sysacts(frame_json)
           sysact_tgt_inds = [sysact_ord.get_idx(ua) for ua in tgt_sysacts]
           sysact_tgt_inds.sort()
-          sysact_src = '; '.join(sysact_src)
           sysact_tgt = ' '.join(f's{i}' for i in sysact_tgt_inds)
 
           # Generate recommended system actions.
           self._total_turns += 1
 
           gt_intent = last_user_frame_json['state']['active_intent']
-          cur_intent = 'NONE'
-          for i in range(len(frame_act_hist[service]) - 1, -1, -1):
-            turn_acts = frame_act_hist[service][i]
-            done = False
-            for act in turn_acts:
-              if act[0] in ['INFORM_INTENT', 'AFFIRM_INTENT']:
-                cur_intent = act[1]
-                done = True
-              elif act[0] == 'NEGATE_INTENT':
-                cur_intent = 'NONE'
-                done = True
-              elif (
-                  # This should be NEGATE, but we filter out this action
-                  act[0] in ('THANK_YOU', 'GOODBYE')
-                  and i > 0
-                  and any(
-                      a[0] == 'REQ_MORE' for a in frame_act_hist[service][i - 1]
-                  )
-              ):
-                # If user is doing NEGATE and last system turn had REQ_MORE
-                # i.e. if the system asked if the user need anything else, and
-                # they said no
-                cur_intent = 'NONE'
-                done = True
-              if done:
-                break
-            if done:
-              break
+          cur_intent = tracker.cur_intent
           assert cur_intent == gt_intent
 
-          sys_act_recs = anytod_policy_function(
-              bs,
-              cur_intent,
-              frame_act_hist[service],
-              self._services[service],
+          sys_act_recs = self._policies[service](
+              bs, cur_intent, tracker.act_hist
           )
           if set(sys_act_recs).issuperset(set(tgt_sysacts)):
             self._total_turns_correct += 1
@@ -799,12 +1147,12 @@ class Converter:
           sysact_recs_src = ' '.join(f's{i}' for i in sysact_recs_inds)
 
           if self._mode_is_zombie_hist():
-            frame_act_hist[service].append(tgt_sysacts)
+            tracker.add_system_turn(tgt_sysacts)
 
           act_hist_tag = '[ history ]' if self._fix_tags else '[ user actions ]'
           select_tag = '[ select ]' if self._fix_tags else '[ system actions ]'
 
-          if _MODE.value == Mode.ZOMBIE_HISTORY_2PASS:
+          if self._mode == Mode.ZOMBIE_HISTORY_2PASS:
             inp = (
                 f'[ params ] {bs_src} [ user actions ] {useract_src} '
                 f'[ system actions ] {sysact_src} [ conversation ] {convo_str}'
@@ -849,20 +1197,20 @@ class Converter:
                 )
             )
           else:
-            if _MODE.value == Mode.ZOMBIE:
+            if self._mode == Mode.ZOMBIE:
               inp = (
                   f'[ params ] {bs_src} [ user actions ]  {useract_src} ['
                   f' system actions ] {sysact_src} [ conversation ] {convo_str}'
               )
               val = f'[ belief state ] {bs_tgt} {act_hist_tag} {useract_tgt}'
-            elif _MODE.value == Mode.ZOMBIE_HISTORY:
+            elif self._mode == Mode.ZOMBIE_HISTORY:
               inp = (
                   f'[ params ] {bs_src} [ user actions ] {useract_src} '
                   f'[ system actions ] {sysact_src} [ conversation ] '
                   f'{convo_str}'
               )
               val = f'[ belief state ] {bs_tgt} {act_hist_tag} {act_hist_tgt}'
-            elif _MODE.value == Mode.ZOMBIE_HISTORY_2PASS_2NDONLY:
+            elif self._mode == Mode.ZOMBIE_HISTORY_2PASS_2NDONLY:
               inp = (
                   f'[ params ] {bs_src} [ user actions ] {useract_src} '
                   f'[ system actions ] {sysact_src} [ conversation ] '
@@ -873,7 +1221,7 @@ class Converter:
                   f'{select_tag} {sysact_tgt} [ response ] '
                   f'[ {speaker.lower()} ] {utt}'
               )
-            elif _MODE.value == Mode.ZOMBIE_HISTORY_2PASS_EVAL:
+            elif self._mode == Mode.ZOMBIE_HISTORY_2PASS_EVAL:
               inp = (
                   f'[ params ] {bs_src} [ user actions ] {useract_src} '
                   f'[ system actions ] {sysact_src} [ conversation ] '
@@ -908,18 +1256,77 @@ class Converter:
                 )
             )
 
-      convo_hist.append((speaker, utt))
+      convo_hist.append(f'[ {speaker} ] {utt}')
       for frame, frame_json in enumerate(turn_json['frames']):
         service = frame_json['service']
         frame_json_hist[turn][service] = frame_json
 
     return examples
 
-  def convert_to_anytodog_format(self) -> list[Example]:
-    """Top-level function to convert data to AnyTOD format."""
+  def convert_chunk(
+      self, dialog_jsons: list[Json]
+  ) -> tuple[list[Example], int, int]:
+    """Converts dialogs, counting turns separately from other conversions.
+
+    Args:
+      dialog_jsons: The dialogs to convert.
+
+    Returns:
+      The examples of the dialogs, the number of converted system turns, and
+      the number of them whose actions the policy function recommended.
+    """
+    total_turns, total_turns_correct = (
+        self._total_turns,
+        self._total_turns_correct,
+    )
+    examples = []
+    for d in dialog_jsons:
+      examples.extend(self._convert_anytodog(d))
+    return (
+        examples,
+        self._total_turns - total_turns,
+        self._total_turns_correct - total_turns_correct,
+    )
+
+  def _worker_copy(self) -> 'Converter':
+    """Returns a copy sharing the gathered actions, but no dialogs."""
+    converter = copy.copy(self)
+    converter._dialog_jsons = []
+    return converter
+
+  def convert_to_anytodog_format(self, num_workers: int = 1) -> list[Example]:
+    """Top-level function to convert data to AnyTOD format.
+
+    Args:
+      num_workers: Number of processes converting chunks of dialogs. Each
+        worker receives a copy of the actions gathered by `_build_acts` once,
+        and the turn counters of all chunks are merged. Examples are returned
+        in the same order as with a single process.
+
+    Returns:
+      The examples of all dialogs.
+    """
+    chunks = [
+        self._dialog_jsons[i : i + _CHUNK_SIZE]
+        for i in range(0, len(self._dialog_jsons), _CHUNK_SIZE)
+    ]
+    num_workers = min(num_workers, len(chunks))
+    if num_workers <= 1:
+      results = map(self.convert_chunk, chunks)
+    else:
+      pool = futures.ProcessPoolExecutor(
+          num_workers,
+          initializer=_init_worker,
+          initargs=(self._worker_copy(),),
+      )
+      with pool:
+        results = list(pool.map(_convert_chunk_in_worker, chunks))
+      self._total_turns += sum(total_turns for _, total_turns, _ in results)
+      self._total_turns_correct += sum(correct for _, _, correct in results)
+
     ret = []
-    for d in self._dialog_jsons:
-      ret.extend(self._convert_anytodog(d))
+    for examples, _, _ in results:
+      ret.extend(examples)
 
     print(
         '%d out of %d turns had the recommended system actions be a'
@@ -931,9 +1338,22 @@ class Converter:
 
 
 def main(_):
+  reporter = progress_utils.ProgressReporter(
+      'create_sgd_anytod_data', num_verbose_examples=_VERBOSE_EXAMPLES.value
+  )
+  seed = _SEED.value
+  if seed is None:
+    seed = random.getrandbits(32)
+    logging.info(
+        'Using random seed %d, pass --seed=%d to reproduce.', seed, seed
+    )
   split_to_exs = {}
   for split in ['train', 'dev', 'test']:
-    dialogs, schema = load_sgd_data(os.path.join(_INPUT_DIR.value, split))
+    with reporter.stage('load'):
+      dialogs, schema = load_sgd_data(
+          os.path.join(_INPUT_DIR.value, split),
+          _USE_CACHE.value,
+      )
     converter = Converter(
         dialogs,
         schema,
@@ -941,23 +1361,29 @@ def main(_):
         _SHUFFLE.value,
         _CAT_SLOTS.value,
         _FIX_TAGS.value,
+        seed,
     )
-    examples = converter.convert_to_anytodog_format()
+    with reporter.stage('convert'):
+      examples = converter.convert_to_anytodog_format(_NUM_WORKERS.value)
+    reporter.add_dialogues(len(dialogs))
     if _SHUFFLE.value and split == 'train':
-      random.shuffle(examples)
+      random.Random(seed).shuffle(examples)
     split_to_exs[split] = examples
 
   split_to_exs['devtest'] = split_to_exs['dev'] + split_to_exs['test']
   split_to_exs['devsample'] = split_to_exs['dev'][:2048]
 
-  tf.io.gfile.makedirs(_OUTPUT_DIR.value)
   for split, exs in split_to_exs.items():
-    with tf.io.TFRecordWriter(
-        os.path.join(_OUTPUT_DIR.value, f'{split}.tfrecord')
-    ) as rw:
-      for ex in exs:
-        rw.write(ex.build_tf_example().SerializeToString())
+    with reporter.stage('write'):
+      tfrecord_utils.write_examples(
+          (ex.features() for ex in exs),
+          os.path.join(_OUTPUT_DIR.value, f'{split}.tfrecord'),
+          num_shards=_NUM_SHARDS.value,
+          num_workers=_NUM_WORKERS.value,
+          reporter=reporter,
+      )
       print(f'Write {len(exs)} examples to {split}')
+  reporter.log_progress()
 
 
 if __name__ == '__main__':
@@ -16,6 +16,8 @@
 
 import json
 import os
+import random
+from unittest import mock
 
 from absl import flags
 from absl.testing import parameterized
@@ -108,6 +110,155 @@ class CreateSgdAnytodDataTest(parameterized.TestCase):
     for exp, act in zip(expected, actual):
       self.assertDictEqual(exp, act)
 
+  def test_generate_data_in_parallel(self):
+    dialogs, schema = self._load_testdata()
+
+    def _convert(num_workers):
+      converter = create_sgd_anytod_data.Converter(
+          dialogs,
+          schema,
+          create_sgd_anytod_data.Mode.ZOMBIE_HISTORY_2PASS,
+          True,
+          True,
+          False,
+          seed=7,
+      )
+      examples = converter.convert_to_anytodog_format(num_workers)
+      return (
+          [ex.features() for ex in examples],
+          converter._total_turns,
+          converter._total_turns_correct,
+      )
+
+    with mock.patch.object(create_sgd_anytod_data, '_CHUNK_SIZE', 1):
+      serial = _convert(1)
+      parallel = _convert(2)
+    self.assertNotEmpty(serial[0])
+    self.assertGreater(serial[1], 0)
+    self.assertEqual(serial, parallel)
+
+  def test_prompt_compiler(self):
+    def _compiler(shuffle):
+      return create_sgd_anytod_data._PromptCompiler(
+          {'city': 'city of the event', 'seats': 'number of seats'},
+          {'seats': ['One', 'Two', 'Three']},
+          {
+              ('INFORM', 'city'): 'user is informing {slot_ind}',
+              ('THANK_YOU', None): 'user is saying thanks',
+          },
+          {('REQUEST', 'seats'): 'request {slot_ind} from the user'},
+          shuffle,
+      )
+
+    compiler = _compiler(False)
+    prompt = compiler.compile()
+    self.assertIs(compiler.compile(), prompt)
+    self.assertEqual(
+        prompt.bs_src, 'p0=city of the event; p1=number of seats 0) one '
+        '1) two 2) three'
+    )
+    self.assertEqual(
+        prompt.useract_src,
+        'u0=user is informing p0; u1=user is saying thanks',
+    )
+    self.assertEqual(prompt.sysact_src, 's0=request p1 from the user')
+
+    compiler = _compiler(True)
+    for seed in range(10):
+      prompt = compiler.compile(random.Random(seed))
+      self.assertEqual(
+          compiler.compile(random.Random(seed)).bs_src, prompt.bs_src
+      )
+      seats_ind = prompt.slot_ord.get_idx('seats')
+      self.assertEqual(
+          prompt.sysact_src, f's0=request p{seats_ind} from the user'
+      )
+      self.assertIn(
+          f'{prompt.cat_val_ord["seats"].get_idx("two")}) two', prompt.bs_src
+      )
+
+  def test_service_state_tracker(self):
+    tracker = create_sgd_anytod_data.ServiceStateTracker()
+    self.assertEqual(tracker.cur_intent, 'NONE')
+    tracker.add_user_turn([('INFORM_INTENT', 'FindRestaurants')], {'a': 'b'})
+    self.assertEqual(tracker.cur_intent, 'FindRestaurants')
+    self.assertEqual(tracker.belief_state, {'a': 'b'})
+    tracker.add_system_turn([('OFFER_INTENT', 'ReserveRestaurant')])
+    tracker.add_user_turn([('AFFIRM_INTENT', 'ReserveRestaurant')])
+    self.assertEqual(tracker.cur_intent, 'ReserveRestaurant')
+    self.assertEqual(tracker.belief_state, {'a': 'b'})
+    # Thanks only end the intent after the system asked for anything else.
+    tracker.add_system_turn([('NOTIFY_SUCCESS', None)])
+    tracker.add_user_turn([('THANK_YOU', None)])
+    self.assertEqual(tracker.cur_intent, 'ReserveRestaurant')
+    tracker.add_system_turn([('REQ_MORE', None)])
+    tracker.add_user_turn([('THANK_YOU', None), ('INFORM_INTENT', 'Other')])
+    self.assertEqual(tracker.cur_intent, 'NONE')
+    self.assertLen(tracker.act_hist, 7)
+    policy = create_sgd_anytod_data.ServicePolicy({'intents': []})
+    self.assertEqual(
+        tracker.recommend(policy), {('GOODBYE', None), ('REQ_MORE', None)}
+    )
+
+  def test_service_policy(self):
+    api = {
+        'intents': [
+            {
+                'name': 'FindRestaurants',
+                'required_slots': ['city', 'cuisine'],
+                'optional_slots': ['price'],
+                'offered_slots': ['restaurant_name'],
+                'is_transactional': False,
+            },
+            {
+                'name': 'ReserveRestaurant',
+                'required_slots': ['restaurant_name', 'time'],
+                'optional_slots': ['seats'],
+                'offered_slots': [],
+                'is_transactional': True,
+            },
+        ]
+    }
+    policy = create_sgd_anytod_data.ServicePolicy(api)
+    states = [
+        ({}, 'NONE', [[('GOODBYE', None)]]),
+        ({'city': 'SF'}, 'findrestaurants', [[('INFORM_INTENT', 'x')]]),
+        ({'city': 'SF'}, 'FindRestaurants', [[('INFORM', 'cuisine')]]),
+        ({'city': 'SF', 'cuisine': 'Thai'}, 'FindRestaurants', [[
+            ('SELECT', None)
+        ]]),
+        ({'restaurant_name': 'A', 'time': '7'}, 'ReserveRestaurant', [[
+            ('AFFIRM', None)
+        ]]),
+        ({}, 'ReserveRestaurant', [[
+            ('NEGATE', None),
+            ('INFORM', 'restaurant_name'),
+            ('INFORM', 'time'),
+        ]]),
+    ]
+    expected = [
+        {('GOODBYE', None), ('REQ_MORE', None)},
+        {('REQUEST', 'cuisine')},
+        {('OFFER', 'restaurant_name'), ('INFORM_COUNT', None)},
+        {('REQ_MORE', None), ('OFFER_INTENT', 'ReserveRestaurant')},
+        {
+            ('NOTIFY_SUCCESS', None),
+            ('NOTIFY_FAILURE', None),
+            ('REQ_MORE', None),
+        },
+        {('CONFIRM', 'restaurant_name'), ('CONFIRM', 'time')},
+    ]
+    self.assertEqual(policy.recommend_batch(states), expected)
+    self.assertEqual(
+        [
+            create_sgd_anytod_data.anytod_policy_function(*state, api)
+            for state in states
+        ],
+        expected,
+    )
+    with self.assertRaises(ValueError):
+      policy({}, 'BookHotel', [[('INFORM', 'city')]])
+
 
 if __name__ == '__main__':
   tf.test.main()
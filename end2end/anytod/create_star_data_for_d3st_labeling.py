@@ -35,6 +35,8 @@ from absl import app
 from absl import flags
 from absl import logging
 from task_oriented_dialogue.end2end.anytod import starv2_lib
+from task_oriented_dialogue.state_tracking.utils import history_utils
+from task_oriented_dialogue.state_tracking.utils import tfrecord_utils
 import tensorflow as tf
 
 
@@ -59,6 +61,17 @@ _NUM_EXS_PER_TASK = flags.DEFINE_integer(
 )
 _OUTDIR = flags.DEFINE_string('output_dir', None, 'Output directory.')
 _MODE = flags.DEFINE_enum_class('mode', Mode.HANDLABEL, Mode, 'Mode.')
+_USE_CACHE = flags.DEFINE_bool(
+    'use_cache',
+    False,
+    'If true, cache the parsed input data next to it, to speed up later runs.',
+)
+_USE_DIALOGUE_STORE = flags.DEFINE_bool(
+    'use_dialogue_store',
+    False,
+    'If true, decode dialogs on demand from an indexed store written next to'
+    ' the input data, instead of holding all of them in memory.',
+)
 
 # "intents" for each task
 TASK_DESCS = {
@@ -105,32 +118,19 @@ class Example:
   def slot_ord_str(self) -> str:
     return ', '.join(self.slot_ord)
 
+  def features(self) -> tfrecord_utils.Features:
+    """Returns the tf.Example features of this Example."""
+    return {
+        'input': self.inp,
+        'value': self.tgt,
+        'dialog_id': str(self.dialog_id),
+        'turn': self.turn,
+        'slot_ordering': self.slot_ord_str,
+    }
+
   def build_tf_example(self) -> tf.train.Example:
     """Converts this Example dataclass into a tf.Example."""
-
-    def _bytes_feature(value):
-      """Returns a bytes_list from a string / byte."""
-      return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
-
-    def _int64_feature(value):
-      """Returns an int64_list from a bool / enum / int / uint."""
-      return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
-
-    return tf.train.Example(
-        features=tf.train.Features(
-            feature={
-                'input': _bytes_feature(self.inp.encode('utf-8')),
-                'value': _bytes_feature(self.tgt.encode('utf-8')),
-                'dialog_id': _bytes_feature(
-                    str(self.dialog_id).encode('utf-8')
-                ),
-                'turn': _int64_feature(self.turn),
-                'slot_ordering': _bytes_feature(
-                    self.slot_ord_str.encode('utf-8')
-                ),
-            }
-        )
-    )
+    return tfrecord_utils.to_tf_example(self.features())
 
 
 def generate_star_d3st_examples(
@@ -183,7 +183,7 @@ def generate_star_d3st_examples(
     for dialog_id in data.task_to_ids[task][: _NUM_EXS_PER_TASK.value]:
       dialog = data.dialogs[dialog_id]
       dialog_json = dialog.json
-      convo_hist = []
+      convo_hist = history_utils.DialogueHistory()
       for turn, event in enumerate(dialog_json['Events']):
         # Add to conversation history.
         if starv2_lib.is_user_event(event) or starv2_lib.is_wizard_event(event):
@@ -193,7 +193,7 @@ def generate_star_d3st_examples(
           if not convo_hist:
             wiz_info = _extract_wizard_task_info(dialog)
             text = '. '.join(wiz_info + [text])
-          convo_hist.append((speaker, text))
+          convo_hist.append(f'[{speaker}] {text}')
 
         if starv2_lib.is_user_event(event):
           name_to_param = {p.name: p for p in api.params}
@@ -269,9 +269,7 @@ def generate_star_d3st_examples(
               else:
                 tgt.append(f'{slot_ind}={val}')
 
-          convo_str = ' '.join(
-              f'[{speaker}] {utt}' for speaker, utt in convo_hist
-          )
+          convo_str = convo_hist.render()
           inp = f'{prompt} {convo_str}'
           tgt = ' '.join(tgt)
           tgt = f'[states] {tgt} [intents] i0 [req_slots]'
@@ -291,7 +289,9 @@ def main(argv: Sequence[str]) -> None:
       starv2_lib.ExampleFormat.TRANSITIONS_ANYTOD, False, False
   )
   starv2_lib.set_star_version(starv2_lib.StarVersion.V1)
-  data = starv2_lib.load_star_jsons(_DATADIR.value, options)
+  data = starv2_lib.load_star_jsons(
+      _DATADIR.value, options, _USE_CACHE.value, _USE_DIALOGUE_STORE.value
+  )
   task_examples = generate_star_d3st_examples(data)
 
   if _MODE.value == Mode.HANDLABEL:
@@ -305,15 +305,11 @@ def main(argv: Sequence[str]) -> None:
           f.write(ex.slot_ord_str)
       logging.info('Wrote %d examples to %s', len(exs), task_fname)
   elif _MODE.value == Mode.PREDICT:
-    all_tfexs = []
-    for task, exs in task_examples.items():
-      for ex in exs:
-        all_tfexs.append(ex.build_tf_example())
     fname = os.path.join(_OUTDIR.value, 'all_exs_predict.tfrecord')
-    with tf.io.TFRecordWriter(fname) as rw:
-      for tfex in all_tfexs:
-        rw.write(tfex.SerializeToString())
-    logging.info('Wrote %d examples to %s', len(all_tfexs), fname)
+    num_examples = tfrecord_utils.write_examples(
+        (ex.features() for exs in task_examples.values() for ex in exs), fname
+    )
+    logging.info('Wrote %d examples to %s', num_examples, fname)
 
 
 if __name__ == '__main__':
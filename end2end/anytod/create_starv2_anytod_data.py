@@ -26,6 +26,7 @@ from absl import app
 from absl import flags
 from absl import logging
 from task_oriented_dialogue.end2end.anytod import starv2_lib
+from task_oriented_dialogue.state_tracking.utils import tfrecord_utils
 import tensorflow as tf
 
 _DATADIR = flags.DEFINE_string(
@@ -51,6 +52,20 @@ _FULLSHOT_PERCENT = flags.DEFINE_float(
     'fullshot_percent', 0.8, 'Percentage of data for fullshot exps.'
 )
 _FIX_TAGS = flags.DEFINE_bool('fix_tags', False, 'If true, use fixed tags.')
+_USE_CACHE = flags.DEFINE_bool(
+    'use_cache',
+    False,
+    'If true, cache the parsed input data next to it, to speed up later runs.',
+)
+_USE_DIALOGUE_STORE = flags.DEFINE_bool(
+    'use_dialogue_store',
+    False,
+    'If true, decode dialogs on demand from an indexed store written next to'
+    ' the input data, instead of holding all of them in memory.',
+)
+_NUM_WORKERS = flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes serializing output examples.'
+)
 
 TASKS = [
     'apartment_schedule',
@@ -90,34 +105,21 @@ class Example:
   val: str
   metadata: starv2_lib.Json
 
+  def features(self) -> tfrecord_utils.Features:
+    """Returns the tf.Example features of this Example."""
+    return {
+        'input': self.inp,
+        'value': self.val,
+        'dialog_id': str(self.dialog_id),
+        'turn': self.turn,
+        'metadata': json.dumps(self.metadata),
+        # Legacy field, keep this in
+        'policy_table': '[]',
+    }
+
   def build_tf_example(self) -> tf.train.Example:
     """Converts this Example dataclass into a tf.Example."""
-
-    def _bytes_feature(value):
-      """Returns a bytes_list from a string / byte."""
-      return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
-
-    def _int64_feature(value):
-      """Returns an int64_list from a bool / enum / int / uint."""
-      return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
-
-    return tf.train.Example(
-        features=tf.train.Features(
-            feature={
-                'input': _bytes_feature(self.inp.encode('utf-8')),
-                'value': _bytes_feature(self.val.encode('utf-8')),
-                'dialog_id': _bytes_feature(
-                    str(self.dialog_id).encode('utf-8')
-                ),
-                'turn': _int64_feature(self.turn),
-                'metadata': _bytes_feature(
-                    json.dumps(self.metadata).encode('utf-8')
-                ),
-                # Legacy field, keep this in
-                'policy_table': _bytes_feature('[]'.encode('utf-8')),
-            }
-        )
-    )
+    return tfrecord_utils.to_tf_example(self.features())
 
 
 def _is_categorical_slot(param):
@@ -471,6 +473,12 @@ def generate_examples(
   return all_exs
 
 
+def _write_examples(exs: Sequence[Example], path: str) -> None:
+  tfrecord_utils.write_examples(
+      (ex.features() for ex in exs), path, num_workers=_NUM_WORKERS.value
+  )
+
+
 def main(argv: Sequence[str]) -> None:
   if len(argv) > 1:
     raise app.UsageError('Too many command-line arguments.')
@@ -480,21 +488,30 @@ def main(argv: Sequence[str]) -> None:
       starv2_lib.ExampleFormat.TRANSITIONS_ANYTOD, False, False
   )
   starv2_lib.set_star_version(starv2_lib.StarVersion.V1)
-  data = starv2_lib.load_star_jsons(_DATADIR.value, options)
+  data = starv2_lib.load_star_jsons(
+      _DATADIR.value, options, _USE_CACHE.value, _USE_DIALOGUE_STORE.value
+  )
   all_exs = generate_examples(data)
 
   def _get_domain(task):
     return task.split('_')[0]
 
+  # Tasks are read from the index rather than the dialogs, which a dialogue
+  # store would decode again on every lookup.
+  id_to_task = {
+      dialog_id: task
+      for task, dialog_ids in data.task_to_ids.items()
+      for dialog_id in dialog_ids
+  }
+
   # Generate zero-shot domain data
   print('ZERO-SHOT DOMAIN')
   domains = set(_get_domain(task) for task in TASKS)
   for eval_domain in domains:
     train_exs = []
     test_exs = []
-    for dialog_id, dialog in data.dialogs.items():
-      task = dialog.task
-      if _get_domain(task) == eval_domain:
+    for dialog_id in data.dialogs:
+      if _get_domain(id_to_task[dialog_id]) == eval_domain:
         test_exs.extend(all_exs[(dialog_id, 'test')])
       else:
         train_exs.extend(all_exs[(dialog_id, 'train')])
@@ -503,18 +520,13 @@ def main(argv: Sequence[str]) -> None:
     print(eval_domain, 'test', len(test_exs))
     random.shuffle(train_exs)
     domain_dir = os.path.join(_OUTPUT_DIR.value, eval_domain)
-    tf.io.gfile.makedirs(domain_dir)
-    with tf.io.TFRecordWriter(os.path.join(domain_dir, 'train.tfrecord')) as rw:
-      for ex in train_exs:
-        rw.write(ex.build_tf_example().SerializeToString())
-    with tf.io.TFRecordWriter(os.path.join(domain_dir, 'test.tfrecord')) as rw:
-      for ex in test_exs:
-        rw.write(ex.build_tf_example().SerializeToString())
+    _write_examples(train_exs, os.path.join(domain_dir, 'train.tfrecord'))
+    _write_examples(test_exs, os.path.join(domain_dir, 'test.tfrecord'))
   print()
 
   # Generate fullshot data
   print('FULLSHOT')
-  all_dialog_ids = sorted(list(set(data.dialogs.keys())))
+  all_dialog_ids = sorted(id_to_task)
   fs_train_dialog_ids = all_dialog_ids[
       : int(len(all_dialog_ids) * _FULLSHOT_PERCENT.value)
   ]
@@ -527,17 +539,11 @@ def main(argv: Sequence[str]) -> None:
   ]:
     exs = []
     for dialog_id in split_dialog_ids:
-      dialog = data.dialogs[dialog_id]
       exs.extend(all_exs[(dialog_id, split)])
     if split == 'train':
       random.shuffle(exs)
     fullshot_dir = os.path.join(_OUTPUT_DIR.value, 'fullshot')
-    tf.io.gfile.makedirs(fullshot_dir)
-    with tf.io.TFRecordWriter(
-        os.path.join(fullshot_dir, f'{split}.tfrecord')
-    ) as rw:
-      for ex in exs:
-        rw.write(ex.build_tf_example().SerializeToString())
+    _write_examples(exs, os.path.join(fullshot_dir, f'{split}.tfrecord'))
     print(f'fullshot {split} {len(exs)}')
 
 
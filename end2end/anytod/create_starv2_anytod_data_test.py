@@ -15,6 +15,7 @@
 """Tests for create_starv2_anytod_data."""
 import os
 import random
+import shutil
 from unittest import mock
 
 from absl import flags
@@ -103,6 +104,59 @@ class CreateStarv2AnytodDataTest(parameterized.TestCase):
     self.assertLen(task_examples[(1005, "train")], 6)
     self.assertLen(task_examples[(1005, "test")], 11)
 
+  def test_get_closest_event(self):
+    options = starv2_lib.Options(
+        starv2_lib.ExampleFormat.TRANSITIONS_ANYTOD, False, False
+    )
+    starv2_lib.set_star_version(starv2_lib.StarVersion.V1)
+    data = starv2_lib.load_star_jsons(
+        os.path.join(self._test_dir, "starv2_data"), options
+    )
+    criteria = [
+        starv2_lib.is_user_event,
+        starv2_lib.is_wizard_event,
+        starv2_lib.is_query_event,
+        starv2_lib.is_wizard_or_query_event,
+        starv2_lib.is_result_event,
+        starv2_lib.is_user_or_result_event,
+    ]
+    for dialog in data.dialogs.values():
+      for turn in range(len(dialog.events)):
+        for criterion in criteria:
+          for reverse in (False, True):
+            # Wrapping the criterion forces a scan of the events.
+            self.assertEqual(
+                dialog.get_closest_event(turn, criterion, reverse),
+                dialog.get_closest_event(
+                    turn, lambda e, c=criterion: c(e), reverse
+                ),
+            )
+
+  def test_dialogue_store(self):
+    data_dir = os.path.join(self.create_tempdir().full_path, "starv2_data")
+    shutil.copytree(os.path.join(self._test_dir, "starv2_data"), data_dir)
+    options = starv2_lib.Options(
+        starv2_lib.ExampleFormat.TRANSITIONS_ANYTOD, False, False
+    )
+    starv2_lib.set_star_version(starv2_lib.StarVersion.V1)
+    data = starv2_lib.load_star_jsons(data_dir, options)
+    with self._mock:
+      task_examples = create_starv2_anytod_data.generate_examples(data)
+
+    for _ in range(2):  # Writes the store, then reuses it.
+      random.seed(123)
+      stored_data = starv2_lib.load_star_jsons(
+          data_dir, options, use_dialogue_store=True
+      )
+      self.assertIsInstance(stored_data.dialogs, starv2_lib.StoredStarDialogs)
+      self.assertEqual(list(stored_data.dialogs), list(data.dialogs))
+      self.assertEqual(stored_data.task_to_ids, data.task_to_ids)
+      with self._mock:
+        stored_task_examples = create_starv2_anytod_data.generate_examples(
+            stored_data
+        )
+      self.assertEqual(stored_task_examples, task_examples)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -16,6 +16,7 @@
 # TODO(jeffreyzhao): This is research code and still being experimented with!
 # Need to clean up once in more stable state.
 import collections
+import collections.abc
 import copy
 import dataclasses
 import enum
@@ -24,8 +25,11 @@ import json
 import os
 import random
 import time
-from typing import Callable, Generic, Iterator, Optional, Sequence, TypeVar
+from typing import Callable, Generic, Iterator, Mapping, Optional, Sequence, TypeVar
 
+from task_oriented_dialogue.state_tracking.utils import cache_utils
+from task_oriented_dialogue.state_tracking.utils import dialogue_store
+from task_oriented_dialogue.state_tracking.utils import tfrecord_utils
 import tensorflow as tf
 
 DialogId = int
@@ -135,6 +139,18 @@ def is_relevant_event(event):
   return is_user_or_result_event(event) or is_wizard_or_query_event(event)
 
 
+# Criteria for which `StarDialog.get_closest_event` indexes the closest
+# matching events of every turn, instead of scanning the events.
+_INDEXED_EVENT_CRITERIA = frozenset([
+    is_user_event,
+    is_wizard_event,
+    is_query_event,
+    is_wizard_or_query_event,
+    is_result_event,
+    is_user_or_result_event,
+])
+
+
 # pytype: disable=bad-return-type
 def get_action_label(event) -> Action:
   """Infer action label without looking at JSON's 'ActionLabel' field."""
@@ -839,26 +855,20 @@ class Example:
   metadata: Json
   policy_table: list[Json]
 
+  def features(self) -> tfrecord_utils.Features:
+    """Returns the tf.Example features of this Example."""
+    return {
+        'input': self.src,
+        'value': self.tgt,
+        'dialog_id': str(self.dialog_id),
+        'turn': self.turn,
+        'metadata': json.dumps(self.metadata),
+        'policy_table': json.dumps(self.policy_table),
+    }
+
   def build_tf_example(self) -> tf.train.Example:
     """Converts this Example dataclass into a tf.Example."""
-    policy_table_json_str = json.dumps(self.policy_table)
-
-    return tf.train.Example(
-        features=tf.train.Features(
-            feature={
-                'input': bytes_feature(self.src.encode('utf-8')),
-                'value': bytes_feature(self.tgt.encode('utf-8')),
-                'dialog_id': bytes_feature(str(self.dialog_id).encode('utf-8')),
-                'turn': int64_feature(self.turn),
-                'metadata': bytes_feature(
-                    json.dumps(self.metadata).encode('utf-8')
-                ),
-                'policy_table': bytes_feature(
-                    policy_table_json_str.encode('utf-8')
-                ),
-            }
-        )
-    )
+    return tfrecord_utils.to_tf_example(self.features())
 
 
 @dataclasses.dataclass
@@ -1187,6 +1197,8 @@ class StarDialog:
     self._api = api
     self._graph = graph
     self._options = options
+    # criteria -> (next matching turn, previous matching turn) of each turn.
+    self._closest_turns = {}
 
   @functools.cached_property
   def task(self) -> str:
@@ -1216,12 +1228,56 @@ class StarDialog:
   def get_event(self, turn: int) -> Json:
     return self.events[turn]
 
+  def _get_closest_turns(
+      self, criteria: Callable[[Json], bool]
+  ) -> tuple[list[Optional[int]], list[Optional[int]]]:
+    """Returns the next and previous turn matching `criteria` of each turn."""
+    if criteria not in self._closest_turns:
+      num_events = len(self.events)
+      matches = [criteria(event) for event in self.events]
+      next_turns = [None] * num_events
+      prev_turns = [None] * num_events
+      closest_turn = None
+      for turn in range(num_events - 1, -1, -1):
+        next_turns[turn] = closest_turn
+        if matches[turn]:
+          closest_turn = turn
+      closest_turn = None
+      for turn in range(num_events):
+        prev_turns[turn] = closest_turn
+        if matches[turn]:
+          closest_turn = turn
+      self._closest_turns[criteria] = (next_turns, prev_turns)
+    return self._closest_turns[criteria]
+
   def get_closest_event(
       self,
       turn: int,
       criteria: Callable[[Json], bool],
       reverse: bool = False) -> tuple[Optional[int], Optional[Json]]:
-    """Gets the cloesst event from some turn that satisfies some criteria."""
+    """Gets the cloesst event from some turn that satisfies some criteria.
+
+    For the `is_*_event` criteria of this module, the closest matching turns of
+    all turns are computed on first use, so each lookup takes constant time.
+    Other criteria scan the events from `turn`.
+
+    Args:
+      turn: The turn to start from, which is not itself considered.
+      criteria: Predicate on events.
+      reverse: Whether to look for the closest previous event instead of the
+        closest next one.
+
+    Returns:
+      The turn and the closest matching event, or (None, None) if no event
+      matches.
+    """
+    if criteria in _INDEXED_EVENT_CRITERIA and 0 <= turn < len(self.events):
+      next_turns, prev_turns = self._get_closest_turns(criteria)
+      closest_turn = prev_turns[turn] if reverse else next_turns[turn]
+      if closest_turn is None:
+        return None, None
+      return closest_turn, self.get_event(closest_turn)
+
     if not reverse:
       turn_range = range(turn + 1, len(self.events))
     else:
@@ -1565,9 +1621,45 @@ class StarDialog:
     raise ValueError('Could not infer database action for %s' % event)
 
 
+class StoredStarDialogs(collections.abc.Mapping):
+  """Mapping from dialog ID to StarDialog, decoded on demand from a store.
+
+  Only the store's index is held in memory. Every lookup decodes the dialog
+  JSON again and wraps it in a new StarDialog.
+  """
+
+  def __init__(
+      self,
+      store: dialogue_store.DialogueStore,
+      task_to_api: dict[str, StarApi],
+      task_to_graph: dict[str, StarGraph],
+      options: Options,
+  ):
+    self._store = store
+    self._task_to_api = task_to_api
+    self._task_to_graph = task_to_graph
+    self._options = options
+
+  def __getitem__(self, dialog_id: DialogId) -> StarDialog:
+    js = self._store[dialog_id]
+    task = js['Scenario']['WizardCapabilities'][0]['Task']
+    return StarDialog(
+        js, self._task_to_api[task], self._task_to_graph[task], self._options
+    )
+
+  def __contains__(self, dialog_id: object) -> bool:
+    return dialog_id in self._store
+
+  def __iter__(self) -> Iterator[DialogId]:
+    return iter(self._store)
+
+  def __len__(self) -> int:
+    return len(self._store)
+
+
 @dataclasses.dataclass
 class StarData:
-  dialogs: dict[DialogId, StarDialog]
+  dialogs: Mapping[DialogId, StarDialog]
   task_to_ids: dict[str, list[DialogId]]
   task_to_api: dict[str, StarApi]
   task_to_graph: dict[str, StarGraph]
@@ -1608,20 +1700,53 @@ def load_star_graph_jsons(data_dir: str) -> dict[str, StarGraph]:
   return task_to_graph
 
 
-def load_star_jsons(data_dir: str, options: Options) -> StarData:
-  """Loads all STAR dataset JSONs."""
-  filenames = tf.io.gfile.glob(os.path.join(data_dir, 'dialogues', '*'))
-
-  # TODO(jeffreyzhao): Parallelize below.
-  start_time = time.time()
-  dialog_json_strs = [read_file(f) for f in filenames]
-  print(
-      f'Reading dialogues_*.json files took {time.time() - start_time} seconds.'
-  )
+def load_star_jsons(
+    data_dir: str,
+    options: Options,
+    use_cache: bool = False,
+    use_dialogue_store: bool = False,
+) -> StarData:
+  """Loads all STAR dataset JSONs.
+
+  Args:
+    data_dir: Directory of the STAR dataset.
+    options: Options for building the dialogs.
+    use_cache: If True, the loaded data is cached in a
+      `cache_utils.CACHE_DIRNAME` directory under `data_dir`, and loaded from
+      there as long as the dataset files, `options` and STAR_VERSION are
+      unchanged.
+    use_dialogue_store: If True, dialogs are packed into an indexed dialogue
+      store in the `cache_utils.CACHE_DIRNAME` directory (which must be on a
+      local file system), and the returned `dialogs` decode them on demand
+      instead of holding all of them in memory.
+
+  Returns:
+    The loaded STAR data.
+  """
+  if use_cache:
+    source_paths = (
+        tf.io.gfile.glob(os.path.join(data_dir, 'dialogues', '*'))
+        + tf.io.gfile.glob(os.path.join(data_dir, 'apis', 'apis', '*.json'))
+        + tf.io.gfile.glob(os.path.join(data_dir, 'tasks', '*', '*.json'))
+    )
+    data = cache_utils.load_cached(
+        name='star',
+        cache_dir=os.path.join(data_dir, cache_utils.CACHE_DIRNAME),
+        source_paths=source_paths,
+        load_fn=functools.partial(
+            _load_star_jsons, data_dir, options, use_dialogue_store
+        ),
+        key=f'{STAR_VERSION}:{options}:{use_dialogue_store}',
+    )
+    # Restore the global set by _load_star_jsons on a cache hit.
+    global ALL_ASK_ACTS
+    ALL_ASK_ACTS = data.all_ask_acts
+    return data
+  return _load_star_jsons(data_dir, options, use_dialogue_store)
 
-  task_to_api = load_star_api_jsons(data_dir)
-  task_to_graph = load_star_graph_jsons(data_dir)
 
+def _get_all_ask_acts(task_to_graph: dict[str, StarGraph]) -> set[str]:
+  """Returns the ask acts of all tasks, also setting ALL_ASK_ACTS."""
   all_ask_acts = set()
   for _, graph in task_to_graph.items():
     for _, actions in graph.slot_actions.items():
@@ -1631,6 +1756,77 @@ def load_star_jsons(data_dir: str, options: Options) -> StarData:
   # TODO(jeffreyzhao): Avoid this global
   global ALL_ASK_ACTS
   ALL_ASK_ACTS = all_ask_acts
+  return all_ask_acts
+
+
+def _iter_dialog_jsons(filenames: list[str]) -> Iterator[Json]:
+  """Yields the single-task dialog JSONs of the given files."""
+  for filename in filenames:
+    js = json.loads(read_file(filename), object_hook=Json)
+    # TODO(jeffreyzhao): Multitask
+    if not js['Scenario']['MultiTask']:
+      yield js
+
+
+def _open_star_dialogue_store(
+    data_dir: str, filenames: list[str]
+) -> dialogue_store.DialogueStore:
+  """Opens the store of single-task dialogs, writing it first if needed."""
+  path = os.path.join(
+      data_dir,
+      cache_utils.CACHE_DIRNAME,
+      f'star-{cache_utils.fingerprint(filenames)}.dialogues',
+  )
+  if not dialogue_store.dialogue_store_exists(path):
+    task_to_ids = collections.defaultdict(list)
+
+    def _iter_indexed_dialog_jsons():
+      for js in _iter_dialog_jsons(filenames):
+        task = js['Scenario']['WizardCapabilities'][0]['Task']
+        task_to_ids[task].append(js['DialogueID'])
+        yield js
+
+    # Metadata is only read once all dialogs are written, so task_to_ids is
+    # complete by then.
+    dialogue_store.write_dialogue_store(
+        path,
+        _iter_indexed_dialog_jsons(),
+        id_key='DialogueID',
+        metadata={'task_to_ids': task_to_ids},
+    )
+  return dialogue_store.DialogueStore(path)
+
+
+def _load_star_jsons(
+    data_dir: str, options: Options, use_dialogue_store: bool
+) -> StarData:
+  """Loads all STAR dataset JSONs, see `load_star_jsons`."""
+  filenames = tf.io.gfile.glob(os.path.join(data_dir, 'dialogues', '*'))
+  if use_dialogue_store:
+    task_to_api = load_star_api_jsons(data_dir)
+    task_to_graph = load_star_graph_jsons(data_dir)
+    all_ask_acts = _get_all_ask_acts(task_to_graph)
+    store = _open_star_dialogue_store(data_dir, filenames)
+    task_to_ids = collections.defaultdict(list)
+    task_to_ids.update(store.metadata['task_to_ids'])
+    return StarData(
+        StoredStarDialogs(store, task_to_api, task_to_graph, options),
+        task_to_ids,
+        task_to_api,
+        task_to_graph,
+        all_ask_acts,
+    )
+
+  # TODO(jeffreyzhao): Parallelize below.
+  start_time = time.time()
+  dialog_json_strs = [read_file(f) for f in filenames]
+  print(
+      f'Reading dialogues_*.json files took {time.time() - start_time} seconds.'
+  )
+
+  task_to_api = load_star_api_jsons(data_dir)
+  task_to_graph = load_star_graph_jsons(data_dir)
+  all_ask_acts = _get_all_ask_acts(task_to_graph)
 
   dialogs = {}
   for js_str in dialog_json_strs:
@@ -14,6 +14,7 @@
 
 """Script to process SGD dialogs for finetuning T5."""
 
+import contextlib
 import csv
 import json
 import os
@@ -32,12 +33,17 @@ flags.DEFINE_boolean("delexicalize", False,
                      "Whether to delexicalize non-categorical slots")
 flags.DEFINE_string("templates_dir", None,
                     "Directory contains utterance templates.")
+flags.DEFINE_string(
+    "templates_cache_path", None,
+    "If set, the parsed utterance templates are cached to this file, to "
+    "speed up later runs.")
 
 FLAGS = flags.FLAGS
 
 SEPARATOR = " | "
 _CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 FEWSHOT_IDS_DIR = f"{_CURRENT_DIR}/fewshot_splits"
+ENCODING_SCHEMES = ("naive", "schema_guided", "t2g2")
 
 
 def _remove_newline_and_tabs(s):
@@ -63,11 +69,14 @@ class Preprocessor:
     self.schemas_path = schemas_path
     self.slots_str_repr = {}
     self.service_str_repr = {}
+    # Schema and is_categorical of each slot, by service name.
+    self.schemas = {}
+    self.slot_is_categorical = {}
     self.input_representation_type = input_representation_type
     self.add_slot_desc = (self.input_representation_type == "schema_guided")
     self.schemas_str_repr = self.preprocess_schemas(schemas_path)
     self._utterance_gen = utterance_generator.TemplateUtteranceGenerator(
-        FLAGS.templates_dir)
+        FLAGS.templates_dir, cache_path=FLAGS.templates_cache_path)
 
   def preprocess_slot(self, slot):
     slot_str = f"name={slot['name']},description={slot['description']}"
@@ -75,15 +84,17 @@ class Preprocessor:
       slot_str = f"{slot_str},examples ={','.join(slot['possible_values'])}"
     return slot_str
 
-  def load_schema(self, schemas_path, service):
-    schemas = json.load(tf.io.gfile.GFile(schemas_path))
-    for schema in schemas:
-      if schema["service_name"] == service:
-        return schema
-    return schemas
+  def get_schema(self, service):
+    """Returns the schema of a service, without reading the schemas file."""
+    return self.schemas[service]
 
   def preprocess_schemas(self, schemas_path):
     schemas = json.load(tf.io.gfile.GFile(schemas_path))
+    for schema in schemas:
+      service = schema["service_name"]
+      self.schemas[service] = schema
+      self.slot_is_categorical[service] = (
+          utterance_generator.get_slot_is_categorical(schema))
     schemas_str_repr = {
         schema["service_name"]: self.preprocess_schema(schema)
         for schema in schemas
@@ -107,16 +118,23 @@ class Preprocessor:
     schema_str = SEPARATOR.join(schema_str_parts).lower()
     return schema_str
 
+  def _get_slot_is_categorical(self, schema):
+    if schema is None:
+      return None
+    return self.slot_is_categorical.get(schema["service_name"])
+
   def preprocess_target_utterance(self, turn, schema=None):
     if FLAGS.delexicalize:
-      return self._utterance_gen.get_delexicalized_utterance(turn, schema)
+      return self._utterance_gen.get_delexicalized_utterance(
+          turn, schema, self._get_slot_is_categorical(schema))
     else:
       return turn["utterance"]
 
   def preprocess_turn(self, turn, schema=None):
     """Convert a dialog turn into a textual representation."""
     if self.input_representation_type == "t2g2":
-      robot_utterance = self._utterance_gen.get_robot_utterance(turn, schema)
+      robot_utterance = self._utterance_gen.get_robot_utterance(
+          turn, schema, self._get_slot_is_categorical(schema))
       return turn["speaker"] + SEPARATOR + robot_utterance
     turn_str_parts = [turn["speaker"]]
     for frame in turn["frames"]:
@@ -153,9 +171,16 @@ class Preprocessor:
       action_str = f"{action_str}, values = {values}"
     return action_str
 
+  def get_turn_schema(self, turn):
+    """Returns the schema of the service of a system turn, if delexicalizing."""
+    services = list(set([frame["service"] for frame in turn["frames"]]))
+    if len(services) > 1 and self.input_representation_type != "t2g2":
+      raise ValueError("found turn with multiple services. exiting.")
+    service = services[0]
+    return self.get_schema(service) if FLAGS.delexicalize else None
+
   def create_tsv_data(self, dialogs, output_tsv_path, query_dialog_ids=None):
     """Convert a dialog json file into a tsv for seq2seq models."""
-    count = 0
     random.shuffle(dialogs)
     with tf.io.gfile.GFile(output_tsv_path, "w") as tsvfile:
       writer = csv.writer(tsvfile, delimiter="\t")
@@ -163,40 +188,105 @@ class Preprocessor:
         dialog_id = dialog["dialogue_id"]
         if query_dialog_ids and dialog_id not in query_dialog_ids:
           continue
-        services = dialog["services"]
-        turns = dialog["turns"]
-        # add turn number
-        turn_id = 0
-        for turn in turns:
-          if turn["speaker"] == "USER":
-            continue
-          services = list(set([frame["service"] for frame in turn["frames"]]))
-          if len(services) > 1 and self.input_representation_type != "t2g2":
-            raise ValueError("found turn with multiple services. exiting.")
-          service = services[0]
-          schema = self.load_schema(self.schemas_path,
-                                    service) if FLAGS.delexicalize else None
-          text = _remove_newline_and_tabs(
-              self.preprocess_target_utterance(turn, schema))
-          structured_data = self.preprocess_turn(turn, schema)
-          structured_data = _remove_newline_and_tabs(structured_data)
-          metadata = _remove_newline_and_tabs(json.dumps(turn))
-          writer.writerow([structured_data, text, metadata, dialog_id, turn_id])
-          turn_id += 1
-
-
-def create_fewshot_splits(dialogs, data_processor, output_dir, encoding_scheme):
-  """Create fewshot splits for the training set."""
-  for filename in os.listdir(FEWSHOT_IDS_DIR):
+        encoding_scheme = self.input_representation_type
+        writer.writerows(
+            create_tsv_rows(dialog, {encoding_scheme: self})[encoding_scheme])
+
+
+def create_tsv_rows(dialog, data_processors):
+  """Converts the system turns of a dialog into tsv rows for each encoding.
+
+  The target utterance and metadata columns don't depend on the encoding, so
+  they are computed once per turn.
+
+  Args:
+    dialog: The dialog json.
+    data_processors: A dict mapping each encoding scheme to its Preprocessor.
+
+  Returns:
+    A dict mapping each encoding scheme to the rows of the dialog.
+  """
+  dialog_id = dialog["dialogue_id"]
+  rows = {encoding_scheme: [] for encoding_scheme in data_processors}
+  # add turn number
+  turn_id = 0
+  for turn in dialog["turns"]:
+    if turn["speaker"] == "USER":
+      continue
+    text = None
+    metadata = None
+    for encoding_scheme, data_processor in data_processors.items():
+      schema = data_processor.get_turn_schema(turn)
+      if text is None:
+        text = _remove_newline_and_tabs(
+            data_processor.preprocess_target_utterance(turn, schema))
+        metadata = _remove_newline_and_tabs(json.dumps(turn))
+      structured_data = data_processor.preprocess_turn(turn, schema)
+      structured_data = _remove_newline_and_tabs(structured_data)
+      rows[encoding_scheme].append(
+          [structured_data, text, metadata, dialog_id, turn_id])
+    turn_id += 1
+  return rows
+
+
+def load_fewshot_dialog_ids():
+  """Returns a dict mapping each fewshot split to its set of dialog ids."""
+  fewshot_dialog_ids = {}
+  for filename in sorted(os.listdir(FEWSHOT_IDS_DIR)):
     dialog_ids = set()
     with tf.io.gfile.GFile(os.path.join(FEWSHOT_IDS_DIR, filename)) as f:
       for line in f:
         dialog_ids.add(line.strip())
     data_size = filename[:-4]  # Remove the .txt extension.
+    fewshot_dialog_ids[data_size] = dialog_ids
+  return fewshot_dialog_ids
+
+
+def create_fewshot_splits(dialogs, data_processor, output_dir, encoding_scheme):
+  """Create fewshot splits for the training set."""
+  for data_size, dialog_ids in load_fewshot_dialog_ids().items():
     tsv_path = os.path.join(output_dir, f"{encoding_scheme}_{data_size}.tsv")
     data_processor.create_tsv_data(dialogs, tsv_path, dialog_ids)
 
 
+def create_split_tsv_data(dialogs, data_processors, output_dir,
+                          fewshot_dialog_ids=None):
+  """Creates the tsv files of all encodings and splits in a single pass.
+
+  Each dialog is converted once into the rows of every encoding scheme, which
+  are written to `<encoding_scheme>_all.tsv` and to the
+  `<encoding_scheme>_<data_size>.tsv` file of every fewshot split containing
+  the dialog. All files list dialogs in the same shuffled order.
+
+  Args:
+    dialogs: The dialogs of the split.
+    data_processors: A dict mapping each encoding scheme to its Preprocessor.
+    output_dir: Directory where the tsv files are created.
+    fewshot_dialog_ids: Optional dict mapping each fewshot split to its set of
+      dialog ids.
+  """
+  random.shuffle(dialogs)
+  targets = [(None, "all")]
+  if fewshot_dialog_ids:
+    targets.extend((dialog_ids, data_size)
+                   for data_size, dialog_ids in fewshot_dialog_ids.items())
+  with contextlib.ExitStack() as stack:
+    writers = []
+    for encoding_scheme in data_processors:
+      for dialog_ids, data_size in targets:
+        tsvfile = stack.enter_context(
+            tf.io.gfile.GFile(
+                os.path.join(output_dir, f"{encoding_scheme}_{data_size}.tsv"),
+                "w"))
+        writers.append((encoding_scheme, dialog_ids,
+                        csv.writer(tsvfile, delimiter="\t")))
+    for dialog in dialogs:
+      rows = create_tsv_rows(dialog, data_processors)
+      for encoding_scheme, dialog_ids, writer in writers:
+        if not dialog_ids or dialog["dialogue_id"] in dialog_ids:
+          writer.writerows(rows[encoding_scheme])
+
+
 def main(_):
   # Process the train, dev and test splits.
   for split in ["train", "dev", "test"]:
@@ -208,22 +298,22 @@ def main(_):
       with tf.io.gfile.GFile(os.path.join(dataset_dir, filename)) as f:
         dialogs.extend(json.load(f))
 
-    for encoding_scheme in ["naive", "schema_guided", "t2g2"]:
-      # Create data processor.
-      schema_path = os.path.join(dataset_dir, "schema.json")
-      data_processor = Preprocessor(schema_path, encoding_scheme)
-
-      # Create the tsv file containing data from all dialogues in the split.
-      output_dir = os.path.join(FLAGS.output_dir, split)
-      if not tf.io.gfile.isdir(output_dir):
-        tf.io.gfile.makedirs(output_dir)
-      output_tsv_path = os.path.join(output_dir, f"{encoding_scheme}_all.tsv")
-      data_processor.create_tsv_data(dialogs, output_tsv_path)
-
-      # Create fewshot splits for the training set.
-      if split == "train":
-        create_fewshot_splits(dialogs, data_processor, output_dir,
-                              encoding_scheme)
+    schema_path = os.path.join(dataset_dir, "schema.json")
+    output_dir = os.path.join(FLAGS.output_dir, split)
+    if not tf.io.gfile.isdir(output_dir):
+      tf.io.gfile.makedirs(output_dir)
+
+    # Create the tsv files of all encodings, and the fewshot splits for the
+    # training set, in a single pass over the dialogs.
+    data_processors = {
+        encoding_scheme: Preprocessor(schema_path, encoding_scheme)
+        for encoding_scheme in ENCODING_SCHEMES
+    }
+    fewshot_dialog_ids = None
+    if split == "train":
+      fewshot_dialog_ids = load_fewshot_dialog_ids()
+    create_split_tsv_data(dialogs, data_processors, output_dir,
+                          fewshot_dialog_ids)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for prepare_dataset."""
+
+import json
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import flagsaver
+from generation import prepare_dataset
+
+_SCHEMA = [{
+    "service_name": "Test_1",
+    "description": "A test service",
+    "slots": [{
+        "name": "city",
+        "description": "Name of the city",
+        "is_categorical": False,
+        "possible_values": []
+    }, {
+        "name": "count",
+        "description": "Number of places",
+        "is_categorical": True,
+        "possible_values": ["1", "2", "3"]
+    }]
+}]
+
+
+def _make_dialog(idx):
+  return {
+      "dialogue_id": f"1_{idx:05d}",
+      "services": ["Test_1"],
+      "turns": [{
+          "speaker": "USER",
+          "utterance": "Find me some places.",
+          "frames": [],
+      }, {
+          "speaker": "SYSTEM",
+          "utterance": f"There are {idx % 3 + 1} places in City {idx}.",
+          "frames": [{
+              "service": "Test_1",
+              "actions": [{
+                  "act": "INFORM",
+                  "slot": "city",
+                  "values": [f"City {idx}"]
+              }, {
+                  "act": "INFORM",
+                  "slot": "count",
+                  "values": [str(idx % 3 + 1)]
+              }]
+          }],
+      }, {
+          "speaker": "USER",
+          "utterance": "Thanks.",
+          "frames": [],
+      }, {
+          "speaker": "SYSTEM",
+          "utterance": "Bye.",
+          "frames": [{
+              "service": "Test_1",
+              "actions": [{
+                  "act": "GOODBYE",
+                  "slot": "",
+                  "values": []
+              }]
+          }],
+      }],
+  }
+
+
+def _read_lines(path):
+  with open(path) as f:
+    return f.readlines()
+
+
+class PrepareDatasetTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    tempdir = self.create_tempdir().full_path
+    self._schema_path = os.path.join(tempdir, "schema.json")
+    with open(self._schema_path, "w") as f:
+      json.dump(_SCHEMA, f)
+    self._template_dir = os.path.join(tempdir, "templates")
+    os.makedirs(self._template_dir)
+    with open(os.path.join(self._template_dir, "Test_1.tsv"), "w") as f:
+      f.write("INFORM!!city!!@\tThe city is @.\n"
+              "INFORM!!count!!@\tThere are @.\n"
+              "GOODBYE\tBye.\n")
+    self._fewshot_dir = os.path.join(tempdir, "fewshot_splits")
+    os.makedirs(self._fewshot_dir)
+    for data_size, indices in (("1_shot", [3]), ("2_shot", [0, 4])):
+      with open(os.path.join(self._fewshot_dir, f"{data_size}.txt"), "w") as f:
+        f.write("".join(f"1_{idx:05d}\n" for idx in indices))
+    self._dialogs = [_make_dialog(idx) for idx in range(6)]
+
+  @flagsaver.flagsaver(delexicalize=True)
+  def test_single_pass_matches_per_encoding_files(self):
+    single_pass_dir = self.create_tempdir().full_path
+    per_encoding_dir = self.create_tempdir().full_path
+    with flagsaver.flagsaver(templates_dir=self._template_dir), \
+        mock.patch.object(prepare_dataset, "FEWSHOT_IDS_DIR",
+                          self._fewshot_dir):
+      data_processors = {
+          encoding_scheme: prepare_dataset.Preprocessor(
+              self._schema_path, encoding_scheme)
+          for encoding_scheme in prepare_dataset.ENCODING_SCHEMES
+      }
+      prepare_dataset.create_split_tsv_data(
+          list(self._dialogs), data_processors, single_pass_dir,
+          prepare_dataset.load_fewshot_dialog_ids())
+      for encoding_scheme, data_processor in data_processors.items():
+        data_processor.create_tsv_data(
+            list(self._dialogs),
+            os.path.join(per_encoding_dir, f"{encoding_scheme}_all.tsv"))
+        prepare_dataset.create_fewshot_splits(
+            list(self._dialogs), data_processor, per_encoding_dir,
+            encoding_scheme)
+
+    expected_files = [
+        f"{encoding_scheme}_{data_size}.tsv"
+        for encoding_scheme in prepare_dataset.ENCODING_SCHEMES
+        for data_size in ("all", "1_shot", "2_shot")
+    ]
+    self.assertCountEqual(os.listdir(single_pass_dir), expected_files)
+    self.assertCountEqual(os.listdir(per_encoding_dir), expected_files)
+    for filename in expected_files:
+      # Dialogs are shuffled differently by the two paths.
+      lines = _read_lines(os.path.join(single_pass_dir, filename))
+      self.assertNotEmpty(lines)
+      self.assertCountEqual(
+          lines, _read_lines(os.path.join(per_encoding_dir, filename)))
+    self.assertLen(_read_lines(os.path.join(single_pass_dir, "t2g2_all.tsv")),
+                   12)
+    self.assertLen(
+        _read_lines(os.path.join(single_pass_dir, "naive_2_shot.tsv")), 4)
+
+
+if __name__ == "__main__":
+  absltest.main()
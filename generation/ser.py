@@ -14,13 +14,13 @@
 
 """Compute slot error rate (SER) metric."""
 
-import csv
 import collections
+import csv
+import itertools
 import json
 
 from absl import app
 from absl import flags
-import pandas as pd
 import tensorflow as tf
 
 FLAGS = flags.FLAGS
@@ -30,6 +30,13 @@ flags.DEFINE_string(
     'data_dir', None,
     'Path to SGD dataset. The directory shoud include sub-directoes for train, dev and test, each with its own schema.json file.'
 )
+flags.DEFINE_bool(
+    'streaming', True,
+    'Whether to read the inputs and predictions line by line instead of '
+    'loading them into memory.')
+
+
+UNSEEN_DOMAINS = ('Alarm', 'Messaging', 'Payment', 'Train')
 
 
 def get_ser_slots(data_dir):
@@ -45,54 +52,169 @@ def get_ser_slots(data_dir):
   return permissible_slots
 
 
-def example_ser(mr, prediction, permissible_slots):
-  """Calculates slot error rate for a single prediction."""
-  prediction = prediction.lower()
+def get_ser_slot_set(permissible_slots):
+  """Returns the frozenset of (service, slot) pairs checked for SER."""
+  return frozenset((service, slot)
+                   for service, slots in permissible_slots.items()
+                   for slot in slots)
+
+
+def _get_missing_slots(mr, prediction, slot_set):
+  """Returns the required slots and those with a value missing in prediction.
+
+  Args:
+    mr: The meaning representation, i.e. the turn json.
+    prediction: The lowercased prediction.
+    slot_set: The set of (service, slot) pairs checked for SER.
+
+  Returns:
+    A tuple of the list of (service, slot) pairs whose values are required
+    and the set of those with any value not found in the prediction.
+  """
+  required = []
+  missing = set()
   for frame in mr['frames']:
     service = frame['service']
     for action in frame['actions']:
-      slot = action['slot']
-      if slot not in permissible_slots[service]:
+      key = (service, action['slot'])
+      if key not in slot_set:
         continue
-      values = action['values']
-      for value in values:
-        value = value.lower()
-        if value not in prediction:
-          return False
-  return True
-
-
-def calculate_ser(data, permissible_slots):
-  """Calculates slot error rate for a set of predictions."""
-  df = pd.DataFrame(data)
-  df['is_wrong'] = df.apply(
-      lambda x: not example_ser(x['mr'], x['prediction'], permissible_slots),
-      axis=1)
-  results = {}
-  results['overall'] = df['is_wrong'].mean()
-  df_ser = df.groupby('tag').apply(lambda x: x['is_wrong'].mean()).reset_index(
-      name='ser')
-  results.update(dict(df_ser.values))
-  results = {k: v * 100 for k, v in results.items()}
-  return results
+      required.append(key)
+      for value in action['values']:
+        if value.lower() not in prediction:
+          missing.add(key)
+          break
+  return required, missing
+
+
+def example_ser(mr, prediction, permissible_slots):
+  """Calculates slot error rate for a single prediction.
+
+  Args:
+    mr: The meaning representation, i.e. the turn json.
+    prediction: The predicted utterance.
+    permissible_slots: The frozenset of (service, slot) pairs checked for SER,
+      as returned by `get_ser_slot_set`. A dict as returned by `get_ser_slots`
+      is also accepted, but is converted again on every call.
+
+  Returns:
+    Whether the values of all checked slots are found in the prediction.
+  """
+  if not isinstance(permissible_slots, frozenset):
+    permissible_slots = get_ser_slot_set(permissible_slots)
+  _, missing = _get_missing_slots(mr, prediction.lower(), permissible_slots)
+  return not missing
+
+
+def get_tag(mr):
+  """Returns whether the domain of an example is 'seen' or 'unseen'."""
+  domain = mr['frames'][0]['service'].split('_')[0]
+  return 'unseen' if domain in UNSEEN_DOMAINS else 'seen'
+
+
+class SerAccumulator:
+  """Running slot error rate counts of predictions.
+
+  Besides the overall and per tag SER, i.e. the percentage of examples where
+  the value of any checked slot is missing from the prediction, the SER is
+  broken down by the service of the example and by slot. The SER of a slot is
+  the percentage of examples requiring it where any of its values is missing.
+  """
+
+  def __init__(self, permissible_slots):
+    """Inits an accumulator.
+
+    Args:
+      permissible_slots: A dict mapping each service to the slots checked for
+        SER, as returned by `get_ser_slots`.
+    """
+    self._slot_set = get_ser_slot_set(permissible_slots)
+    self._num_examples = collections.Counter()
+    self._num_wrong = collections.Counter()
+    self._num_examples_by_service = collections.Counter()
+    self._num_wrong_by_service = collections.Counter()
+    self._num_examples_by_slot = collections.Counter()
+    self._num_wrong_by_slot = collections.Counter()
+
+  def add(self, mr, prediction, tag):
+    """Counts a prediction and returns whether it's wrong."""
+    required, missing = _get_missing_slots(mr, prediction.lower(),
+                                           self._slot_set)
+    is_wrong = bool(missing)
+    service = mr['frames'][0]['service']
+    self._num_examples['overall'] += 1
+    self._num_examples[tag] += 1
+    self._num_examples_by_service[service] += 1
+    # Count each slot once per example.
+    self._num_examples_by_slot.update(set(required))
+    if is_wrong:
+      self._num_wrong['overall'] += 1
+      self._num_wrong[tag] += 1
+      self._num_wrong_by_service[service] += 1
+      self._num_wrong_by_slot.update(missing)
+    return is_wrong
+
+  @staticmethod
+  def _percentages(num_wrong, num_examples):
+    return {
+        key: num_wrong[key] / count * 100 for key, count in num_examples.items()
+    }
+
+  def ser(self):
+    """Returns the overall SER and the SER of each tag, in percent."""
+    return self._percentages(self._num_wrong, self._num_examples)
+
+  def service_ser(self):
+    """Returns the SER of each service, in percent."""
+    return self._percentages(self._num_wrong_by_service,
+                             self._num_examples_by_service)
+
+  def slot_ser(self):
+    """Returns the SER of each (service, slot) pair, in percent."""
+    return self._percentages(self._num_wrong_by_slot,
+                             self._num_examples_by_slot)
+
+
+def calculate_ser(data, permissible_slots, accumulator=None):
+  """Calculates slot error rate for a set of predictions.
+
+  Args:
+    data: The dict returned by `prepare_data`.
+    permissible_slots: A dict mapping each service to the slots checked for
+      SER, as returned by `get_ser_slots`.
+    accumulator: Optional SerAccumulator to add the predictions to, e.g. to
+      read the per service and slot breakdowns afterwards.
+
+  Returns:
+    A dict with the overall SER and the SER of each tag, in percent.
+
+  Raises:
+    ValueError: If `data` has different numbers of meaning representations,
+      predictions and tags.
+  """
+  lengths = {key: len(data[key]) for key in ('mr', 'prediction', 'tag')}
+  if len(set(lengths.values())) > 1:
+    raise ValueError(f'Mismatched numbers of examples: {lengths}')
+  if accumulator is None:
+    accumulator = SerAccumulator(permissible_slots)
+  for mr, prediction, tag in zip(data['mr'], data['prediction'], data['tag']):
+    accumulator.add(mr, prediction, tag)
+  return accumulator.ser()
 
 
 def prepare_data(inputs_path, predictions_path):
   """Prepare inputs and predictions for slot error rate calculation."""
-  unseen_domains = ['Alarm', 'Messaging', 'Payment', 'Train']
   predictions = [
       line.strip('\n') for line in tf.io.gfile.GFile(predictions_path)
   ]
   reader = csv.reader(tf.io.gfile.GFile(inputs_path), delimiter='\t')
-  data = list(reader)
+  # Rows may have more columns after the metadata, e.g. the dialogue id and
+  # turn written by prepare_dataset.
+  data = [row[:3] for row in reader]
   mrs = [json.loads(mr) for _, _, mr in data]
   inputs = [inp for inp, _, _ in data]
   targets = [target for _, target, _ in data]
-  services = [mr['frames'][0]['service'] for mr in mrs]
-  domains = [service.split('_')[0] for service in services]
-  tags = [
-      'unseen' if domain in unseen_domains else 'seen' for domain in domains
-  ]
+  tags = [get_tag(mr) for mr in mrs]
   data = {
       'mr': mrs,
       'input': inputs,
@@ -103,11 +225,74 @@ def prepare_data(inputs_path, predictions_path):
   return data
 
 
+def iter_examples(inputs_path, predictions_path):
+  """Streams the meaning representation, prediction and tag of each example.
+
+  The input tsv and the predictions file are read line by line in lockstep, so
+  memory use doesn't depend on their size.
+
+  Args:
+    inputs_path: Path to the tsv dataset file.
+    predictions_path: Path to the predictions file, with one prediction per
+      line in the same order as `inputs_path`.
+
+  Yields:
+    Tuples of the parsed meaning representation, the prediction and the tag of
+    each example.
+
+  Raises:
+    ValueError: If the files have different numbers of examples.
+  """
+  with tf.io.gfile.GFile(inputs_path) as inputs_file, tf.io.gfile.GFile(
+      predictions_path) as predictions_file:
+    reader = csv.reader(inputs_file, delimiter='\t')
+    for row, line in itertools.zip_longest(reader, predictions_file):
+      if row is None or line is None:
+        raise ValueError(f'{inputs_path} and {predictions_path} have different '
+                         'numbers of examples.')
+      mr = json.loads(row[2])
+      yield mr, line.strip('\n'), get_tag(mr)
+
+
+def calculate_streaming_ser(inputs_path,
+                            predictions_path,
+                            permissible_slots,
+                            accumulator=None):
+  """Calculates slot error rate without loading the files into memory.
+
+  Args:
+    inputs_path: Path to the tsv dataset file.
+    predictions_path: Path to the predictions file.
+    permissible_slots: A dict mapping each service to the slots checked for
+      SER, as returned by `get_ser_slots`.
+    accumulator: Optional SerAccumulator to add the predictions to.
+
+  Returns:
+    A dict with the overall SER and the SER of each tag, in percent.
+  """
+  if accumulator is None:
+    accumulator = SerAccumulator(permissible_slots)
+  for mr, prediction, tag in iter_examples(inputs_path, predictions_path):
+    accumulator.add(mr, prediction, tag)
+  return accumulator.ser()
+
+
 def main(_):
-  data = prepare_data(FLAGS.inputs_path, FLAGS.predictions_path)
   permissible_slots = get_ser_slots(FLAGS.data_dir)
-  ser_results = calculate_ser(data, permissible_slots)
+  accumulator = SerAccumulator(permissible_slots)
+  if FLAGS.streaming:
+    ser_results = calculate_streaming_ser(FLAGS.inputs_path,
+                                          FLAGS.predictions_path,
+                                          permissible_slots, accumulator)
+  else:
+    data = prepare_data(FLAGS.inputs_path, FLAGS.predictions_path)
+    ser_results = calculate_ser(data, permissible_slots, accumulator)
   print(ser_results)
+  print('SER by service:', accumulator.service_ser())
+  print('SER by slot:', {
+      f'{service}/{slot}': ser
+      for (service, slot), ser in accumulator.slot_ser().items()
+  })
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for ser."""
+
+import csv
+import json
+import os
+
+from absl.testing import absltest
+from generation import ser
+
+_PERMISSIBLE_SLOTS = {'Buses_1': ['from_city', 'to_city'], 'Alarm_1': ['name']}
+
+
+def _mr(service, slot_values):
+  return {
+      'frames': [{
+          'service':
+              service,
+          'actions': [{
+              'act': 'INFORM',
+              'slot': slot,
+              'values': values
+          } for slot, values in slot_values.items()]
+      }]
+  }
+
+
+class SerTest(absltest.TestCase):
+
+  def test_calculate_ser(self):
+    mrs = [
+        _mr('Buses_1', {
+            'from_city': ['San Jose'],
+            'to_city': ['LA'],
+            'fare': ['$20']
+        }),
+        _mr('Buses_1', {
+            'from_city': ['Napa'],
+            'to_city': ['SF', 'LA']
+        }),
+        _mr('Alarm_1', {'name': ['Wake up']}),
+        _mr('Alarm_1', {'time': ['7 am']}),
+    ]
+    data = {
+        'mr': mrs,
+        'prediction': [
+            'From san jose to LA.', 'From SF to LA.', 'Alarm set.', 'Done.'
+        ],
+        'tag': [ser.get_tag(mr) for mr in mrs],
+    }
+    self.assertEqual(data['tag'], ['seen', 'seen', 'unseen', 'unseen'])
+
+    accumulator = ser.SerAccumulator(_PERMISSIBLE_SLOTS)
+    self.assertEqual(
+        ser.calculate_ser(data, _PERMISSIBLE_SLOTS, accumulator), {
+            'overall': 50.0,
+            'seen': 50.0,
+            'unseen': 50.0
+        })
+    self.assertEqual(accumulator.service_ser(), {
+        'Buses_1': 50.0,
+        'Alarm_1': 50.0
+    })
+    self.assertEqual(
+        accumulator.slot_ser(), {
+            ('Buses_1', 'from_city'): 50.0,
+            ('Buses_1', 'to_city'): 0.0,
+            ('Alarm_1', 'name'): 100.0
+        })
+    self.assertFalse(
+        ser.example_ser(mrs[1], data['prediction'][1], _PERMISSIBLE_SLOTS))
+    slot_set = ser.get_ser_slot_set(_PERMISSIBLE_SLOTS)
+    self.assertEqual(
+        [ser.example_ser(mr, p, slot_set)
+         for mr, p in zip(mrs, data['prediction'])], [True, False, False, True])
+
+    data['prediction'].pop()
+    with self.assertRaises(ValueError):
+      ser.calculate_ser(data, _PERMISSIBLE_SLOTS)
+
+  def test_streaming_ser(self):
+    tempdir = self.create_tempdir().full_path
+    inputs_path = os.path.join(tempdir, 'inputs.tsv')
+    predictions_path = os.path.join(tempdir, 'predictions.txt')
+    mrs = [
+        _mr('Buses_1', {'from_city': ['Napa']}),
+        _mr('Alarm_1', {'name': ['Wake up']})
+    ]
+    with open(inputs_path, 'w') as f:
+      writer = csv.writer(f, delimiter='\t')
+      for idx, mr in enumerate(mrs):
+        writer.writerow(['input', 'target', json.dumps(mr), f'1_0000{idx}', 0])
+    with open(predictions_path, 'w') as f:
+      f.write('From napa.\nAlarm set.\n')
+
+    accumulator = ser.SerAccumulator(_PERMISSIBLE_SLOTS)
+    expected = {'overall': 50.0, 'seen': 0.0, 'unseen': 100.0}
+    self.assertEqual(
+        ser.calculate_streaming_ser(inputs_path, predictions_path,
+                                    _PERMISSIBLE_SLOTS, accumulator), expected)
+    self.assertEqual(accumulator.service_ser(), {
+        'Buses_1': 0.0,
+        'Alarm_1': 100.0
+    })
+    self.assertEqual(
+        ser.calculate_ser(
+            ser.prepare_data(inputs_path, predictions_path),
+            _PERMISSIBLE_SLOTS), expected)
+
+    with open(predictions_path, 'a') as f:
+      f.write('Extra.\n')
+    with self.assertRaises(ValueError):
+      ser.calculate_streaming_ser(inputs_path, predictions_path,
+                                  _PERMISSIBLE_SLOTS)
+
+
+if __name__ == '__main__':
+  absltest.main()
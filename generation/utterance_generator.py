@@ -22,6 +22,8 @@ of each action present in the turn.
 """
 
 import os
+import pickle
+import re
 
 VALUE_CHAR = "@"
 SEPARATOR = "!!"
@@ -36,6 +38,78 @@ ACT_PREFERENCE_ORDER = ("SELECT", "INFORM_COUNT", "NOTIFY_SUCCESS",
 INTENT_CONDITIONED_ACTS = frozenset(
     ["NOTIFY_FAILURE", "NOTIFY_SUCCESS", "INFORM_COUNT", "OFFER_INTENT"])
 
+_TEMPLATE_SUFFIX = ".tsv"
+
+# Template registries by absolute template directory.
+_REGISTRIES = {}
+
+
+def get_slot_is_categorical(schema):
+  """Returns a dict mapping each slot of a service schema to is_categorical."""
+  return {slot["name"]: slot["is_categorical"] for slot in schema["slots"]}
+
+
+def parse_template(template_str):
+  """Splits a template string into the literal text around each placeholder.
+
+  Args:
+    template_str: Template with one VALUE_CHAR per value to fill in.
+
+  Returns:
+    A tuple of the literal segments of the template, one more than the number
+    of placeholders.
+  """
+  return tuple(template_str.split(VALUE_CHAR))
+
+
+def fill_template(template, values):
+  """Fills the placeholders of a template parsed by `parse_template`.
+
+  Args:
+    template: The literal segments of the template.
+    values: The values to fill in, in order. Only the first `len(template) - 1`
+      values are used.
+
+  Returns:
+    The filled template string.
+
+  Raises:
+    ValueError: If there are fewer values than placeholders.
+  """
+  if len(values) < len(template) - 1:
+    raise ValueError(
+        f"Template {VALUE_CHAR.join(template)} needs {len(template) - 1} "
+        f"values, got {values}.")
+  parts = [template[0]]
+  for value, literal in zip(values, template[1:]):
+    parts.append(value)
+    parts.append(literal)
+  return "".join(parts)
+
+
+def delexicalize(utterance, value_to_replacement):
+  """Replaces all occurrences of the given values in a single pass.
+
+  All values are matched by one compiled alternation, longest values first, so
+  at each position the longest matching value is replaced. Replacements are
+  never matched again.
+
+  Args:
+    utterance: The utterance to delexicalize.
+    value_to_replacement: A dict mapping each non-empty value to its
+      replacement.
+
+  Returns:
+    The delexicalized utterance.
+  """
+  if not value_to_replacement:
+    return utterance
+  pattern = re.compile("|".join(
+      re.escape(value)
+      for value in sorted(value_to_replacement, key=len, reverse=True)))
+  return pattern.sub(lambda match: value_to_replacement[match.group(0)],
+                     utterance)
+
 
 def get_action_template(action, intent):
   """Returns a templatized representation of an action.
@@ -75,41 +149,106 @@ def get_action_template(action, intent):
   return SEPARATOR.join(parts)
 
 
+def _load_template_file(tsv_path):
+  """Loads and validates the templates of a service from a tsv file."""
+  act_key_to_template = {}
+  with open(tsv_path) as f:
+    for line in f:
+      columns = line.strip().split("\t")
+      if len(columns) != 2:
+        raise ValueError(
+            "Template row must have 2 columns in {}: {}".format(tsv_path, line))
+      act_key, template_str = columns
+      # Verify that the act_key and template_str are consistent.
+      if act_key.count(VALUE_CHAR) != template_str.count(VALUE_CHAR):
+        raise ValueError(
+            "Template not consistent. act_key: {} template: {}".format(
+                act_key, template_str))
+      act_key_to_template[act_key] = parse_template(template_str)
+  return act_key_to_template
+
+
+class TemplateRegistry:
+  """Parsed utterance templates of all services in a directory.
+
+  All `<service>.tsv` files are loaded and validated when the registry is
+  created. If `cache_path` is given, the parsed templates are also pickled to
+  it, together with the names, sizes and modification times of the tsv files,
+  and later registries load them from there while the tsv files are unchanged.
+  Use `get_template_registry` to share a registry within the process.
+  """
+
+  def __init__(self, template_dir, cache_path=None):
+    self._template_dir = template_dir
+    tsv_names = sorted(
+        f for f in os.listdir(template_dir) if f.endswith(_TEMPLATE_SUFFIX))
+    fingerprint = []
+    for tsv_name in tsv_names:
+      stat = os.stat(os.path.join(template_dir, tsv_name))
+      fingerprint.append((tsv_name, stat.st_size, stat.st_mtime_ns))
+
+    self._templates_for_service = None
+    if cache_path and os.path.exists(cache_path):
+      with open(cache_path, "rb") as f:
+        cached_fingerprint, templates_for_service = pickle.load(f)
+      if cached_fingerprint == fingerprint:
+        self._templates_for_service = templates_for_service
+    if self._templates_for_service is None:
+      self._templates_for_service = {
+          tsv_name[:-len(_TEMPLATE_SUFFIX)]:
+          _load_template_file(os.path.join(template_dir, tsv_name))
+          for tsv_name in tsv_names
+      }
+      if cache_path:
+        # Write to a temporary file first, so that concurrent runs never read
+        # a partial cache file.
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+          pickle.dump((fingerprint, self._templates_for_service), f)
+        os.replace(tmp_path, cache_path)
+
+  @property
+  def services(self):
+    return list(self._templates_for_service)
+
+  def get_templates(self, service):
+    """Returns a dict mapping act keys to the parsed templates of a service."""
+    if service not in self._templates_for_service:
+      raise ValueError("Templates not defined for service: {}.".format(service))
+    return self._templates_for_service[service]
+
+
+def get_template_registry(template_dir, cache_path=None):
+  """Returns the registry of a template directory, shared by the process."""
+  key = os.path.abspath(template_dir)
+  if key not in _REGISTRIES:
+    _REGISTRIES[key] = TemplateRegistry(template_dir, cache_path)
+  return _REGISTRIES[key]
+
+
 class TemplateUtteranceGenerator:
   """Generates template utterance for a dialogue turn."""
 
-  def __init__(self, template_dir, use_canonical_values=False):
-    self._template_dir = template_dir
-    self._templates_for_service = {}
+  def __init__(self, template_dir, use_canonical_values=False,
+               cache_path=None):
+    self._registry = get_template_registry(template_dir, cache_path)
     act_pref = {v: k for k, v in enumerate(ACT_PREFERENCE_ORDER)}
     # Key function used for sorting actions based on the preference order of
     # dialogue acts.
     self._act_key_fn = lambda action: act_pref.get(action["act"], len(act_pref))
     self._use_canonical_values = use_canonical_values
 
-  def _load_templates_for_service(self, service):
-    """Load utterance templates for a service from the tsv file."""
-    tsv_path = os.path.join(self._template_dir, "{}.tsv".format(service))
-    if not os.path.exists(tsv_path):
-      raise ValueError("Templates not defined for service: {}.".format(service))
-    act_key_to_template = {}
-    with open(tsv_path) as f:
-      for line in f:
-        act_key, template_str = line.strip().split("\t")
-        # Verify that the act_key and template_str are consistent.
-        if act_key.count(VALUE_CHAR) != template_str.count(VALUE_CHAR):
-          raise ValueError(
-              "Template not consistent. act_key: {} template: {}".format(
-                  act_key, template_str))
-        act_key_to_template[act_key] = template_str
-    self._templates_for_service[service] = act_key_to_template
-
   def _get_intent(self, action, frame):
     if action["act"] == "OFFER_INTENT" and action["slot"] == "intent":
       return action["values"][0]
     return frame.get("service_call", {}).get("method", None)
 
-  def _get_utterance_for_action(self, service, intent, action, schema=None):
+  def _get_utterance_for_action(self,
+                                service,
+                                intent,
+                                action,
+                                schema=None,
+                                slot_is_categorical=None):
     """Converts an action to an utterance and also identifies slot spans.
 
     Args:
@@ -117,46 +256,32 @@ class TemplateUtteranceGenerator:
       intent: The intent corresponding to the action.
       action: A json object containing a dialogue action.
       schema: if given API schema, do lexicalization based on the schema
+      slot_is_categorical: Optional output of `get_slot_is_categorical` for
+        `schema`, to avoid recomputing it.
 
     Returns:
       The robot utterance corresponding to the action.
     """
-    if service not in self._templates_for_service:
-      self._load_templates_for_service(service)
     act_key = get_action_template(action, intent)
-    template_dict = self._templates_for_service[service]
+    template_dict = self._registry.get_templates(service)
     if act_key not in template_dict:
       raise ValueError(f"Template not defined for {act_key} for {service}.")
     template = template_dict[act_key]
-    # Fill the placeholder characters in the template from action.
-    value_idx = 0
-    offset = 0
-    for idx, char in enumerate(template):
-      if char == VALUE_CHAR:
-        if self._use_canonical_values:
-          value = action["canonical_values"][value_idx]
-        else:
-          value = action["values"][value_idx]
-        if schema:
-          matched_slot = None
-          for slot in schema["slots"]:
-            if slot["name"] == action["slot"]:
-              matched_slot = slot
-          is_categorical = matched_slot[
-              "is_categorical"] if matched_slot else True
-          replacement = value if is_categorical else f"<{action['slot']}>"
-        else:
-          replacement = value
-        value_idx += 1
-      else:
-        continue
-
-      char_ind = idx + offset
-      template = template[:char_ind] + replacement + template[char_ind + 1:]
-      offset += len(replacement) - 1
-    return template
+    if schema and slot_is_categorical is None:
+      slot_is_categorical = get_slot_is_categorical(schema)
+    if self._use_canonical_values:
+      values = action["canonical_values"]
+    else:
+      values = action["values"]
+    if schema and not slot_is_categorical.get(action["slot"], True):
+      replacement = f"<{action['slot']}>"
+      values = [replacement] * len(values)
+    return fill_template(template, values)
 
-  def get_delexicalized_utterance(self, turn, schema=None):
+  def get_delexicalized_utterance(self,
+                                  turn,
+                                  schema=None,
+                                  slot_is_categorical=None):
     """Delexicalize target utterances.
 
     Delexicalize the turn utterance based on given service schema, now only
@@ -164,30 +289,42 @@ class TemplateUtteranceGenerator:
     For example, the utterance 'The restaurant is PizzaHut.' will be converted
     into 'The restaurant is <reataurant_name>.'
 
+    The values of all frames are replaced in a single pass over the utterance,
+    preferring the longest value at each position. A value shared by several
+    slots is replaced by the slot whose act comes first in
+    ACT_PREFERENCE_ORDER.
+
     Args:
       turn: turn object, containing utterance, action, slots information
-      schema: SGD service schema, indicating if the slot is categorical
+      schema: SGD service schema, indicating if the slot is categorical. If
+        None and `slot_is_categorical` is not given either, the values of all
+        slots are delexicalized.
+      slot_is_categorical: Optional output of `get_slot_is_categorical` for
+        `schema`, to avoid recomputing it.
 
     Returns:
       delexicalized utterance.
     """
-    delexicalized_utterance = turn["utterance"]
+    if slot_is_categorical is None and schema is not None:
+      slot_is_categorical = get_slot_is_categorical(schema)
+    value_to_replacement = {}
+    value_to_act_key = {}
     for frame in turn["frames"]:
-      for action in sorted(frame["actions"], key=self._act_key_fn):
+      for action in frame["actions"]:
+        slot = action["slot"]
+        if (slot_is_categorical is not None and
+            slot_is_categorical.get(slot, True)):
+          continue
+        act_key = self._act_key_fn(action)
         for value in action["values"]:
-          matched_slot = None
-          for slot in schema["slots"]:
-            if slot["name"] == action["slot"]:
-              matched_slot = slot
-          is_categorical = matched_slot[
-              "is_categorical"] if matched_slot else True
-          replacement = value if is_categorical else f"<{action['slot']}>"
-          delexicalized_utterance = delexicalized_utterance.replace(
-              value, replacement)
-
-      return delexicalized_utterance
-
-  def get_robot_utterance(self, turn, schema):
+          if not value:
+            continue
+          if value not in value_to_act_key or act_key < value_to_act_key[value]:
+            value_to_replacement[value] = f"<{slot}>"
+            value_to_act_key[value] = act_key
+    return delexicalize(turn["utterance"], value_to_replacement)
+
+  def get_robot_utterance(self, turn, schema, slot_is_categorical=None):
     """Get the robot utterance corresponding to a turn."""
     # Use templates to generate an utterance for each action. All utterances are
     # then concatenated to give the resulting system utterance.
@@ -202,7 +339,8 @@ class TemplateUtteranceGenerator:
         # Get the active intent corresponding to this action.
         intent = self._get_intent(action, frame)
         utterance = self._get_utterance_for_action(frame["service"], intent,
-                                                   action, schema)
+                                                   action, schema,
+                                                   slot_is_categorical)
 
         utterances.append(utterance)
     return " ".join(utterances)
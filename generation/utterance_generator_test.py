@@ -0,0 +1,168 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for utterance_generator."""
+
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from generation import utterance_generator
+
+_SCHEMA = {
+    "service_name": "Test_1",
+    "slots": [{
+        "name": "city",
+        "is_categorical": False
+    }, {
+        "name": "count",
+        "is_categorical": True
+    }]
+}
+
+
+class UtteranceGeneratorTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._template_dir = self.create_tempdir().full_path
+    self._write_templates("Test_1", [
+        "INFORM!!city!!@\tThe city is @.",
+        "INFORM!!count!!@@\t@ left, @ not.",
+        "GOODBYE\tBye.",
+    ])
+
+  def _write_templates(self, service, rows):
+    with open(os.path.join(self._template_dir, f"{service}.tsv"), "w") as f:
+      f.write("\n".join(rows) + "\n")
+
+  def test_fill_template(self):
+    template = utterance_generator.parse_template("@ and @ at @.")
+    self.assertEqual(
+        utterance_generator.fill_template(template, ["a@", "b", "c"]),
+        "a@ and b at c.")
+    with self.assertRaises(ValueError):
+      utterance_generator.fill_template(template, ["a", "b"])
+
+  def test_get_robot_utterance(self):
+    generator = utterance_generator.TemplateUtteranceGenerator(
+        self._template_dir)
+    turn = {
+        "frames": [{
+            "service": "Test_1",
+            "actions": [{
+                "act": "GOODBYE",
+                "slot": "",
+                "values": []
+            }, {
+                "act": "INFORM",
+                "slot": "city",
+                "values": ["Napa"]
+            }]
+        }]
+    }
+    self.assertEqual(
+        generator.get_robot_utterance(turn, None), "The city is Napa. Bye.")
+    self.assertEqual(
+        generator.get_robot_utterance(turn, _SCHEMA),
+        "The city is <city>. Bye.")
+
+  def test_delexicalize(self):
+    self.assertEqual(
+        utterance_generator.delexicalize("Napa Valley or Napa, <city>?", {
+            "Napa": "<city>",
+            "Napa Valley": "<area>",
+            "<city>": "<x>"
+        }), "<area> or <city>, <x>?")
+    self.assertEqual(utterance_generator.delexicalize("a.b", {}), "a.b")
+
+  def test_get_delexicalized_utterance(self):
+    generator = utterance_generator.TemplateUtteranceGenerator(
+        self._template_dir)
+    schema = {
+        "service_name": "Test_1",
+        "slots": _SCHEMA["slots"] + [{
+            "name": "area",
+            "is_categorical": False
+        }]
+    }
+    turn = {
+        "utterance": "2 places in San Jose and San Jose Hills.",
+        "frames": [{
+            "service": "Test_1",
+            "actions": [{
+                "act": "INFORM",
+                "slot": "city",
+                "values": ["San Jose"]
+            }, {
+                "act": "INFORM",
+                "slot": "count",
+                "values": ["2"]
+            }]
+        }, {
+            "service": "Test_1",
+            "actions": [{
+                "act": "OFFER",
+                "slot": "area",
+                "values": ["San Jose Hills", "San Jose"]
+            }]
+        }]
+    }
+    # Values of all frames are replaced, the longest one first. INFORM is
+    # preferred over OFFER for the value shared by two slots.
+    self.assertEqual(
+        generator.get_delexicalized_utterance(turn, schema),
+        "2 places in <city> and <area>.")
+    # Without a schema, categorical slots are delexicalized too.
+    self.assertEqual(
+        generator.get_delexicalized_utterance(turn),
+        "<count> places in <city> and <area>.")
+
+  def test_registry_is_shared_and_cached(self):
+    cache_path = os.path.join(self.create_tempdir().full_path, "templates.pkl")
+    registry = utterance_generator.TemplateRegistry(self._template_dir,
+                                                    cache_path)
+    self.assertEqual(registry.services, ["Test_1"])
+    with self.assertRaises(ValueError):
+      registry.get_templates("Other_1")
+
+    with mock.patch.object(
+        utterance_generator,
+        "_load_template_file",
+        side_effect=AssertionError("Not loaded from cache.")):
+      cached_registry = utterance_generator.TemplateRegistry(
+          self._template_dir, cache_path)
+    self.assertEqual(
+        cached_registry.get_templates("Test_1"),
+        registry.get_templates("Test_1"))
+
+    # Modified templates invalidate the cache.
+    self._write_templates("Test_1", ["GOODBYE\tSee you."])
+    registry = utterance_generator.TemplateRegistry(self._template_dir,
+                                                    cache_path)
+    self.assertEqual(
+        registry.get_templates("Test_1"), {"GOODBYE": ("See you.",)})
+
+    self.assertIs(
+        utterance_generator.get_template_registry(self._template_dir),
+        utterance_generator.get_template_registry(self._template_dir + "/"))
+
+  def test_inconsistent_template(self):
+    self._write_templates("Test_2", ["INFORM!!city!!@\tThe city."])
+    with self.assertRaisesRegex(ValueError, "Template not consistent"):
+      utterance_generator.TemplateRegistry(self._template_dir)
+
+
+if __name__ == "__main__":
+  absltest.main()
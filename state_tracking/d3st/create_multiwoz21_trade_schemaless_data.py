@@ -23,7 +23,9 @@ import string
 from typing import Dict, List, Set
 
 from absl import flags
+from state_tracking.utils import history_utils
 from state_tracking.utils import multiwoz_utils
+from state_tracking.utils import progress_utils
 from state_tracking.utils import text_to_text_utils
 import tensorflow as tf
 
@@ -60,6 +62,17 @@ flags.DEFINE_list(
     'if set. This is used to run zero-shot '
     'cross-domain experiments as in paper '
     'https://aclanthology.org/2021.naacl-main.448.pdf.')
+flags.DEFINE_bool(
+    'use_cache', False, 'If true, cache the parsed input data next to it, to '
+    'speed up later runs.')
+flags.DEFINE_integer(
+    'verbose_examples', 0, 'Number of generated examples to log in full, '
+    'for debugging.')
+flags.DEFINE_integer(
+    'num_shards', 1, 'Number of TFRecord shards to write per split. If '
+    'greater than 1, shards are named <split>.tfrecord-00000-of-<num_shards>.')
+flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes serializing output examples.')
 
 # Use OrderedDict for JSON to preserve field order.
 Json = collections.OrderedDict
@@ -213,7 +226,7 @@ def create_schemaless_data(json_data: Json, schema_info: SchemaInfo,
 
   examples = []
   for dialog_id, dialog_json in json_data.items():
-    history_str = ''
+    history = history_utils.DialogueHistory()
 
     for turn, utterance_json in enumerate(dialog_json['dialogue']):
       sys_utt = utterance_json['system_transcript'].strip().replace('\t', ' ')
@@ -222,14 +235,14 @@ def create_schemaless_data(json_data: Json, schema_info: SchemaInfo,
           metadata_json=utterance_json['belief_state'], is_trade=True)
       domains_in_turn = multiwoz_utils.extract_domains(belief_state)
       if turn == 0:
-        history_str += f'[user] {user_utt} '
+        history.append(f'[user] {user_utt}')
       else:
-        history_str += f'[system] {sys_utt} [user] {user_utt} '
+        history.append(f'[system] {sys_utt} [user] {user_utt}')
 
       if options.blocked_domains & domains_in_turn:
         continue
       examples.append(
-          _process_one_turn(dialog_id, turn, belief_state, history_str,
+          _process_one_turn(dialog_id, turn, belief_state, history.render(),
                             domains_in_turn, slot_descriptions))
 
   return examples
@@ -237,8 +250,15 @@ def create_schemaless_data(json_data: Json, schema_info: SchemaInfo,
 
 def main(_):
   random.seed(FLAGS.random_seed)
-  multiwoz_data = multiwoz_utils.load_data(
-      data_path=FLAGS.multiwoz_dir, multiwoz_version='2.1', is_trade=True)
+  reporter = progress_utils.ProgressReporter(
+      'create_multiwoz21_trade_schemaless_data',
+      num_verbose_examples=FLAGS.verbose_examples)
+  with reporter.stage('load'):
+    multiwoz_data = multiwoz_utils.load_data(
+        data_path=FLAGS.multiwoz_dir,
+        multiwoz_version='2.1',
+        is_trade=True,
+        use_cache=FLAGS.use_cache)
   schema_info = multiwoz_utils.load_schema(FLAGS.schema_file)
   options = Options(
       description_type=FLAGS.description_type,
@@ -247,23 +267,29 @@ def main(_):
       use_active_domains_only=FLAGS.use_active_domains_only,
       blocked_domains=set(FLAGS.blocked_domains))
 
-  split_to_examples = {
-      'train':
-          create_schemaless_data(multiwoz_data.train_json, schema_info,
-                                 multiwoz_data.slot_descriptions, options),
-      'dev':
-          create_schemaless_data(multiwoz_data.dev_json, schema_info,
-                                 multiwoz_data.slot_descriptions, options),
-      'test':
-          create_schemaless_data(multiwoz_data.test_json, schema_info,
-                                 multiwoz_data.slot_descriptions, options),
+  split_to_json = {
+      'train': multiwoz_data.train_json,
+      'dev': multiwoz_data.dev_json,
+      'test': multiwoz_data.test_json,
   }
+  split_to_examples = {}
+  for split, json_data in split_to_json.items():
+    with reporter.stage('convert'):
+      split_to_examples[split] = create_schemaless_data(
+          json_data, schema_info, multiwoz_data.slot_descriptions, options)
+    reporter.add_dialogues(len(json_data))
   split_to_examples['dev_test'] = (
       split_to_examples['dev'] + split_to_examples['test'])
 
   for split, examples in split_to_examples.items():
-    text_to_text_utils.write_data(
-        examples, os.path.join(FLAGS.output_dir, f'{split}.tfrecord'))
+    with reporter.stage('write'):
+      text_to_text_utils.write_data(
+          examples,
+          os.path.join(FLAGS.output_dir, f'{split}.tfrecord'),
+          reporter,
+          num_shards=FLAGS.num_shards,
+          num_workers=FLAGS.num_workers)
+  reporter.log_progress()
 
 
 if __name__ == '__main__':
@@ -27,7 +27,9 @@ from typing import Dict, List, Set
 from absl import app
 from absl import flags
 from absl import logging
+from state_tracking.utils import history_utils
 from state_tracking.utils import multiwoz_utils
+from state_tracking.utils import progress_utils
 from state_tracking.utils import text_to_text_utils
 
 FLAGS = flags.FLAGS
@@ -68,6 +70,17 @@ flags.DEFINE_list(
 flags.DEFINE_bool(
     'use_target_separators', False,
     'If true, separate target slot-value pairs using ;.')
+flags.DEFINE_bool(
+    'use_cache', False, 'If true, cache the parsed input data next to it, to '
+    'speed up later runs.')
+flags.DEFINE_integer(
+    'verbose_examples', 0, 'Number of generated examples to log in full, '
+    'for debugging.')
+flags.DEFINE_integer(
+    'num_shards', 1, 'Number of TFRecord shards to write per split. If '
+    'greater than 1, shards are named <split>.tfrecord-00000-of-<num_shards>.')
+flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes serializing output examples.')
 
 Json = multiwoz_utils.Json
 SchemaInfo = multiwoz_utils.SchemaInfo
@@ -232,7 +245,7 @@ def create_schemaless_data(dialogs_by_id: Dict[str,
 
   examples = []
   for dialog_id, dialog in dialogs_by_id.items():
-    history_str = ''
+    history = history_utils.DialogueHistory()
 
     for turn_num, turn in enumerate(dialog.turns):
       is_system = turn_num % 2 == 1
@@ -246,19 +259,25 @@ def create_schemaless_data(dialogs_by_id: Dict[str,
         if domains_in_turn & options.blocked_domains:
           continue
         examples.append(
-            _process_one_turn(dialog_id, turn_num, belief_state, history_str,
-                              domains_in_turn, slot_descriptions))
-      history_str += f'[{speaker}] {utterance} '
+            _process_one_turn(dialog_id, turn_num, belief_state,
+                              history.render(), domains_in_turn,
+                              slot_descriptions))
+      history.append(f'[{speaker}] {utterance}')
 
   return examples
 
 
 def main(_):
   random.seed(FLAGS.random_seed)
-  multiwoz_data = multiwoz_utils.load_data_as_dataclasses(
-      data_path=FLAGS.multiwoz_dir,
-      multiwoz_version=FLAGS.multiwoz_version,
-      is_trade=False)
+  reporter = progress_utils.ProgressReporter(
+      'create_multiwoz_schemaless_data',
+      num_verbose_examples=FLAGS.verbose_examples)
+  with reporter.stage('load'):
+    multiwoz_data = multiwoz_utils.load_data_as_dataclasses(
+        data_path=FLAGS.multiwoz_dir,
+        multiwoz_version=FLAGS.multiwoz_version,
+        is_trade=False,
+        use_cache=FLAGS.use_cache)
   schema_info = multiwoz_utils.load_schema(FLAGS.schema_file)
   options = Options(
       multiwoz_version=FLAGS.multiwoz_version,
@@ -269,23 +288,29 @@ def main(_):
       blocked_domains=set(FLAGS.blocked_domains),
       use_target_separators=FLAGS.use_target_separators)
 
-  split_to_examples = {
-      'train':
-          create_schemaless_data(multiwoz_data.train_dialogs, schema_info,
-                                 multiwoz_data.slot_descriptions, options),
-      'dev':
-          create_schemaless_data(multiwoz_data.dev_dialogs, schema_info,
-                                 multiwoz_data.slot_descriptions, options),
-      'test':
-          create_schemaless_data(multiwoz_data.test_dialogs, schema_info,
-                                 multiwoz_data.slot_descriptions, options)
+  split_to_dialogs = {
+      'train': multiwoz_data.train_dialogs,
+      'dev': multiwoz_data.dev_dialogs,
+      'test': multiwoz_data.test_dialogs,
   }
+  split_to_examples = {}
+  for split, dialogs in split_to_dialogs.items():
+    with reporter.stage('convert'):
+      split_to_examples[split] = create_schemaless_data(
+          dialogs, schema_info, multiwoz_data.slot_descriptions, options)
+    reporter.add_dialogues(len(dialogs))
   split_to_examples['dev_test'] = (
       split_to_examples['dev'] + split_to_examples['test'])
 
   for split, examples in split_to_examples.items():
-    text_to_text_utils.write_data(
-        examples, os.path.join(FLAGS.output_dir, f'{split}.tfrecord'))
+    with reporter.stage('write'):
+      text_to_text_utils.write_data(
+          examples,
+          os.path.join(FLAGS.output_dir, f'{split}.tfrecord'),
+          reporter,
+          num_shards=FLAGS.num_shards,
+          num_workers=FLAGS.num_workers)
+  reporter.log_progress()
 
 
 if __name__ == '__main__':
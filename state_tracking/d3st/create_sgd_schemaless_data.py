@@ -24,15 +24,19 @@ This is version 2, which generates the schemaless data format:
 [req_slots] m n...
 """
 import collections
+import contextlib
 import copy
 import dataclasses
 import json
+import multiprocessing
 import os
 import random
 import string
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from absl import app
 from absl import flags
+from state_tracking.utils import history_utils
+from state_tracking.utils import progress_utils
 
 import tensorflow as tf
 
@@ -71,29 +75,101 @@ flags.DEFINE_float('data_percent', 0.0, 'If not 0, the percentage of data to '
 flags.DEFINE_bool(
     'uniform_domain_distribution', False, 'When data_percent > 0'
     ' make sure domains are (close-to) uniform distribution.')
+flags.DEFINE_integer(
+    'random_seed', None, 'Random seed. If set, each dialogue is converted with '
+    'its own RNG seeded by this value and the dialogue ID, so output does not '
+    'depend on num_workers. If None, random is not seeded.')
+flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes used to convert dialogues. If 1, '
+    'dialogues are converted in the main process.')
+flags.DEFINE_integer(
+    'num_shards', 1, 'Number of output shards. If greater than 1, output is '
+    'written to <output_file>-00000-of-<num_shards> etc., and dialogues are '
+    'assigned to shards round-robin.')
+flags.DEFINE_integer(
+    'verbose_examples', 0, 'Number of generated examples to log in full, '
+    'for debugging.')
+
+# Number of dialogues sent to a worker process at once.
+_DIALOGUES_PER_TASK = 16
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class TurnInfo:
+  """Immutable snapshot of the information needed to write one example.
+
+  Snapshots are taken from a TurnState once a turn has been processed. Since
+  they can't change afterwards, they can be kept (e.g. for sampling) and shared
+  between frames without copying.
+  """
+  out_ctx_with_desc_str: str
+  out_state_str: str
+  out_act_str: str
+  out_intent_str: str
+  curr_utt: str
+  user_turn: bool
+  turn_domain: str
+  dialogue_id: str
+  turn_id: str
+  frame_id: str
 
 
 @dataclasses.dataclass
-class TurnInfo:
-  """Information extracted from dialog turns."""
+class TurnState:
+  """Information accumulated over the turns of a dialogue."""
   out_ctx_str: str = ''
   out_ctx_with_desc_str: str = ''
   out_state_str: str = ''
   out_act_str: str = ''
   prev_state_str: str = ''
-  delta_state_str: str = ''
-  prev_sys_response: str = ''
-  history_states: str = ''
-  curr_user_utt: str = ''
   out_intent_str: str = ''
-  new_states: str = ''
-  new_intents: str = ''
   curr_utt: str = ''
   user_turn: bool = False
   turn_domain: str = ''
   dialogue_id: str = ''
   turn_id: str = ''
   frame_id: str = ''
+  ctx_history: history_utils.DialogueHistory = dataclasses.field(
+      default_factory=lambda: history_utils.DialogueHistory(separator=''))
+
+  def snapshot(self) -> TurnInfo:
+    return TurnInfo(
+        out_ctx_with_desc_str=self.out_ctx_with_desc_str,
+        out_state_str=self.out_state_str,
+        out_act_str=self.out_act_str,
+        out_intent_str=self.out_intent_str,
+        curr_utt=self.curr_utt,
+        user_turn=self.user_turn,
+        turn_domain=self.turn_domain,
+        dialogue_id=self.dialogue_id,
+        turn_id=self.turn_id,
+        frame_id=self.frame_id)
+
+
+@dataclasses.dataclass
+class DomainSchema:
+  """Schema items of a single domain, precompiled for prompt construction.
+
+  Descriptions and possible values are rendered according to
+  FLAGS.data_format and FLAGS.lowercase.
+
+  Attributes:
+    slots: Names of the slots in this domain, in schema order.
+    slot_descs: Rendered description of each slot.
+    slot_possible_values: Possible values of each slot if it is prompted as
+      multiple choice, else an empty list.
+    slot_possible_values_descs: Rendered possible values of each slot.
+    intents: Names of the intents in this domain, in schema order.
+    intent_descs: Rendered description of each intent.
+  """
+  slots: List[str] = dataclasses.field(default_factory=list)
+  slot_descs: List[str] = dataclasses.field(default_factory=list)
+  slot_possible_values: List[List[str]] = dataclasses.field(
+      default_factory=list)
+  slot_possible_values_descs: List[List[str]] = dataclasses.field(
+      default_factory=list)
+  intents: List[str] = dataclasses.field(default_factory=list)
+  intent_descs: List[str] = dataclasses.field(default_factory=list)
 
 
 def _merge_domain_slot(domain: str, slot_name: str):
@@ -103,6 +179,66 @@ def _merge_domain_slot(domain: str, slot_name: str):
 SchemaInfo = Dict[str, Dict]
 
 
+def _maybe_lowercase(s: str) -> str:
+  return s.lower() if FLAGS.lowercase else s
+
+
+def _compile_domain_schemas(item_desc: SchemaInfo) -> Dict[str, DomainSchema]:
+  """Groups schema items by domain and renders their descriptions once.
+
+  Args:
+    item_desc: A dictionary of schema items and their descriptions.
+
+  Returns:
+    A dictionary mapping each domain (service) to its DomainSchema.
+  """
+  domain_schemas = {}
+  domains = {
+      item.split('-')[0]
+      for item in (*item_desc['slots'], *item_desc['intents'])
+  }
+  for domain in domains:
+    domain_schema = DomainSchema()
+    for slot in item_desc['slots']:
+      # Only consider slots in the utterance domain.
+      if domain not in slot.split('-')[0]:
+        continue
+      if FLAGS.data_format == 'full_desc':
+        desc = item_desc['slots'][slot]
+      elif FLAGS.data_format == 'item_name':
+        desc = slot
+      elif FLAGS.data_format == 'rand_name':
+        desc = item_desc['slots_rand_name'][slot]
+
+      possible_values = []
+      if FLAGS.multiple_choice != 'none' and item_desc['is_categorical'][slot]:
+        # Copied, so that prompts never reorder the shared schema. Values are
+        # shuffled through an index permutation instead.
+        possible_values = list(item_desc['possible_values'][slot])
+        assert len(possible_values) < len(string.ascii_lowercase)
+
+      domain_schema.slots.append(slot)
+      domain_schema.slot_descs.append(_maybe_lowercase(desc))
+      domain_schema.slot_possible_values.append(possible_values)
+      domain_schema.slot_possible_values_descs.append(
+          [_maybe_lowercase(value) for value in possible_values])
+
+    for intent in item_desc['intents']:
+      # Only consider intents in the utterance domain.
+      if domain not in intent:
+        continue
+      if FLAGS.data_format == 'full_desc':
+        desc = item_desc['intents'][intent]
+      if FLAGS.data_format == 'item_name':
+        desc = intent
+      elif FLAGS.data_format == 'rand_name':
+        desc = item_desc['intents_rand_name'][intent]
+      domain_schema.intents.append(intent)
+      domain_schema.intent_descs.append(_maybe_lowercase(desc))
+    domain_schemas[domain] = domain_schema
+  return domain_schemas
+
+
 def load_schema() -> Tuple[collections.OrderedDict, SchemaInfo]:
   """Loads schema items and descriptions.
 
@@ -170,10 +306,11 @@ def load_schema() -> Tuple[collections.OrderedDict, SchemaInfo]:
             for intent in schema['intents']
         })
         # pylint: enable=g-complex-comprehension
+  item_desc['domains'] = _compile_domain_schemas(item_desc)
   return slots, item_desc
 
 
-def _process_user_turn(state: Dict[str, Any], turn_info: TurnInfo,
+def _process_user_turn(state: Dict[str, Any], turn_info: TurnState,
                        cumu_slots: collections.OrderedDict, domain: str,
                        item_desc: SchemaInfo,
                        state_dict: Dict[str, List[str]]) -> Dict[str, int]:
@@ -181,7 +318,7 @@ def _process_user_turn(state: Dict[str, Any], turn_info: TurnInfo,
 
   Args:
     state: A dictionary containing state info.
-    turn_info: A TurnInfo object accmulating essential info from each turn.
+    turn_info: A TurnState object accmulating essential info from each turn.
     cumu_slots: An OrderedDict containing cmumulative slot information.
     domain: A string, domain (service) of the turn.
     item_desc: A dictionary of items and their descriptions.
@@ -205,91 +342,73 @@ def _process_user_turn(state: Dict[str, Any], turn_info: TurnInfo,
 
   # Clean up.
   desc_to_slot_id = {}
-  slots = list(item_desc['slots'].keys())
+  domain_schema = item_desc['domains'].get(domain, DomainSchema())
+  slot_order = list(range(len(domain_schema.slots)))
   if FLAGS.randomize_items:
-    random.shuffle(slots)
+    random.shuffle(slot_order)
   # In multi-domain turn case, desc_prefix already contains desc from the
   # previous domain.
   slot_id = len(state_dict['slot_desc'])
-  for slot in slots:
-    if FLAGS.data_format == 'full_desc':
-      desc = item_desc['slots'][slot]
-    elif FLAGS.data_format == 'item_name':
-      desc = slot
-    elif FLAGS.data_format == 'rand_name':
-      desc = item_desc['slots_rand_name'][slot]
+  letters = string.ascii_lowercase
+  for slot_idx in slot_order:
+    slot = domain_schema.slots[slot_idx]
+    desc = domain_schema.slot_descs[slot_idx]
 
     # If we are generating with multiple choice, append this prompt.
-    if FLAGS.multiple_choice != 'none' and item_desc['is_categorical'][slot]:
-      possible_values = item_desc['possible_values'][slot]
+    possible_values = domain_schema.slot_possible_values[slot_idx]
+    if possible_values:
+      value_order = list(range(len(possible_values)))
       if FLAGS.randomize_items:
-        random.shuffle(possible_values)
-      assert len(possible_values) < len(string.ascii_lowercase)
-      letters = list(string.ascii_lowercase)
+        random.shuffle(value_order)
+      possible_values_descs = domain_schema.slot_possible_values_descs[slot_idx]
 
       possible_values_pieces = []
-      for letter, value in zip(letters, possible_values):
+      for letter, value_idx in zip(letters, value_order):
+        value_desc = possible_values_descs[value_idx]
         if FLAGS.multiple_choice == '1a':
-          possible_values_pieces.append(f'{slot_id}{letter}) {value}')
+          possible_values_pieces.append(f'{slot_id}{letter}) {value_desc}')
         elif FLAGS.multiple_choice == 'a':
-          possible_values_pieces.append(f'{letter}) {value}')
+          possible_values_pieces.append(f'{letter}) {value_desc}')
       desc += ' ' + ' '.join(possible_values_pieces)
 
-    # Only consider slots in the utterance domain.
-    if domain in slot.split('-')[0]:
-      # Description prefix to be included in each turn.
-      t = f' {slot_id}{FLAGS.delimiter}'
-      desc_to_slot_id[slot] = slot_id
-      state_dict['slot_desc'].append(t + desc.lower() +
-                                     ' ' if FLAGS.lowercase else t + desc + ' ')
-
-      state_str = ''
-      # Corresponding values for active slots.
-      if cumu_slots[slot]:
-        value = cumu_slots[slot]
-        if (FLAGS.multiple_choice != 'none' and
-            item_desc['is_categorical'][slot] and value != 'dontcare'):
-          # Convert to multiple choice for categorical slots.
-          assert value in possible_values
-          state_str = t + str(slot_id) + letters[possible_values.index(value)]
-        else:
-          state_str = t + value
-
-      turn_info.out_state_str += (
-          state_str.lower() if FLAGS.lowercase else state_str)
-      turn_info.turn_domain = domain
-      slot_id += 1
+    # Description prefix to be included in each turn.
+    t = f' {slot_id}{FLAGS.delimiter}'
+    desc_to_slot_id[slot] = slot_id
+    state_dict['slot_desc'].append(t + desc + ' ')
+
+    state_str = ''
+    # Corresponding values for active slots.
+    if cumu_slots[slot]:
+      value = cumu_slots[slot]
+      if possible_values and value != 'dontcare':
+        # Convert to multiple choice for categorical slots.
+        assert value in possible_values
+        letter = letters[value_order.index(possible_values.index(value))]
+        state_str = t + str(slot_id) + letter
+      else:
+        state_str = t + value
+
+    turn_info.out_state_str += _maybe_lowercase(state_str)
+    turn_info.turn_domain = domain
+    slot_id += 1
 
   # Handle intents.
   # In multi-domain turn case, intent list already contains intents from the
   # previous domain.
-  intents = list(item_desc['intents'].keys())
+  intent_order = list(range(len(domain_schema.intents)))
   if FLAGS.randomize_items:
-    random.shuffle(intents)
+    random.shuffle(intent_order)
   intent_id = len(state_dict['intent_desc'])
-  for intent in intents:
-    if FLAGS.data_format == 'full_desc':
-      desc = item_desc['intents'][intent]
-    if FLAGS.data_format == 'item_name':
-      desc = intent
-    elif FLAGS.data_format == 'rand_name':
-      desc = item_desc['intents_rand_name'][intent]
-
-    # Only consider slots in the utterance domain.
-    if domain in intent:
-      active_intent = domain + '-' + state['active_intent']
-      # Description prefix to be included in each turn.
-      t = f' i{intent_id}{FLAGS.delimiter}'
-      intent_str = ''
-      if active_intent == intent:
-        intent_str = ' ' + t[:-1]
-
-      state_dict['intent_desc'].append(t + desc.lower() +
-                                       ' ' if FLAGS.lowercase else t + desc +
-                                       ' ')
-      if intent_str:
-        state_dict['intent_ids'].append(intent_str)
-      intent_id += 1
+  active_intent = domain + '-' + state['active_intent']
+  for intent_idx in intent_order:
+    intent = domain_schema.intents[intent_idx]
+    desc = domain_schema.intent_descs[intent_idx]
+    # Description prefix to be included in each turn.
+    t = f' i{intent_id}{FLAGS.delimiter}'
+    state_dict['intent_desc'].append(t + desc + ' ')
+    if active_intent == intent:
+      state_dict['intent_ids'].append(' ' + t[:-1])
+    intent_id += 1
 
   # Handle requested slots.
   for req_slot in state['requested_slots']:
@@ -304,13 +423,13 @@ def _process_user_turn(state: Dict[str, Any], turn_info: TurnInfo,
   return desc_to_slot_id
 
 
-def _process_agent_turn(actions: List[Dict[str, Any]], turn_info: TurnInfo,
+def _process_agent_turn(actions: List[Dict[str, Any]], turn_info: TurnState,
                         domain: str, desc_to_slot_id: Dict[str, int]) -> None:
   """Updates turn_info based on the system actions.
 
   Args:
     actions: A list of strings for system actions.
-    turn_info: A Turninfo object accmulating essential info from each turn.
+    turn_info: A TurnState object accmulating essential info from each turn.
     domain: A string, domain (service) of the current turn.
     desc_to_slot_id: A dictionary that maps descriptions to slot ids.
   """
@@ -339,14 +458,15 @@ def _process_agent_turn(actions: List[Dict[str, Any]], turn_info: TurnInfo,
     turn_info.out_act_str = turn_info.out_act_str.lower()
 
 
-def process_turn(turn: Dict[str, Any], turn_info: TurnInfo,
-                 cumu_slots: collections.OrderedDict, item_desc: SchemaInfo,
-                 prefix: str, turn_id: int) -> str:
+def process_turn(
+    turn: Dict[str, Any], turn_info: TurnState,
+    cumu_slots: collections.OrderedDict, item_desc: SchemaInfo, prefix: str,
+    turn_id: int) -> Tuple[str, List[TurnInfo]]:
   """Collects information from a single turn.
 
   Args:
     turn: A dictionary containing original turn structure.
-    turn_info: A dictionary accmulating essential info from each turn.
+    turn_info: A TurnState object accmulating essential info from each turn.
     cumu_slots: An OrderedDict containing cumumulative slot information.
     item_desc: A dictionary of scheam items and their descriptions.
     prefix: A string of the schema item description prefix.
@@ -354,18 +474,16 @@ def process_turn(turn: Dict[str, Any], turn_info: TurnInfo,
 
   Returns:
     Prefix string (item descriptions) from the current turn and per-frame
-    TurnInfo objects.
+    TurnInfo snapshots.
   """
   speaker = turn['speaker'].lower()
   user_turn = speaker == 'user'
   turn_info.user_turn = user_turn
   utt = turn['utterance']
-  turn_info.curr_utt = f'[{speaker}] {utt} '
-  turn_info.out_ctx_str += f'[{speaker}] {utt} '
+  turn_info.curr_utt = _maybe_lowercase(f'[{speaker}] {utt} ')
+  turn_info.ctx_history.append(turn_info.curr_utt)
+  turn_info.out_ctx_str = turn_info.ctx_history.render()
   turn_info.turn_id = str(turn_id)
-  if FLAGS.lowercase:
-    turn_info.curr_utt = turn_info.curr_utt.lower()
-    turn_info.out_ctx_str = turn_info.out_ctx_str.lower()
   # Intent and act strings are not accumulative.
   turn_info.out_act_str = ''
   if user_turn:
@@ -373,7 +491,6 @@ def process_turn(turn: Dict[str, Any], turn_info: TurnInfo,
     turn_info.out_intent_str = '[intents]'
 
   desc_to_slot_id = {}
-  turn_info_per_frame = []
   for frame_id, frames in enumerate(turn['frames']):
     domain = frames['service']
     turn_info.frame_id = str(frame_id)
@@ -409,17 +526,21 @@ def process_turn(turn: Dict[str, Any], turn_info: TurnInfo,
     turn_info.out_intent_str += ''.join(state_dict['intent_ids'])
     turn_info.out_intent_str += ' [req_slots] '
     turn_info.out_intent_str += ' '.join(state_dict['req_slots'])
-    turn_info_per_frame.append(turn_info)
 
-  return user_turn_prefix, turn_info_per_frame
+  # All frames of a turn share the state reached after its last frame.
+  return user_turn_prefix, [turn_info.snapshot()] * len(turn['frames'])
 
 
-def write_examples(turn_list: List[TurnInfo], out_file: tf.io.gfile.GFile) -> None:
+def write_examples(
+    turn_list: Iterable[TurnInfo],
+    out_file: tf.io.gfile.GFile,
+    reporter: Optional[progress_utils.ProgressReporter] = None) -> None:
   """Format output example strings and write to file.
 
   Args:
-    turn_list: A list of dict accmulating essential info from each turn.
+    turn_list: An iterable of TurnInfo snapshots, one per example.
     out_file: A GFile object for file output.
+    reporter: If set, counts the written examples and bytes.
   """
   for turn_info in turn_list:
     # Write samples to file. Each example is divided into two parts
@@ -428,6 +549,7 @@ def write_examples(turn_list: List[TurnInfo], out_file: tf.io.gfile.GFile) -> No
     src = turn_info.out_ctx_with_desc_str
     tgt = ''
 
+    curr_utt = turn_info.curr_utt
     if FLAGS.level == 'dst':
       if turn_info.user_turn:
         # Only output at user turns.
@@ -439,11 +561,10 @@ def write_examples(turn_list: List[TurnInfo], out_file: tf.io.gfile.GFile) -> No
       if not turn_info.user_turn:
         # Only output at system turns, including:
         # state + action + responses
-        turn_info.curr_utt = turn_info.curr_utt.replace('[system]',
-                                                        '[response]')
+        curr_utt = curr_utt.replace('[system]', '[response]')
         tgt = ' '.join([
             turn_info.out_state_str, turn_info.out_intent_str,
-            turn_info.out_act_str, turn_info.curr_utt
+            turn_info.out_act_str, curr_utt
         ])
 
     if tgt:
@@ -454,93 +575,293 @@ def write_examples(turn_list: List[TurnInfo], out_file: tf.io.gfile.GFile) -> No
                  f'{turn_info.frame_id}')
       if FLAGS.lowercase:
         example = example.lower()
-      print(example)
-      out_file.write('{}\n'.format(example.strip()))
+      line = '{}\n'.format(example.strip())
+      out_file.write(line)
+      if reporter:
+        reporter.add_example(example, len(line.encode('utf-8')))
+
 
+def _iter_dialogues() -> Iterator[Dict[str, Any]]:
+  """Yields dialogues from all SGD files, holding one file in memory at once."""
+  for sgd_file in tf.io.gfile.glob(FLAGS.sgd_file):
+    with tf.io.gfile.GFile(sgd_file) as sgd_in:
+      yield from json.load(sgd_in)
 
-def example_filter(turn_list: List[TurnInfo]):
-  """Extract specified percentage of examples.
 
-  And ensure uniform domain distribution if specified.
+def _iter_turn_infos(dlg: Dict[str, Any],
+                     ordered_slots: collections.OrderedDict,
+                     item_desc: SchemaInfo) -> Iterator[TurnInfo]:
+  """Yields per-frame TurnInfo snapshots for a single dialogue.
 
   Args:
-    turn_list: A list of TurnInfo containing all examples.
+    dlg: A dictionary containing the original dialogue structure.
+    ordered_slots: An ordered dictionary containing slot names.
+    item_desc: A dictionary containing items and their descriptions.
+
+  Yields:
+    A TurnInfo for each frame of each turn in the dialogue.
+  """
+  # Cumulative states throughout this dialog.
+  cumu_slots = copy.deepcopy(ordered_slots)
+  turn_info = TurnState()
+  turn_info.dialogue_id = dlg['dialogue_id']
+  prefix = ''
+  for turn_idx, turn in enumerate(dlg['turns']):
+    prefix, per_frame_turn_info = process_turn(turn, turn_info, cumu_slots,
+                                               item_desc, prefix, turn_idx)
+    yield from per_frame_turn_info
+
+
+# Schema used by `_convert_dialogue`, set by `_init_converter` in each process.
+_converter_schema = None
+
+
+def _init_converter(flag_values: Dict[str, Any],
+                    ordered_slots: collections.OrderedDict,
+                    item_desc: SchemaInfo) -> None:
+  """Sets up a (possibly worker) process for `_convert_dialogue`.
+
+  Args:
+    flag_values: Flag values of the main process, only applied if flags were
+      not inherited (i.e. the process was not forked).
+    ordered_slots: An ordered dictionary containing slot names.
+    item_desc: A dictionary containing items and their descriptions.
+  """
+  global _converter_schema
+  if not FLAGS.is_parsed():
+    for name, value in flag_values.items():
+      if name in FLAGS:
+        FLAGS[name].value = value
+    FLAGS.mark_as_parsed()
+  _converter_schema = (ordered_slots, item_desc)
+
+
+def _convert_dialogue(dlg: Dict[str, Any]) -> List[TurnInfo]:
+  """Converts a single dialogue into per-frame TurnInfo snapshots."""
+  if FLAGS.random_seed is not None:
+    random.seed(f'{FLAGS.random_seed}:{dlg["dialogue_id"]}')
+  ordered_slots, item_desc = _converter_schema
+  return list(_iter_turn_infos(dlg, ordered_slots, item_desc))
+
+
+def _iter_converted_dialogues(
+    ordered_slots: collections.OrderedDict,
+    item_desc: SchemaInfo) -> Iterator[List[TurnInfo]]:
+  """Yields the per-frame TurnInfo objects of each dialogue, in input order.
+
+  Uses a pool of FLAGS.num_workers processes if more than one worker is
+  requested.
+
+  Args:
+    ordered_slots: An ordered dictionary containing slot names.
+    item_desc: A dictionary containing items and their descriptions.
+  """
+  if FLAGS.num_workers <= 1:
+    _init_converter({}, ordered_slots, item_desc)
+    yield from map(_convert_dialogue, _iter_dialogues())
+    return
+
+  flag_values = {name: FLAGS[name].value for name in FLAGS}
+  with multiprocessing.Pool(
+      FLAGS.num_workers,
+      initializer=_init_converter,
+      initargs=(flag_values, ordered_slots, item_desc)) as pool:
+    yield from pool.imap(
+        _convert_dialogue, _iter_dialogues(), chunksize=_DIALOGUES_PER_TASK)
+
+
+def _count_turns_per_domain(item_desc: SchemaInfo) -> Dict[str, int]:
+  """Counts per-frame TurnInfo objects per turn domain without building them.
+
+  This mirrors how `process_turn` assigns `turn_domain`: it is only updated on
+  user frames whose service has slots in the schema, and is shared by all
+  frames of a turn.
+
+  Args:
+    item_desc: A dictionary containing items and their descriptions.
+
+  Returns:
+    A dictionary mapping each turn domain to its number of TurnInfo objects, in
+    order of first appearance.
+  """
+  slot_domains = {slot.split('-')[0] for slot in item_desc['slots']}
+  domain_counts = collections.Counter()
+  for dlg in _iter_dialogues():
+    turn_domain = ''
+    for turn in dlg['turns']:
+      if turn['speaker'].lower() == 'user':
+        for frame in turn['frames']:
+          domain = frame['service']
+          if any(domain in slot_domain for slot_domain in slot_domains):
+            turn_domain = domain
+      domain_counts[turn_domain] += len(turn['frames'])
+  return domain_counts
+
+
+def _uniform_domain_picks(domain_counts: List[int],
+                          out_sample_num: int) -> List[int]:
+  """Returns the domain index of each sampled example, in output order.
+
+  Domains are visited round-robin, skipping domains that have run out of
+  examples, so that sampled domains are as close to uniform as possible.
+
+  Args:
+    domain_counts: The number of available examples for each domain.
+    out_sample_num: The total number of examples to sample.
+  """
+  domain_count = len(domain_counts)
+  consumed_examples = [0] * domain_count
+  picks = []
+  for s in range(out_sample_num):
+    # Find first domain that still has unused examples.
+    domain_id = s % domain_count
+    for d in range(domain_count):
+      cand_domain = (domain_id + d) % domain_count
+      if domain_counts[cand_domain] > consumed_examples[cand_domain]:
+        domain_id = cand_domain
+        break
+    picks.append(domain_id)
+    consumed_examples[domain_id] += 1
+  return picks
+
+
+class _Reservoir:
+  """Fixed-size sample of a stream of TurnInfo objects.
+
+  If an RNG is given, this is a uniform random sample (Algorithm R). Otherwise
+  the first `size` items of the stream are kept.
+  """
+
+  def __init__(self, size: int, rng: Optional[random.Random]):
+    self._size = size
+    self._rng = rng
+    self._num_seen = 0
+    self.samples = []
+
+  def add(self, turn_info: TurnInfo) -> None:
+    self._num_seen += 1
+    if len(self.samples) < self._size:
+      self.samples.append(turn_info)
+    elif self._rng:
+      idx = self._rng.randrange(self._num_seen)
+      if idx < self._size:
+        self.samples[idx] = turn_info
+
+
+def _iter_reported_dialogues(
+    ordered_slots: collections.OrderedDict, item_desc: SchemaInfo,
+    reporter: progress_utils.ProgressReporter) -> Iterator[List[TurnInfo]]:
+  """Same as _iter_converted_dialogues, recording progress in `reporter`."""
+  for turn_infos in reporter.timed(
+      'convert', _iter_converted_dialogues(ordered_slots, item_desc)):
+    reporter.add_dialogues()
+    yield turn_infos
+
+
+def _sample_turn_infos(
+    ordered_slots: collections.OrderedDict, item_desc: SchemaInfo,
+    reporter: progress_utils.ProgressReporter) -> List[TurnInfo]:
+  """Samples a FLAGS.data_percent fraction of all examples.
+
+  Only the sampled examples are held in memory. If specified, ensures a
+  (close-to) uniform domain distribution.
+
+  Args:
+    ordered_slots: An ordered dictionary containing slot names.
+    item_desc: A dictionary containing items and their descriptions.
+    reporter: Records conversion progress.
 
   Returns:
     Specified percentage of examples, with uniform domain distribution if
     needed.
   """
-  if FLAGS.data_percent == 0.0:
-    return turn_list
+  with reporter.stage('count'):
+    domain_counts = _count_turns_per_domain(item_desc)
+  out_sample_num = int(sum(domain_counts.values()) * FLAGS.data_percent)
+  # Sampling uses its own RNG, so that it is unaffected by per-dialogue seeding.
+  rng = random.Random(FLAGS.random_seed) if FLAGS.randomize_items else None
 
-  out_sample_num = int(len(turn_list) * FLAGS.data_percent)
   if not FLAGS.uniform_domain_distribution:
-    if FLAGS.randomize_items:
-      random.shuffle(turn_list)
-    return turn_list[:out_sample_num]
+    reservoir = _Reservoir(out_sample_num, rng)
+    for turn_infos in _iter_reported_dialogues(ordered_slots, item_desc,
+                                               reporter):
+      for turn_info in turn_infos:
+        reservoir.add(turn_info)
+    sampled = reservoir.samples
   else:
-    domain_examples = {}
-    domain_id = {}
-    domain_count = 0
-    for turn in turn_list:
-      if turn.turn_domain in domain_id:
-        domain_examples[domain_id[turn.turn_domain]].append(turn)
-      else:
-        domain_examples[domain_count] = [turn]
-        domain_id[turn.turn_domain] = domain_count
-        domain_count += 1
-
+    domains = list(domain_counts.keys())
+    picks = _uniform_domain_picks([domain_counts[d] for d in domains],
+                                  out_sample_num)
+    quotas = collections.Counter(picks)
+    reservoirs = {
+        domain: _Reservoir(quotas[domain_id], rng)
+        for domain_id, domain in enumerate(domains)
+    }
+    for turn_infos in _iter_reported_dialogues(ordered_slots, item_desc,
+                                               reporter):
+      for turn_info in turn_infos:
+        reservoirs[turn_info.turn_domain].add(turn_info)
     # How many examples from each domain has been added to the final list.
-    consumed_examples = {d: 0 for d in range(domain_count)}
-    uniform_turn_list = []
-    for s in range(out_sample_num):
-      # Find first domain that still has unused examples.
-      domain_id = s % domain_count
-      for d in range(domain_count):
-        cand_domain = (domain_id + d) % domain_count
-        if len(domain_examples[cand_domain]) > consumed_examples[cand_domain]:
-          domain_id = cand_domain
-          break
+    consumed_examples = collections.Counter()
+    sampled = []
+    for domain_id in picks:
+      domain = domains[domain_id]
+      sampled.append(reservoirs[domain].samples[consumed_examples[domain]])
+      consumed_examples[domain] += 1
 
-      uniform_turn_list.append(
-          domain_examples[domain_id][consumed_examples[domain_id]])
-      consumed_examples[domain_id] += 1
+  if rng:
+    rng.shuffle(sampled)
+  return sampled
 
-    if FLAGS.randomize_items:
-      random.shuffle(uniform_turn_list)
 
-    return uniform_turn_list
+def _output_paths() -> List[str]:
+  """Returns the output file path of each shard."""
+  if FLAGS.num_shards <= 1:
+    return [FLAGS.output_file]
+  return [
+      f'{FLAGS.output_file}-{shard:05d}-of-{FLAGS.num_shards:05d}'
+      for shard in range(FLAGS.num_shards)
+  ]
 
 
 def generate_data(ordered_slots, item_desc):
   """Generate SGD examples in text format.
 
+  Dialogues are converted and written one at a time, so memory stays flat
+  regardless of corpus size. If FLAGS.data_percent is set, only the sampled
+  examples are held in memory.
+
   Args:
     ordered_slots: An ordered dictionary containing slot names.
     item_desc: A dictionary containing items and their descriptions.
   """
   if not tf.io.gfile.isdir(os.path.dirname(FLAGS.output_file)):
     tf.io.gfile.makedirs(os.path.dirname(FLAGS.output_file))
-  with tf.io.gfile.GFile(FLAGS.output_file, 'w') as out_file:
-    all_turns_per_frame = []
-    for sgd_file in tf.io.gfile.glob(FLAGS.sgd_file):
-      with tf.io.gfile.GFile(sgd_file) as sgd_in:
-        for dlg in json.load(sgd_in):
-          # Cumulative states throughout this dialog.
-          cumu_slots = copy.deepcopy(ordered_slots)
-          turn_info = TurnInfo()
-          turn_info.dialogue_id = dlg['dialogue_id']
-          prefix = ''
-          for turn_idx, turn in enumerate(dlg['turns']):
-            prefix, per_frame_turn_info = process_turn(turn, turn_info,
-                                                       cumu_slots, item_desc,
-                                                       prefix, turn_idx)
-            all_turns_per_frame.extend(copy.deepcopy(per_frame_turn_info))
-
-        write_examples(example_filter(all_turns_per_frame), out_file)
+  reporter = progress_utils.ProgressReporter(
+      'create_sgd_schemaless_data',
+      num_verbose_examples=FLAGS.verbose_examples)
+  with contextlib.ExitStack() as stack:
+    out_files = [
+        stack.enter_context(tf.io.gfile.GFile(path, 'w'))
+        for path in _output_paths()
+    ]
+    num_shards = len(out_files)
+    if FLAGS.data_percent != 0.0:
+      sampled = _sample_turn_infos(ordered_slots, item_desc, reporter)
+      with reporter.stage('write'):
+        for shard, out_file in enumerate(out_files):
+          write_examples(sampled[shard::num_shards], out_file, reporter)
+    else:
+      for dlg_idx, turn_infos in enumerate(
+          _iter_reported_dialogues(ordered_slots, item_desc, reporter)):
+        with reporter.stage('write'):
+          write_examples(turn_infos, out_files[dlg_idx % num_shards],
+                         reporter)
+  reporter.log_progress()
 
 
 def main(_):
+  random.seed(FLAGS.random_seed)
   slots, item_desc = load_schema()
   generate_data(slots, item_desc)
 
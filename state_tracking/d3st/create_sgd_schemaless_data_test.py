@@ -148,6 +148,73 @@ class CreateSgdTxtTest(tf.test.TestCase, parameterized.TestCase):
       create_sgd_schemaless_data.generate_data(slots, item_desc)
       self.assertTrue(filecmp.cmp(temp_output, ref_output))
 
+  def testGenerateDataMultipleFiles(self):
+    temp_dir = self.create_tempdir()
+    for filename in ('dialogues_001.json', 'dialogues_002.json'):
+      tf.io.gfile.copy(
+          os.path.join(FLAGS.test_srcdir, TEST_DIR, 'sgd_train.json'),
+          os.path.join(temp_dir, filename))
+    temp_output = os.path.join(temp_dir, 'output')
+    ref_output = os.path.join(FLAGS.test_srcdir, TEST_DIR,
+                              'sgd_text_v2_full_desc_dst')
+    with flagsaver.flagsaver(
+        level='dst',
+        delimiter='=',
+        data_format='full_desc',
+        sgd_file=os.path.join(temp_dir, 'dialogues_*.json'),
+        schema_file=os.path.join(FLAGS.test_srcdir, TEST_DIR,
+                                 'sgd_train_schema.json'),
+        output_file=temp_output,
+        randomize_items=False):
+      slots, item_desc = create_sgd_schemaless_data.load_schema()
+      create_sgd_schemaless_data.generate_data(slots, item_desc)
+    with tf.io.gfile.GFile(ref_output) as f:
+      ref_lines = f.readlines()
+    with tf.io.gfile.GFile(temp_output) as f:
+      self.assertEqual(f.readlines(), ref_lines * 2)
+
+  @parameterized.named_parameters(
+      {
+          'testcase_name': 'all_data',
+          'data_percent': 0.0,
+      }, {
+          'testcase_name': 'sampled_data',
+          'data_percent': 0.5,
+      })
+  def testGenerateDataParallelMatchesSerial(self, data_percent):
+    temp_dir = self.create_tempdir()
+    # Includes a dialogue with categorical slots, for the multiple choices.
+    for idx, filename in enumerate(
+        ('sgd_train.json', 'sgd_train_categorical.json')):
+      tf.io.gfile.copy(
+          os.path.join(FLAGS.test_srcdir, TEST_DIR, filename),
+          os.path.join(temp_dir, f'dialogues_{idx:03d}.json'))
+    output_paths = {}
+    for num_workers in (1, 2):
+      output_file = os.path.join(temp_dir, f'output_{num_workers}')
+      with flagsaver.flagsaver(
+          level='dst_intent',
+          delimiter='=',
+          data_format='full_desc',
+          sgd_file=os.path.join(temp_dir, 'dialogues_*.json'),
+          schema_file=os.path.join(FLAGS.test_srcdir, TEST_DIR,
+                                   'sgd_train_schema.json'),
+          output_file=output_file,
+          randomize_items=True,
+          multiple_choice='1a',
+          random_seed=0,
+          data_percent=data_percent,
+          num_workers=num_workers,
+          num_shards=2):
+        slots, item_desc = create_sgd_schemaless_data.load_schema()
+        create_sgd_schemaless_data.generate_data(slots, item_desc)
+      output_paths[num_workers] = sorted(tf.io.gfile.glob(output_file + '-*'))
+
+    self.assertLen(output_paths[1], 2)
+    self.assertLen(output_paths[2], 2)
+    for serial_path, parallel_path in zip(output_paths[1], output_paths[2]):
+      self.assertTrue(filecmp.cmp(serial_path, parallel_path, shallow=False))
+
 
 if __name__ == '__main__':
   tf.test.main()
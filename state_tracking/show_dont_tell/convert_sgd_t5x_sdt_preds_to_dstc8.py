@@ -15,21 +15,30 @@
 r"""Converts T5X predictions on SGD to DSTC8 official format for evaluation."""
 
 import collections
+from concurrent import futures
+import contextlib
+import dataclasses
+import functools
+import itertools
 import json
 import os
 import re
-from typing import Dict, Optional, Sequence, Union
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 from absl import app
 from absl import flags
 from absl import logging
+from state_tracking.utils import cache_utils
+from state_tracking.utils import dialogue_store
 from state_tracking.utils import sgd_utils
 import tensorflow as tf
 
 
 _T5X_PREDICTIONS_JSONL = flags.DEFINE_string(
     't5x_predictions_jsonl', None,
-    'Input JSONL file with T5X model predictions.')
+    'Input JSONL file with T5X model predictions, or a glob pattern matching '
+    'its shards.')
 _DSTC8_DATA_DIR = flags.DEFINE_string(
     'dstc8_data_dir', None,
     'Directory for the downloaded DSTC8 data, which contains '
@@ -49,44 +58,177 @@ _EVALUATE_INTENT_ACC = flags.DEFINE_bool(
     'evaluate_intent_acc', False, 'Whether to evaluate on active intent '
     'classification task.')
 
+_DIALOGUE_STORE_DIR = flags.DEFINE_string(
+    'dialogue_store_dir', None, 'Local directory for the indexed store of the '
+    'split\'s dialogues, which is written on first use and reused as long as '
+    'the split is unchanged. If None, a temporary store is written for each '
+    'run.')
+_NUM_WORKERS = flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes parsing prediction shards in '
+    'parallel.')
+_PER_FILE_OUTPUTS = flags.DEFINE_bool(
+    'per_file_outputs', False, 'Whether to write the predictions for each '
+    'dialogue file of the split to a file of the same name in output_dir, '
+    'instead of a single dialogues_all.json.')
+_COMPACT_JSON = flags.DEFINE_bool(
+    'compact_json', False, 'Whether to write compact JSON outputs, encoded by '
+    'orjson if installed, instead of JSON indented by 2 spaces.')
+_OUTPUT_COMPRESSION = flags.DEFINE_enum(
+    'output_compression', None, ['gzip', 'zstd'], 'Compression of the '
+    'outputs, whose filenames get a .gz or .zst suffix. zstd requires the '
+    'zstandard package.')
+
 _SDT_CAT_SLOT_IDENTIFIER = 'of possible values'
 
+# Start of each multiple choice option, e.g. "a) ", and end of its value.
+_OPTION_BOUNDARY_RE = re.compile(r'[a-z]\)')
+# Number of cached option maps, i.e. of distinct prompts in a predictions file.
+_OPTION_MAP_CACHE_SIZE = 4096
 
-def _create_categorical_slot_to_value_map(
-    input_str: str) -> Dict[str, Dict[str, str]]:
-  """Creates mappings from letters to values for categorical slots."""
-  slot_values = input_str.split('[slots]')[1].split('[context]')[0].split(
-      '[intent]')[0].strip()
-  slot_to_option_to_value = collections.defaultdict(dict)
-  for slot, value in re.findall(
-      rf'(\w+){_DELIMITER.value}(.*?)(?=\w+{_DELIMITER.value}|$)', slot_values):
+
+@functools.lru_cache(maxsize=None)
+def _key_value_re(delimiter: str) -> re.Pattern[str]:
+  return re.compile(rf'(\w+){delimiter}(.*?)(?=\w+{delimiter}|$)')
+
+
+@functools.lru_cache(maxsize=None)
+def _key_re(delimiter: str) -> re.Pattern[str]:
+  return re.compile(rf'(\w+){re.escape(delimiter)}')
+
+
+def _split_key_values(text: str, delimiter: str) -> List[Tuple[str, str]]:
+  """Splits "key1<delimiter>value1 key2<delimiter>value2 ..." into pairs.
+
+  A value extends up to the next word directly followed by the delimiter.
+  Keys are located with a single scan, and the values are the text between
+  them, which gives the same pairs as matching
+  `(\w+)<delimiter>(.*?)(?=\w+<delimiter>|$)` without the lazy lookahead.
+  Delimiters that the regex would interpret or that contain word characters,
+  and multi-line texts, fall back to the regex.
+
+  Args:
+    text: The text to split.
+    delimiter: The delimiter between each key and its value.
+
+  Returns:
+    The (key, value) pairs, in order.
+  """
+  if ('\n' in text or re.escape(delimiter) != delimiter or
+      re.search(r'\w', delimiter)):
+    return _key_value_re(delimiter).findall(text)
+  matches = list(_key_re(delimiter).finditer(text))
+  pairs = []
+  for match, next_match in itertools.zip_longest(matches, matches[1:]):
+    value_end = next_match.start() if next_match else len(text)
+    pairs.append((match.group(1), text[match.end():value_end]))
+  return pairs
+
+
+def _split_options(text: str) -> List[Tuple[str, str]]:
+  """Splits "a) value1 b) value2 ..." into (letter, value) pairs.
+
+  Gives the same pairs as matching `([a-z])\) (.*?)(?=[a-z]\)|$)`: a value
+  extends up to the next letter followed by ")", and only letters followed by
+  ") " start an option.
+
+  Args:
+    text: The text listing the options.
+
+  Returns:
+    The (letter, value) pairs, in order.
+  """
+  if '\n' in text:
+    return re.findall(r'([a-z])\) (.*?)(?=[a-z]\)|$)', text)
+  boundaries = [match.start() for match in _OPTION_BOUNDARY_RE.finditer(text)]
+  boundaries.append(len(text))
+  options = []
+  for start, end in zip(boundaries, boundaries[1:]):
+    if text.startswith(') ', start + 1):
+      options.append((text[start], text[start + 3:end]))
+  return options
+
+
+@functools.lru_cache(maxsize=_OPTION_MAP_CACHE_SIZE)
+def _parse_categorical_slot_options(
+    slot_values: str, delimiter: str) -> Mapping[str, Mapping[str, str]]:
+  """Parses the options of the categorical slots of a slots prompt.
+
+  Many frames share the same prompt, so results are cached by prompt. They
+  must not be modified.
+
+  Args:
+    slot_values: The "[slots]" section of an input.
+    delimiter: The delimiter between slots and their descriptions or values.
+
+  Returns:
+    A dict mapping each categorical slot to its letter to value mapping.
+  """
+  slot_to_option_to_value = {}
+  for slot, value in _split_key_values(slot_values, delimiter):
     if _SDT_CAT_SLOT_IDENTIFIER not in value:
       continue
     options_str = value.split(_SDT_CAT_SLOT_IDENTIFIER)[1].strip()
-    for option, option_value in re.findall(r'([a-z])\) (.*?)(?=[a-z]\)|$)',
-                                           options_str):
-      slot_to_option_to_value[slot][option] = option_value.strip()
-
+    option_to_value = slot_to_option_to_value.setdefault(slot, {})
+    for option, option_value in _split_options(options_str):
+      option_to_value[option] = option_value.strip()
   return slot_to_option_to_value
 
 
-def _create_intent_map(input_str: str) -> Dict[str, str]:
-  """Creates mappings from letters to intent names."""
-  intent_str = input_str.split('[intent]')[1].split('[context]')[0].strip()
-  intent_option_to_value = {}
+@functools.lru_cache(maxsize=_OPTION_MAP_CACHE_SIZE)
+def _parse_intent_options(intent_str: str) -> Mapping[str, str]:
+  """Parses the intent options of an intent prompt, cached by prompt."""
   if _SDT_CAT_SLOT_IDENTIFIER not in intent_str:
     raise ValueError('Improperly formatted intent prompt: %s' % intent_str)
   intent_str = intent_str.split(_SDT_CAT_SLOT_IDENTIFIER)[1].strip()
-  for option, option_value in re.findall(r'([a-z])\) (.*?)(?=[a-z]\)|$)',
-                                         intent_str):
-    intent_option_to_value[option] = option_value.strip()
+  return {
+      option: option_value.strip()
+      for option, option_value in _split_options(intent_str)
+  }
 
-  return intent_option_to_value
+
+def _get_section(input_str: str, start_tag: str,
+                 end_tags: Sequence[str]) -> str:
+  """Returns the text after `start_tag` up to the next tag of `end_tags`.
+
+  Like `input_str.split(start_tag)[1]`, the section also ends at the next
+  occurrence of `start_tag`.
+
+  Args:
+    input_str: The input string.
+    start_tag: The tag starting the section.
+    end_tags: Tags which end the section.
+
+  Returns:
+    The text of the section.
+  """
+  start = input_str.index(start_tag) + len(start_tag)
+  end = len(input_str)
+  for end_tag in (start_tag, *end_tags):
+    end_tag_idx = input_str.find(end_tag, start, end)
+    if end_tag_idx != -1:
+      end = end_tag_idx
+  return input_str[start:end]
+
+
+def _create_categorical_slot_to_value_map(
+    input_str: str,
+    delimiter: Optional[str] = None) -> Mapping[str, Mapping[str, str]]:
+  """Creates mappings from letters to values for categorical slots."""
+  slot_values = _get_section(input_str, '[slots]',
+                             ('[context]', '[intent]')).strip()
+  return _parse_categorical_slot_options(slot_values, delimiter or
+                                         _DELIMITER.value)
+
+
+def _create_intent_map(input_str: str) -> Mapping[str, str]:
+  """Creates mappings from letters to intent names."""
+  intent_str = _get_section(input_str, '[intent]', ('[context]',)).strip()
+  return _parse_intent_options(intent_str)
 
 
 def _normalize_value_prediction(
     slot_name: str, value: str,
-    slot_to_option_to_value: Dict[str, Dict[str, str]]) -> Optional[str]:
+    slot_to_option_to_value: Mapping[str, Mapping[str, str]]) -> Optional[str]:
   """Normalizes a predicted value and maps a categorical option to value."""
   value = value.strip()
   if value == 'none':
@@ -106,99 +248,292 @@ def _normalize_value_prediction(
   return value
 
 
-def populate_json_predictions(
-    dialog_id_to_dialogue: Dict[str, sgd_utils.DialoguesDict],
-    frame_predictions: Dict[str, Union[str, Dict[str, str]]]) -> None:
-  """Populates a dialogue JSON dictionary with frame-level T5X model outputs.
+@dataclasses.dataclass
+class FramePrediction:
+  """State predicted for a single frame.
 
-  Given a single prediction from frame_predictions, this looks up the
-  corresponding frame from dialog_id_to_dialogue and modifies it in-place by
-  inserting the predictions into the dialogue state field.
+  Attributes:
+    dialogue_id: ID of the dialogue containing the frame.
+    turn_id: Index of the turn containing the frame.
+    frame_id: Index of the frame in its turn.
+    slot_values: Predicted values of the slots with a non-empty prediction.
+    active_intent: Predicted active intent, if intents are evaluated.
+  """
+  dialogue_id: str
+  turn_id: int
+  frame_id: int
+  slot_values: Dict[str, str]
+  active_intent: Optional[str] = None
+
+
+def parse_frame_predictions(
+    frame_predictions: Dict[str, Union[str, Dict[str, str]]],
+    delimiter: Optional[str] = None,
+    evaluate_intent_acc: Optional[bool] = None) -> FramePrediction:
+  """Parses the state predicted for a frame from a T5X model output.
 
   Args:
-    dialog_id_to_dialogue: A mapping from dialog id to the dialogue json object
     frame_predictions: A dict containing T5X predictions and example metadata
+    delimiter: Delimiter between slots and their values. If None, --delimiter
+      is used.
+    evaluate_intent_acc: Whether to parse the active intent. If None,
+      --evaluate_intent_acc is used.
+
+  Returns:
+    The predicted frame state.
   """
+  if delimiter is None:
+    delimiter = _DELIMITER.value
+  if evaluate_intent_acc is None:
+    evaluate_intent_acc = _EVALUATE_INTENT_ACC.value
   preds = frame_predictions['prediction']
   if not isinstance(preds, str):
     raise ValueError(f"'preds' must be string type, "
                      f'not {type(preds)}. preds: {preds}')
-  dialog_id = frame_predictions['input']['dialogue_id']
-  turn_id = int(frame_predictions['input']['turn_id'])
-  frame_id = int(frame_predictions['input']['frame_id'])
-
-  if dialog_id not in dialog_id_to_dialogue:
-    raise ValueError(f'Dialogue ID {dialog_id} not found.')
-
-  frame = dialog_id_to_dialogue[dialog_id]['turns'][turn_id]['frames'][frame_id]
+  prediction = FramePrediction(
+      dialogue_id=frame_predictions['input']['dialogue_id'],
+      turn_id=int(frame_predictions['input']['turn_id']),
+      frame_id=int(frame_predictions['input']['frame_id']),
+      slot_values={})
 
   input_str = frame_predictions['input']['inputs_pretokenized']
 
   # Create a dict(slot -> dict(multiple-choice letter -> value)) for cat slots.
-  slot_to_option_to_value = _create_categorical_slot_to_value_map(input_str)
+  slot_to_option_to_value = _create_categorical_slot_to_value_map(
+      input_str, delimiter)
 
-  if _EVALUATE_INTENT_ACC.value:
+  if evaluate_intent_acc:
     # Create a dict(multiple-choice letter -> intent) for intents.
     option_to_intent = _create_intent_map(input_str)
 
   # Read and populate all slot value predictions.
   # TODO(harrisonlee): Support requested slots.
-  slot_preds = preds.split('[state]')[1].split('[intent]')[0].strip()
-  for slot_name, value in re.findall(
-      rf'(\w+){_DELIMITER.value}(.*?)(?=\w+{_DELIMITER.value}|$)', slot_preds):
+  slot_preds = _get_section(preds, '[state]', ('[intent]',)).strip()
+  for slot_name, value in _split_key_values(slot_preds, delimiter):
     value = _normalize_value_prediction(slot_name, value,
                                         slot_to_option_to_value)
 
     if value:
-      frame['state']['slot_values'][slot_name] = [value]
+      prediction.slot_values[slot_name] = value
 
   # Populate intent prediction.
-  if _EVALUATE_INTENT_ACC.value and '[intent]' in preds:
+  if evaluate_intent_acc and '[intent]' in preds:
     # Read and populate intent prediction.
     intent_pred = preds.split('[intent]')[1].strip()
-    frame['state']['active_intent'] = option_to_intent.get(intent_pred, 'NONE')
+    prediction.active_intent = option_to_intent.get(intent_pred, 'NONE')
+
+  return prediction
+
+
+def _apply_frame_prediction(dialogue: sgd_utils.DialoguesDict,
+                            prediction: FramePrediction) -> None:
+  """Inserts a frame prediction into the dialogue state of its frame."""
+  frame = dialogue['turns'][prediction.turn_id]['frames'][prediction.frame_id]
+  for slot_name, value in prediction.slot_values.items():
+    frame['state']['slot_values'][slot_name] = [value]
+  if prediction.active_intent is not None:
+    frame['state']['active_intent'] = prediction.active_intent
+
+
+def populate_json_predictions(
+    dialog_id_to_dialogue: Mapping[str, sgd_utils.DialoguesDict],
+    frame_predictions: Dict[str, Union[str, Dict[str, str]]]) -> None:
+  """Populates a dialogue JSON dictionary with frame-level T5X model outputs.
+
+  Given a single prediction from frame_predictions, this looks up the
+  corresponding frame from dialog_id_to_dialogue and modifies it in-place by
+  inserting the predictions into the dialogue state field.
+
+  Args:
+    dialog_id_to_dialogue: A mapping from dialog id to the dialogue json object
+    frame_predictions: A dict containing T5X predictions and example metadata
+  """
+  prediction = parse_frame_predictions(frame_predictions)
+  if prediction.dialogue_id not in dialog_id_to_dialogue:
+    raise ValueError(f'Dialogue ID {prediction.dialogue_id} not found.')
+  _apply_frame_prediction(dialog_id_to_dialogue[prediction.dialogue_id],
+                          prediction)
+
+
+def _erase_ground_truth_state(dialogue: sgd_utils.DialoguesDict) -> None:
+  for turn in dialogue['turns']:
+    for frame in turn['frames']:
+      if 'state' in frame:
+        frame['state']['slot_values'] = {}
+        frame['state']['requested_slots'] = []
+        frame['state']['active_intent'] = 'NONE'
+
+
+def _split_dialogue_files() -> List[str]:
+  return sgd_utils.dialogue_files(_DSTC8_DATA_DIR.value, _DATASET_SPLIT.value)
+
+
+def _iter_dialogues(
+    dialogue_files: List[str]) -> Iterator[sgd_utils.DialoguesDict]:
+  """Yields the dialogues of the files, holding one file in memory at once."""
+  for dialogue_file in dialogue_files:
+    yield from sgd_utils.read_json_file(dialogue_file)
+    logging.info('Loaded dialogue file %s', dialogue_file)
+
+
+def _write_json_list(items: Iterable[Any],
+                     output_file: Any,
+                     compact: bool = False) -> None:
+  """Writes a JSON list one item at a time.
+
+  Unless `compact`, the output is identical to `json.dump(list(items),
+  output_file, indent=2, separators=(',', ': '))`, without holding all items
+  in memory.
+
+  Args:
+    items: Items of the list.
+    output_file: Binary file object to write to.
+    compact: Whether to write compact JSON, see `sgd_utils.dumps_json`.
+  """
+  if compact:
+    output_file.write(b'[')
+    for idx, item in enumerate(items):
+      if idx:
+        output_file.write(b',')
+      output_file.write(sgd_utils.dumps_json(item, compact=True))
+    output_file.write(b']')
+    return
+
+  output_file.write(b'[')
+  is_empty = True
+  for item in items:
+    item_str = sgd_utils.dumps_json(item)
+    output_file.write(b'\n  ' if is_empty else b',\n  ')
+    output_file.write(item_str.replace(b'\n', b'\n  '))
+    is_empty = False
+  output_file.write(b']' if is_empty else b'\n]')
+
+
+def _open_dialogue_store(store_dir: str,
+                         dialogue_file: str) -> dialogue_store.DialogueStore:
+  """Opens the store of a dialogue file of the split, writing it if needed.
+
+  The store is named after a fingerprint of the file, so it is rewritten
+  whenever the file changes.
+
+  Args:
+    store_dir: Directory containing the store.
+    dialogue_file: The dialogue file.
+
+  Returns:
+    The dialogue store of the file.
+  """
+  name = os.path.splitext(
+      sgd_utils.strip_compression_suffix(os.path.basename(dialogue_file)))[0]
+  path = os.path.join(
+      store_dir, f'{_DATASET_SPLIT.value}-{name}-'
+      f'{cache_utils.fingerprint([dialogue_file])}.dialogues')
+  if not dialogue_store.dialogue_store_exists(path):
+    dialogue_store.write_dialogue_store(path, _iter_dialogues([dialogue_file]))
+  return dialogue_store.DialogueStore(path)
+
+
+def _parse_predictions_file(path: str, delimiter: str,
+                            evaluate_intent_acc: bool) -> List[FramePrediction]:
+  """Parses the frame predictions of a JSONL file or shard."""
+  with tf.io.gfile.GFile(path, 'r') as predictions_file:
+    predictions = [
+        parse_frame_predictions(
+            json.loads(line), delimiter, evaluate_intent_acc)
+        for line in predictions_file
+    ]
+  logging.info('Parsed %d predictions from %s', len(predictions), path)
+  return predictions
+
+
+def parse_predictions_files(
+    paths: Sequence[str],
+    num_workers: int = 1) -> Iterator[List[FramePrediction]]:
+  """Parses JSONL prediction files, in parallel if `num_workers` > 1.
+
+  Workers only return the parsed frame predictions, which are much smaller
+  than the raw model outputs, so they can be merged into the dialogues by the
+  calling process.
+
+  Args:
+    paths: Paths of the JSONL files or shards.
+    num_workers: Number of parser processes. If 1, files are parsed serially.
+
+  Yields:
+    The frame predictions of each file, in the order of `paths`.
+  """
+  parse_fn = functools.partial(
+      _parse_predictions_file,
+      delimiter=_DELIMITER.value,
+      evaluate_intent_acc=_EVALUATE_INTENT_ACC.value)
+  num_workers = min(num_workers, len(paths))
+  if num_workers <= 1:
+    yield from map(parse_fn, paths)
+    return
+  with futures.ProcessPoolExecutor(num_workers) as pool:
+    yield from pool.map(parse_fn, paths)
 
 
 def main(argv: Sequence[str]) -> None:
   if len(argv) > 1:
     raise app.UsageError('Too many command-line arguments.')
 
-  # Load dialogues and flatten into dict(dialogue_id->dialogue).
-  subdir_to_dialogues = {}
-  sgd_utils.load_dialogues_to_dict(_DSTC8_DATA_DIR.value, _DATASET_SPLIT.value,
-                                   subdir_to_dialogues)
-  dialog_id_to_dialogue = {}
-  for dialogues in subdir_to_dialogues[_DATASET_SPLIT.value].values():
-    for dialog in dialogues:
-      dialog_id_to_dialogue[dialog['dialogue_id']] = dialog
-
-  # Erase ground truth state values.
-  for dial in dialog_id_to_dialogue.values():
-    for turn in dial['turns']:
-      for frame in turn['frames']:
-        if 'state' in frame:
-          frame['state']['slot_values'] = {}
-          frame['state']['requested_slots'] = []
-          frame['state']['active_intent'] = 'NONE'
-
-  # Read JSONL predictions.
-  with tf.io.gfile.GFile(_T5X_PREDICTIONS_JSONL.value, 'r') as predictions_file:
-    for line in predictions_file:
-      frame_predictions = json.loads(line)
-      populate_json_predictions(dialog_id_to_dialogue, frame_predictions)
-
-  # Write JSON predictions.
-  output_dir = _OUTPUT_DIR.value
-  if not tf.io.gfile.isdir(output_dir):
-    tf.io.gfile.makedirs(output_dir)
-
-  with tf.io.gfile.GFile(os.path.join(output_dir, 'dialogues_all.json'),
-                         'w') as output_file:
-    json.dump(
-        list(dialog_id_to_dialogue.values()),
-        output_file,
-        indent=2,
-        separators=(',', ': '))
+  predictions_files = sorted(tf.io.gfile.glob(_T5X_PREDICTIONS_JSONL.value))
+  if not predictions_files:
+    raise ValueError(
+        f'No predictions files match {_T5X_PREDICTIONS_JSONL.value}.')
+
+  with contextlib.ExitStack() as stack:
+    store_dir = _DIALOGUE_STORE_DIR.value or stack.enter_context(
+        tempfile.TemporaryDirectory())
+    file_to_dialogues = {
+        dialogue_file:
+        stack.enter_context(_open_dialogue_store(store_dir, dialogue_file))
+        for dialogue_file in _split_dialogue_files()
+    }
+
+    # Parse JSONL predictions, only keeping the parsed frame states.
+    dialog_id_to_predictions = collections.defaultdict(list)
+    for predictions in parse_predictions_files(predictions_files,
+                                               _NUM_WORKERS.value):
+      for prediction in predictions:
+        dialog_id_to_predictions[prediction.dialogue_id].append(prediction)
+    for dialog_id in dialog_id_to_predictions:
+      if not any(dialog_id in dialogues
+                 for dialogues in file_to_dialogues.values()):
+        raise ValueError(f'Dialogue ID {dialog_id} not found.')
+
+    def _iter_predicted_dialogues(dialogue_stores):
+      for dialogues in dialogue_stores:
+        for dialog_id, dialogue in dialogues.items():
+          # Erase ground truth state values.
+          _erase_ground_truth_state(dialogue)
+          for prediction in dialog_id_to_predictions[dialog_id]:
+            _apply_frame_prediction(dialogue, prediction)
+          yield dialogue
+
+    # Write JSON predictions.
+    output_dir = _OUTPUT_DIR.value
+    if not tf.io.gfile.isdir(output_dir):
+      tf.io.gfile.makedirs(output_dir)
+
+    if _PER_FILE_OUTPUTS.value:
+      outputs = []
+      for dialogue_file, dialogues in file_to_dialogues.items():
+        output_name = sgd_utils.strip_compression_suffix(
+            os.path.basename(dialogue_file))
+        outputs.append((output_name, [dialogues]))
+    else:
+      outputs = [('dialogues_all.json', file_to_dialogues.values())]
+    compression = _OUTPUT_COMPRESSION.value
+    for output_name, dialogue_stores in outputs:
+      output_path = os.path.join(
+          output_dir, output_name + sgd_utils.COMPRESSION_SUFFIXES[compression])
+      with sgd_utils.open_compressed_writer(output_path,
+                                            compression) as output_file:
+        _write_json_list(
+            _iter_predicted_dialogues(dialogue_stores), output_file,
+            _COMPACT_JSON.value)
 
 
 if __name__ == '__main__':
@@ -17,11 +17,13 @@
 import copy
 import json
 import os
+import re
 
 from absl import flags
 from absl.testing import flagsaver
 from absl.testing import parameterized
 from state_tracking.show_dont_tell import convert_sgd_t5x_sdt_preds_to_dstc8
+from state_tracking.utils import sgd_utils
 import tensorflow as tf
 
 FLAGS = flags.FLAGS
@@ -83,6 +85,61 @@ class ConvertSgdT5XSdtPredsToDstc8Test(tf.test.TestCase,
 
     self.assertDictEqual(actual_dialogue_slots, expected_dialogue_slots)
 
+  @parameterized.named_parameters(("indented", False, None),
+                                  ("compact_gzip", True, "gzip"))
+  def test_convert_sharded_data(self, compact_json, output_compression):
+    testdata_dir = os.path.join(FLAGS.test_srcdir, TEST_DIR)
+    data_dir = self.create_tempdir().full_path
+    output_dir = os.path.join(self.create_tempdir().full_path, "preds")
+    with tf.io.gfile.GFile(
+        os.path.join(testdata_dir, "sgd_data", "dev",
+                     "dialogues_001.json")) as f:
+      dialogue = json.load(f)[0]
+    with tf.io.gfile.GFile(
+        os.path.join(testdata_dir, "show_dont_tell",
+                     "sgd_t5x_prediction.jsonl")) as f:
+      prediction = json.loads(f.readline())
+
+    # Writes two dialogue files, and one prediction shard for each dialogue.
+    tf.io.gfile.makedirs(os.path.join(data_dir, "dev"))
+    for idx, dialogue_id in enumerate(["1_00000", "1_00001"]):
+      dialogue["dialogue_id"] = dialogue_id
+      with tf.io.gfile.GFile(
+          os.path.join(data_dir, "dev", f"dialogues_00{idx + 1}.json"),
+          "w") as f:
+        json.dump([dialogue], f)
+      prediction["input"]["dialogue_id"] = dialogue_id
+      with tf.io.gfile.GFile(
+          os.path.join(data_dir, f"preds.jsonl-0000{idx}-of-00002"),
+          "w") as f:
+        f.write(json.dumps(prediction) + "\n")
+
+    with flagsaver.flagsaver(
+        t5x_predictions_jsonl=os.path.join(data_dir, "preds.jsonl-*"),
+        dstc8_data_dir=data_dir,
+        output_dir=output_dir,
+        dataset_split="dev",
+        num_workers=2,
+        per_file_outputs=True,
+        compact_json=compact_json,
+        output_compression=output_compression):
+      convert_sgd_t5x_sdt_preds_to_dstc8.main([])
+
+    suffix = sgd_utils.COMPRESSION_SUFFIXES[output_compression]
+    self.assertCountEqual(
+        tf.io.gfile.listdir(output_dir),
+        ["dialogues_001.json" + suffix, "dialogues_002.json" + suffix])
+    for idx, dialogue_id in enumerate(["1_00000", "1_00001"]):
+      dialogues = sgd_utils.read_json_file(
+          os.path.join(output_dir, f"dialogues_00{idx + 1}.json" + suffix))
+      self.assertLen(dialogues, 1)
+      self.assertEqual(dialogues[0]["dialogue_id"], dialogue_id)
+      self.assertDictEqual(
+          dialogues[0]["turns"][0]["frames"][0]["state"]["slot_values"], {
+              "number_of_seats": ["2"],
+              "time": ["half past 11 in the morning"]
+          })
+
   def test_populate_json_slot_predictions(self):
     frame_predictions = {
         "input": {
@@ -124,6 +181,29 @@ class ConvertSgdT5XSdtPredsToDstc8Test(tf.test.TestCase,
     }
     self.assertDictEqual(actual_dialogue_slots, expected_dialogue_slots)
 
+  @parameterized.parameters(
+      ("time=half past 11 date=the 8th", "="),
+      ("a=b=c d=", "="),
+      ("prefix time:11:15 am seats:2", ":"),
+      ("no pairs", "="),
+      ("x.y.z", "."),
+      ("multi=line\nvalue x=1", "="),
+  )
+  def test_split_key_values(self, text, delimiter):
+    self.assertEqual(
+        convert_sgd_t5x_sdt_preds_to_dstc8._split_key_values(text, delimiter),
+        re.findall(rf"(\w+){delimiter}(.*?)(?=\w+{delimiter}|$)", text))
+
+  @parameterized.parameters(
+      "a) 4 b) 1 c) 2",
+      "a) cheap (b) pricey c)d) x",
+      "no options",
+  )
+  def test_split_options(self, text):
+    self.assertEqual(
+        convert_sgd_t5x_sdt_preds_to_dstc8._split_options(text),
+        re.findall(r"([a-z])\) (.*?)(?=[a-z]\)|$)", text))
+
 
 def test_populate_json_intent_predictions(self):
   frame_predictions = {
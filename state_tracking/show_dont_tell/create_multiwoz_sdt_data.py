@@ -31,7 +31,9 @@ from absl import app
 from absl import flags
 from state_tracking.show_dont_tell import sdt_prompts
 from state_tracking.show_dont_tell import sdt_utils
+from state_tracking.utils import history_utils
 from state_tracking.utils import multiwoz_utils
+from state_tracking.utils import progress_utils
 from state_tracking.utils import text_to_text_utils
 
 FLAGS = flags.FLAGS
@@ -81,6 +83,17 @@ _BLOCKED_DOMAINS = flags.DEFINE_list(
     'if set. This is used to run zero-shot '
     'cross-domain experiments as in paper '
     'https://aclanthology.org/2021.naacl-main.448.pdf.')
+_USE_CACHE = flags.DEFINE_bool(
+    'use_cache', False, 'If true, cache the parsed input data next to it, to '
+    'speed up later runs.')
+_VERBOSE_EXAMPLES = flags.DEFINE_integer(
+    'verbose_examples', 0, 'Number of generated examples to log in full, '
+    'for debugging.')
+_NUM_SHARDS = flags.DEFINE_integer(
+    'num_shards', 1, 'Number of TFRecord shards to write per split. If '
+    'greater than 1, shards are named <split>.tfrecord-00000-of-<num_shards>.')
+_NUM_WORKERS = flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes serializing output examples.')
 
 
 # Use OrderedDict for JSON to preserve field order.
@@ -149,7 +162,7 @@ def _normalize_multiwoz_slot_values(
 
 
 def _process_one_turn(dialog_id: str, turn: int, belief_state: Dict[str, str],
-                      history_utterances: List[str],
+                      history: history_utils.DialogueHistory,
                       options: Options) -> TextToTextExample:
   """Processes a single dialogue turn into a `TextToTextExample`."""
   # Fetch prompts
@@ -173,8 +186,7 @@ def _process_one_turn(dialog_id: str, turn: int, belief_state: Dict[str, str],
       randomize_cat_vals=options.randomize_cat_vals)
 
   # Create context
-  context_str = sdt_utils.generate_context_str(history_utterances,
-                                               options.context_format)
+  context_str = sdt_utils.generate_context_str(history, options.context_format)
 
   # Create target
   norm_dialogue_state = _normalize_multiwoz_slot_values(
@@ -209,7 +221,7 @@ def create_sdt_examples(json_data: Json,
   examples = []
 
   for dialog_id, dialog_json in json_data.items():
-    history_utterances = []
+    history = history_utils.DialogueHistory()
 
     dialog_key = 'dialogue' if options.is_trade else 'log'
     belief_state_key = 'belief_state' if options.is_trade else 'metadata'
@@ -219,9 +231,9 @@ def create_sdt_examples(json_data: Json,
         sys_utt = utterance_json['system_transcript'].strip().replace('\t', ' ')
         user_utt = utterance_json['transcript'].strip().replace('\t', ' ')
         if turn == 0:
-          history_utterances.append(f'[user] {user_utt}')
+          history.append(f'[user] {user_utt}')
         else:
-          history_utterances.append(f'[system] {sys_utt} [user] {user_utt}')
+          history.append(f'[system] {sys_utt} [user] {user_utt}')
         is_system = True
       else:
         is_system = turn % 2 == 1
@@ -237,24 +249,26 @@ def create_sdt_examples(json_data: Json,
         if options.blocked_domains & domains_in_turn:
           continue
         examples.append(
-            _process_one_turn(dialog_id, turn, belief_state, history_utterances,
-                              options))
+            _process_one_turn(dialog_id, turn, belief_state, history, options))
 
-      # Update history_utterances for non-TRADE data
+      # Update history for non-TRADE data
       if not options.is_trade:
         utterance = utterance_json['text'].strip().replace('\t', ' ').replace(
             '\n', ' ')
-        history_utterances.append(f'{SYS_TOK if is_system else USER_TOK} '
-                                  f'{utterance}')
+        history.append(f'{SYS_TOK if is_system else USER_TOK} {utterance}')
 
   return examples
 
 
 def main(_):
-  multiwoz_data = multiwoz_utils.load_data(
-      data_path=_INPUT_DIR.value,
-      multiwoz_version=_MULTIWOZ_VERSION.value,
-      is_trade=_IS_TRADE.value)
+  reporter = progress_utils.ProgressReporter(
+      'create_multiwoz_sdt_data', num_verbose_examples=_VERBOSE_EXAMPLES.value)
+  with reporter.stage('load'):
+    multiwoz_data = multiwoz_utils.load_data(
+        data_path=_INPUT_DIR.value,
+        multiwoz_version=_MULTIWOZ_VERSION.value,
+        is_trade=_IS_TRADE.value,
+        use_cache=_USE_CACHE.value)
 
   options = Options(
       multiwoz_version=_MULTIWOZ_VERSION.value,
@@ -271,11 +285,16 @@ def main(_):
       lowercase=_LOWERCASE.value)
 
   # Create SDT examples
-  split_to_examples = {
-      'train': create_sdt_examples(multiwoz_data.train_json, options),
-      'dev': create_sdt_examples(multiwoz_data.dev_json, options),
-      'test': create_sdt_examples(multiwoz_data.test_json, options),
+  split_to_json = {
+      'train': multiwoz_data.train_json,
+      'dev': multiwoz_data.dev_json,
+      'test': multiwoz_data.test_json,
   }
+  split_to_examples = {}
+  for split, json_data in split_to_json.items():
+    with reporter.stage('convert'):
+      split_to_examples[split] = create_sdt_examples(json_data, options)
+    reporter.add_dialogues(len(json_data))
 
   # Write out examples
   if _SHUFFLE.value:
@@ -284,8 +303,14 @@ def main(_):
   split_to_examples['dev_test'] = (
       split_to_examples['dev'] + split_to_examples['test'])
   for split, examples in split_to_examples.items():
-    text_to_text_utils.write_data(
-        examples, os.path.join(_OUTPUT_DIR.value, f'{split}.tfrecord'))
+    with reporter.stage('write'):
+      text_to_text_utils.write_data(
+          examples,
+          os.path.join(_OUTPUT_DIR.value, f'{split}.tfrecord'),
+          reporter,
+          num_shards=_NUM_SHARDS.value,
+          num_workers=_NUM_WORKERS.value)
+  reporter.log_progress()
 
 
 if __name__ == '__main__':
@@ -33,6 +33,8 @@ from absl import flags
 from absl import logging
 from state_tracking.show_dont_tell import sdt_prompts
 from state_tracking.show_dont_tell import sdt_utils
+from state_tracking.utils import history_utils
+from state_tracking.utils import progress_utils
 from state_tracking.utils import sgd_utils
 import tensorflow as tf
 
@@ -96,6 +98,12 @@ _K_SHOT = flags.DEFINE_integer(
 _USE_INTENT_SLOT_DESCS = flags.DEFINE_bool(
     'use_intent_slot_descs', False,
     'Whether to add D3ST descriptions to prompt.')
+_USE_CACHE = flags.DEFINE_bool(
+    'use_cache', False, 'If true, cache the parsed input data next to it, to '
+    'speed up later runs.')
+_VERBOSE_EXAMPLES = flags.DEFINE_integer(
+    'verbose_examples', 0, 'Number of generated examples to log in full, '
+    'for debugging.')
 
 Prompt = sdt_prompts.Prompt
 
@@ -188,13 +196,13 @@ def create_examples_from_dialogue(dialogue: Mapping[
     service_to_schema: A map from SGD service to schema
     options: An object containing various options related to example generation
   """
-  utt_strs = []
+  history = history_utils.DialogueHistory()
   example_strs = []
 
   for turn_idx, turn in enumerate(dialogue['turns']):
 
     # Format utterances
-    utt_strs.append(
+    history.append(
         _generate_utt_str(utterance=turn['utterance'], speaker=turn['speaker']))
 
     # Don't create examples out of system turns for DST
@@ -218,7 +226,7 @@ def create_examples_from_dialogue(dialogue: Mapping[
           key_to_schema=service_to_schema)
 
       # Create context
-      context_str = sdt_utils.generate_context_str(utt_strs,
+      context_str = sdt_utils.generate_context_str(history,
                                                    options.context_format)
 
       # Create target
@@ -273,10 +281,16 @@ def main(argv: Sequence[str]) -> None:
       use_slot_ids=_USE_SLOT_IDS.value,
       prompt_indices=_PROMPT_INDICES.value)
 
+  reporter = progress_utils.ProgressReporter(
+      'create_sgd_sdt_data', num_verbose_examples=_VERBOSE_EXAMPLES.value)
+
   # Load dataset - SGD-X if provided, otherwise SGD
   sgd_data_dir = options.sgdx_dir or options.sgd_dir
-  subdir_to_schema, subdir_to_dialogues = sgd_utils.load_dataset(
-      data_dir=sgd_data_dir, subdirs=_SUBDIRS.value)
+  with reporter.stage('load'):
+    subdir_to_schema, subdir_to_dialogues = sgd_utils.load_dataset(
+        data_dir=sgd_data_dir,
+        subdirs=_SUBDIRS.value,
+        use_cache=_USE_CACHE.value)
 
   # If enabled, create map from service to schema for adding D3ST descriptions
   if _USE_INTENT_SLOT_DESCS.value:
@@ -306,10 +320,12 @@ def main(argv: Sequence[str]) -> None:
       for dfile, dialogues in dfile_to_dialogues.items():
         logging.info('Processing file %s', dfile)
 
-        for dialogue in dialogues:
-          examples.extend(
-              create_examples_from_dialogue(dialogue, service_to_prompts,
-                                            service_to_schema, options))
+        with reporter.stage('convert'):
+          for dialogue in dialogues:
+            examples.extend(
+                create_examples_from_dialogue(dialogue, service_to_prompts,
+                                              service_to_schema, options))
+        reporter.add_dialogues(len(dialogues))
 
     # Optionally sample a proportion of examples only
     if _DATA_PERCENT.value > 0.0:
@@ -329,8 +345,12 @@ def main(argv: Sequence[str]) -> None:
       ])
 
     # Write example strings to file
-    for e in examples:
-      outfile.write(f'{e.example_str}\n')
+    with reporter.stage('write'):
+      for e in examples:
+        line = f'{e.example_str}\n'
+        outfile.write(line)
+        reporter.add_example(e.example_str, len(line.encode('utf-8')))
+  reporter.log_progress()
 
 
 if __name__ == '__main__':
@@ -20,9 +20,10 @@
 import collections
 import random
 import string
-from typing import Any, Dict, List, Mapping, MutableMapping, Optional, Sequence, Tuple
+from typing import Any, Dict, List, Mapping, MutableMapping, Optional, Sequence, Tuple, Union
 
 from state_tracking.show_dont_tell import sdt_prompts
+from state_tracking.utils import history_utils
 from state_tracking.utils import sgd_utils
 
 Prompt = sdt_prompts.Prompt
@@ -225,11 +226,25 @@ def generate_prompt_str(
   return prompt_str, global_ordered_slots, slot_to_cat_val_to_id, intent_to_id
 
 
-def generate_context_str(history_utterances: List[str],
-                         context_format: str) -> str:
-  """Generates the context string for an example."""
+def generate_context_str(
+    history_utterances: Union[Sequence[str], history_utils.DialogueHistory],
+    context_format: str) -> str:
+  """Generates the context string for an example.
+
+  Args:
+    history_utterances: The utterances of the conversation so far, either as
+      a sequence or as a DialogueHistory joining them with spaces.
+    context_format: Format of the context, only 'dialogue' is supported.
+
+  Returns:
+    The context string.
+  """
+  if isinstance(history_utterances, history_utils.DialogueHistory):
+    history_str = history_utterances.render()
+  else:
+    history_str = ' '.join(history_utterances)
   if context_format == 'dialogue':
-    context_str = '[CONTEXT] ' + ' '.join(history_utterances)
+    context_str = '[CONTEXT] ' + history_str
   else:
     raise ValueError(f'Invalid context format specified: {context_format}')
 
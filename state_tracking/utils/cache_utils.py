@@ -0,0 +1,95 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utils for caching parsed datasets on disk."""
+
+import hashlib
+import json
+import os
+import pickle
+from typing import Callable, Sequence, TypeVar
+
+from absl import logging
+import tensorflow as tf
+
+T = TypeVar('T')
+
+# Name of the cache directory, created next to the source data.
+CACHE_DIRNAME = '.cache'
+
+# Bump to invalidate all existing caches, e.g. when a cached type changes.
+_CACHE_VERSION = 1
+
+
+def _hash(obj) -> str:
+  content = json.dumps([_CACHE_VERSION, obj])
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+def fingerprint(source_paths: Sequence[str], key: str = '') -> str:
+  """Returns a hash of the paths, sizes and mtimes of files, and a key."""
+  stats = []
+  for path in source_paths:
+    stat = tf.io.gfile.stat(path)
+    stats.append((path, stat.length, stat.mtime_nsec))
+  return _hash([key, stats])
+
+
+def load_cached(name: str, cache_dir: str, source_paths: Sequence[str],
+                load_fn: Callable[[], T], key: str = '') -> T:
+  """Loads data from an on-disk cache, or with `load_fn` on a cache miss.
+
+  The cache file is named after `name`, a hash of `key` and a fingerprint of
+  `source_paths`, so each key (e.g. loader options) has its own cache entry,
+  which is invalidated when any source file is modified. When a new entry is
+  written, only the stale entries of the same name and key, i.e. those of
+  older source files, are removed. Failing to write the cache, e.g. because
+  `cache_dir` is read-only, is not an error.
+
+  Args:
+    name: Name of the cached data, unique within `cache_dir`.
+    cache_dir: Directory storing the cache files.
+    source_paths: Paths of all files the data is loaded from.
+    load_fn: Function loading the data from `source_paths`. Its result must be
+      picklable.
+    key: String identifying any other input of `load_fn`.
+
+  Returns:
+    The result of `load_fn`, possibly from the cache.
+  """
+  prefix = f'{name}-{_hash(key)}-'
+  cache_path = os.path.join(cache_dir,
+                            f'{prefix}{fingerprint(source_paths)}.pkl')
+  if tf.io.gfile.exists(cache_path):
+    with tf.io.gfile.GFile(cache_path, 'rb') as f:
+      data = pickle.load(f)
+    logging.info('Loaded %s from cache %s', name, cache_path)
+    return data
+
+  data = load_fn()
+  try:
+    tf.io.gfile.makedirs(cache_dir)
+    stale_paths = tf.io.gfile.glob(os.path.join(cache_dir, f'{prefix}*.pkl'))
+    for stale_path in stale_paths:
+      tf.io.gfile.remove(stale_path)
+    # Write to a temporary file first, so that concurrent or interrupted runs
+    # never read a partial cache file.
+    tmp_path = f'{cache_path}.tmp-{os.getpid()}'
+    with tf.io.gfile.GFile(tmp_path, 'wb') as f:
+      pickle.dump(data, f, protocol=5)
+    tf.io.gfile.rename(tmp_path, cache_path, overwrite=True)
+    logging.info('Cached %s to %s', name, cache_path)
+  except (OSError, tf.errors.OpError) as e:
+    logging.warning('Failed to cache %s to %s: %s', name, cache_path, e)
+  return data
@@ -0,0 +1,86 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for cache_utils."""
+
+import json
+import os
+
+from absl.testing import absltest
+from state_tracking.utils import cache_utils
+
+
+class LoadCachedTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._data_dir = self.create_tempdir().full_path
+    self._cache_dir = os.path.join(self._data_dir, cache_utils.CACHE_DIRNAME)
+    self._source_path = os.path.join(self._data_dir, 'data.json')
+    self._write_source({'a': 1})
+    self._num_loads = 0
+
+  def _write_source(self, data, mtime=None):
+    with open(self._source_path, 'w') as f:
+      json.dump(data, f)
+    if mtime is not None:
+      os.utime(self._source_path, (mtime, mtime))
+
+  def _load(self, key=''):
+
+    def load_fn():
+      self._num_loads += 1
+      with open(self._source_path) as f:
+        return json.load(f)
+
+    return cache_utils.load_cached('data', self._cache_dir,
+                                   [self._source_path], load_fn, key)
+
+  def test_loads_from_cache(self):
+    self.assertEqual(self._load(), {'a': 1})
+    self.assertEqual(self._load(), {'a': 1})
+    self.assertEqual(self._num_loads, 1)
+    self.assertLen(os.listdir(self._cache_dir), 1)
+
+  def test_invalidates_on_source_change(self):
+    self._write_source({'a': 1}, mtime=1000)
+    self.assertEqual(self._load(), {'a': 1})
+    self._write_source({'a': 2}, mtime=2000)
+    self.assertEqual(self._load(), {'a': 2})
+    self.assertEqual(self._num_loads, 2)
+    # The stale cache file is removed.
+    self.assertLen(os.listdir(self._cache_dir), 1)
+
+  def test_caches_each_key(self):
+    self._load(key='v1')
+    self._load(key='v2')
+    self._load(key='v2')
+    self._load(key='v1')
+    self.assertEqual(self._num_loads, 2)
+    self.assertLen(os.listdir(self._cache_dir), 2)
+
+  def test_invalidates_only_same_key_on_source_change(self):
+    self._write_source({'a': 1}, mtime=1000)
+    self._load(key='v1')
+    self._load(key='v2')
+    self._write_source({'a': 2}, mtime=2000)
+    self.assertEqual(self._load(key='v1'), {'a': 2})
+    self.assertEqual(self._num_loads, 3)
+    # The v1 entry of the old source is replaced, the v2 one is kept until v2
+    # is loaded again.
+    self.assertLen(os.listdir(self._cache_dir), 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
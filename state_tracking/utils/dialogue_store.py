@@ -0,0 +1,141 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An indexed, memory-mapped store of dialogue JSONs.
+
+A store consists of a packed data file, holding the compact JSON encoding of
+each dialogue back to back, and an index file `<path>.index` mapping each
+dialogue ID to its byte range. Opening a store only reads the index; dialogues
+are decoded from the memory-mapped data file when they are looked up, so
+memory use doesn't grow with the size of the corpus.
+
+Stores are written with `write_dialogue_store` and must be on a local file
+system.
+"""
+
+import collections.abc
+import json
+import mmap
+import os
+from typing import Any, Dict, Hashable, Iterable, Iterator, Optional
+
+Json = Dict[str, Any]
+
+_INDEX_SUFFIX = '.index'
+
+
+def write_dialogue_store(path: str,
+                         dialogues: Iterable[Json],
+                         id_key: str = 'dialogue_id',
+                         metadata: Optional[Json] = None) -> None:
+  """Writes dialogues into a new store.
+
+  Dialogues are written one at a time, so `dialogues` can be a generator that
+  never holds the whole corpus in memory. The store is written to temporary
+  files which are renamed once complete, so a store is never partially
+  written.
+
+  Args:
+    path: Path of the data file. The index is written to `<path>.index`.
+    dialogues: The dialogues, in the order the store iterates over them.
+    id_key: Field holding the ID of each dialogue. IDs must be unique strings
+      or integers.
+    metadata: Optional JSON-serializable data stored alongside the index.
+  """
+  dirname = os.path.dirname(path)
+  if dirname:
+    os.makedirs(dirname, exist_ok=True)
+  tmp_path = f'{path}.tmp-{os.getpid()}'
+  keys = []
+  offsets = [0]
+  with open(tmp_path, 'wb') as f:
+    for dialogue in dialogues:
+      content = json.dumps(
+          dialogue, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+      f.write(content)
+      keys.append(dialogue[id_key])
+      offsets.append(offsets[-1] + len(content))
+  if len(set(keys)) != len(keys):
+    os.remove(tmp_path)
+    raise ValueError(f'Duplicate dialogue IDs when writing {path}.')
+
+  tmp_index_path = f'{path}{_INDEX_SUFFIX}.tmp-{os.getpid()}'
+  with open(tmp_index_path, 'w') as f:
+    json.dump({
+        'keys': keys,
+        'offsets': offsets,
+        'metadata': metadata or {}
+    }, f)
+  os.replace(tmp_path, path)
+  os.replace(tmp_index_path, path + _INDEX_SUFFIX)
+
+
+def dialogue_store_exists(path: str) -> bool:
+  return os.path.exists(path) and os.path.exists(path + _INDEX_SUFFIX)
+
+
+class DialogueStore(collections.abc.Mapping):
+  """Read-only mapping from dialogue ID to dialogue, backed by a store.
+
+  Every lookup decodes a fresh copy of the dialogue, which the caller may
+  mutate freely. Iteration follows the order in which dialogues were written.
+  Stores pickle as their path, so they can be passed to worker processes.
+  """
+
+  def __init__(self, path: str):
+    """Opens the store written to `path` by `write_dialogue_store`."""
+    self._path = path
+    with open(path + _INDEX_SUFFIX) as f:
+      index = json.load(f)
+    self._keys = index['keys']
+    self._offsets = index['offsets']
+    self._key_to_idx = {key: idx for idx, key in enumerate(self._keys)}
+    self.metadata = index['metadata']
+    self._file = open(path, 'rb')
+    # Empty files can't be memory-mapped.
+    if self._offsets[-1]:
+      self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._data = b''
+
+  @property
+  def path(self) -> str:
+    return self._path
+
+  def __getitem__(self, key: Hashable) -> Json:
+    idx = self._key_to_idx[key]
+    return json.loads(self._data[self._offsets[idx]:self._offsets[idx + 1]])
+
+  def __contains__(self, key: Any) -> bool:
+    return key in self._key_to_idx
+
+  def __iter__(self) -> Iterator[Hashable]:
+    return iter(self._keys)
+
+  def __len__(self) -> int:
+    return len(self._keys)
+
+  def close(self) -> None:
+    if isinstance(self._data, mmap.mmap):
+      self._data.close()
+    self._file.close()
+
+  def __enter__(self) -> 'DialogueStore':
+    return self
+
+  def __exit__(self, *unused_exc_info) -> None:
+    self.close()
+
+  def __reduce__(self):
+    return (DialogueStore, (self._path,))
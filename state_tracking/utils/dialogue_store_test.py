@@ -0,0 +1,89 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for dialogue_store."""
+
+import os
+import pickle
+
+from absl.testing import absltest
+from state_tracking.utils import dialogue_store
+
+_DIALOGUES = [
+    {
+        'dialogue_id': '1_00001',
+        'turns': [{
+            'speaker': 'USER',
+            'utterance': 'Un café, s\'il vous plaît.'
+        }]
+    },
+    {
+        'dialogue_id': '1_00000',
+        'turns': []
+    },
+]
+
+
+class DialogueStoreTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._path = os.path.join(self.create_tempdir().full_path, 'store',
+                              'dev.dialogues')
+
+  def test_lookup_and_iteration(self):
+    self.assertFalse(dialogue_store.dialogue_store_exists(self._path))
+    dialogue_store.write_dialogue_store(
+        self._path, iter(_DIALOGUES), metadata={'split': 'dev'})
+    self.assertTrue(dialogue_store.dialogue_store_exists(self._path))
+
+    with dialogue_store.DialogueStore(self._path) as store:
+      self.assertLen(store, 2)
+      self.assertEqual(list(store), ['1_00001', '1_00000'])
+      self.assertIn('1_00000', store)
+      self.assertNotIn('1_00002', store)
+      self.assertEqual(store['1_00001'], _DIALOGUES[0])
+      self.assertEqual(list(store.values()), _DIALOGUES)
+      self.assertEqual(store.metadata, {'split': 'dev'})
+
+      # Lookups return independent copies.
+      store['1_00000']['turns'].append({})
+      self.assertEqual(store['1_00000'], _DIALOGUES[1])
+
+      unpickled_store = pickle.loads(pickle.dumps(store))
+      self.assertEqual(dict(unpickled_store), dict(store))
+      unpickled_store.close()
+
+  def test_integer_ids(self):
+    dialogues = [{'DialogueID': 7}, {'DialogueID': 3}]
+    dialogue_store.write_dialogue_store(
+        self._path, dialogues, id_key='DialogueID')
+    with dialogue_store.DialogueStore(self._path) as store:
+      self.assertEqual(list(store), [7, 3])
+      self.assertEqual(store[3], {'DialogueID': 3})
+
+  def test_empty_store(self):
+    dialogue_store.write_dialogue_store(self._path, [])
+    with dialogue_store.DialogueStore(self._path) as store:
+      self.assertEmpty(store)
+
+  def test_duplicate_ids(self):
+    with self.assertRaises(ValueError):
+      dialogue_store.write_dialogue_store(self._path,
+                                          [_DIALOGUES[0], _DIALOGUES[0]])
+    self.assertFalse(dialogue_store.dialogue_store_exists(self._path))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,48 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utils for building dialogue history strings incrementally."""
+
+from typing import List, Optional
+
+
+class DialogueHistory:
+  """Conversation history which is built up one utterance at a time.
+
+  Appending only records the utterance. The history is joined when rendered,
+  and the join is cached until the next append, so rendering the same history
+  again, e.g. for each frame of a turn, doesn't re-join the conversation.
+  """
+
+  def __init__(self, separator: str = ' '):
+    """Initializes an empty history.
+
+    Args:
+      separator: String inserted between consecutive utterances.
+    """
+    self._separator = separator
+    self._utterances: List[str] = []
+    # Join of all utterances, or None if an utterance was appended since.
+    self._text: Optional[str] = ''
+
+  def append(self, utterance: str) -> None:
+    """Adds an already formatted utterance to the history."""
+    self._utterances.append(utterance)
+    self._text = None
+
+  def render(self) -> str:
+    """Returns the utterances joined by the separator."""
+    if self._text is None:
+      self._text = self._separator.join(self._utterances)
+    return self._text
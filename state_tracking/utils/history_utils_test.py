@@ -0,0 +1,41 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for history_utils."""
+
+from absl.testing import absltest
+from state_tracking.utils import history_utils
+
+
+class DialogueHistoryTest(absltest.TestCase):
+
+  def test_render(self):
+    history = history_utils.DialogueHistory()
+    self.assertEqual(history.render(), '')
+    history.append('[user] Hi There')
+    self.assertEqual(history.render(), '[user] Hi There')
+    history.append('[system] Hello')
+    history.append('[user] Bye')
+    self.assertEqual(history.render(),
+                     '[user] Hi There [system] Hello [user] Bye')
+
+  def test_separator(self):
+    history = history_utils.DialogueHistory(separator='')
+    history.append('[user] Hi ')
+    history.append('[system] Hello ')
+    self.assertEqual(history.render(), '[user] Hi [system] Hello ')
+
+
+if __name__ == '__main__':
+  absltest.main()
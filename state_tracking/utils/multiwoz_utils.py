@@ -19,11 +19,13 @@
 
 import collections
 import dataclasses
+import functools
 import itertools
 import json
 import os
 from typing import Iterator
 
+from state_tracking.utils import cache_utils
 import tensorflow as tf
 
 # Use OrderedDict for JSON to preserve field order.
@@ -72,17 +74,44 @@ class SchemaInfo:
 
 def load_data(data_path: str,
               multiwoz_version: str,
-              is_trade: bool = False) -> MultiwozData:
+              is_trade: bool = False,
+              use_cache: bool = False) -> MultiwozData:
   """Loads MultiWOZ dataset.
 
   Args:
     data_path: Path to the multiwoz dataset.
     multiwoz_version: The version of the multiwoz dataset.
     is_trade: Whether the data is trade-preprocessed or not.
+    use_cache: If True, the parsed dataset is cached in a
+      `cache_utils.CACHE_DIRNAME` directory under `data_path`, and loaded from
+      there as long as the dataset files are unchanged.
 
   Returns:
     A dataclass object storing the loaded dataset.
   """
+  if not use_cache:
+    return _load_data(data_path, multiwoz_version, is_trade)
+
+  if is_trade:
+    filenames = ['train_dials.json', 'dev_dials.json', 'test_dials.json']
+  else:
+    extension = 'json' if multiwoz_version == '2.4' else 'txt'
+    filenames = [
+        'data.json', f'valListFile.{extension}', f'testListFile.{extension}'
+    ]
+  filenames.append('slot_descriptions.json')
+  return cache_utils.load_cached(
+      name='multiwoz_trade' if is_trade else 'multiwoz',
+      cache_dir=os.path.join(data_path, cache_utils.CACHE_DIRNAME),
+      source_paths=[os.path.join(data_path, f) for f in filenames],
+      load_fn=functools.partial(_load_data, data_path, multiwoz_version,
+                                is_trade),
+      key=multiwoz_version)
+
+
+def _load_data(data_path: str, multiwoz_version: str,
+               is_trade: bool) -> MultiwozData:
+  """Loads MultiWOZ dataset from its JSON files, see `load_data`."""
   # Load dialogue data.
   if is_trade:
     with tf.io.gfile.GFile(os.path.join(data_path, 'train_dials.json')) as f:
@@ -276,18 +305,20 @@ class MultiwozDataclassData:
 
 def load_data_as_dataclasses(data_path: str,
                              multiwoz_version: str,
-                             is_trade: bool = False) -> MultiwozDataclassData:
+                             is_trade: bool = False,
+                             use_cache: bool = False) -> MultiwozDataclassData:
   """Loads MultiWOZ dataset.
 
   Args:
     data_path: Path to the multiwoz dataset.
     multiwoz_version: The version of the multiwoz dataset.
     is_trade: Whether the data is trade-preprocessed or not.
+    use_cache: Whether to cache the parsed dataset, see `load_data`.
 
   Returns:
     A dataclass object storing the loaded dataset.
   """
-  multiwoz_data = load_data(data_path, multiwoz_version, is_trade)
+  multiwoz_data = load_data(data_path, multiwoz_version, is_trade, use_cache)
 
   def _dataclass_from_json(json_data: Json) -> dict[str, MultiwozDialog]:
     dialogs = {}
@@ -0,0 +1,133 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utils for reporting the progress and throughput of data conversion jobs."""
+
+import collections
+import contextlib
+import time
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+from absl import logging
+
+T = TypeVar('T')
+
+
+class ProgressReporter:
+  """Tracks conversion throughput and logs it at a limited rate.
+
+  Counts dialogues, examples and bytes written, and accumulates wall time per
+  named stage (e.g. "load", "convert", "write"). Progress is logged at most
+  once every `log_every_secs` seconds, so reporting never dominates run time.
+  """
+
+  def __init__(self,
+               name: str,
+               log_every_secs: float = 30.0,
+               num_verbose_examples: int = 0,
+               clock: Callable[[], float] = time.monotonic):
+    """Initializes the reporter.
+
+    Args:
+      name: Name of the job, used as a prefix in log messages.
+      log_every_secs: Minimum number of seconds between two progress logs.
+      num_verbose_examples: Number of examples to log in full, from the start
+        of the job.
+      clock: Function returning the current time in seconds.
+    """
+    self._name = name
+    self._log_every_secs = log_every_secs
+    self._num_verbose_examples = num_verbose_examples
+    self._num_logged_examples = 0
+    self._clock = clock
+    self._start_time = clock()
+    self._last_log_time = self._start_time
+    self.num_dialogues = 0
+    self.num_examples = 0
+    self.num_bytes = 0
+    self.stage_secs = collections.OrderedDict()
+
+  def add_dialogues(self, num_dialogues: int = 1) -> None:
+    self.num_dialogues += num_dialogues
+    self.maybe_log()
+
+  def add_examples(self, num_examples: int = 1, num_bytes: int = 0) -> None:
+    self.num_examples += num_examples
+    self.num_bytes += num_bytes
+    self.maybe_log()
+
+  def _maybe_log_example(self, example: Any) -> None:
+    if self._num_logged_examples < self._num_verbose_examples:
+      logging.info('%s example %d: %s', self._name, self._num_logged_examples,
+                   example)
+      self._num_logged_examples += 1
+
+  def add_example(self, example: str, num_bytes: int = 0) -> None:
+    """Counts a single example, logging it if it is among the first few."""
+    self._maybe_log_example(example)
+    self.add_examples(1, num_bytes)
+
+  def log_examples(self, examples: Iterable[T]) -> Iterator[T]:
+    """Yields from `examples`, logging the first few without counting them."""
+    for example in examples:
+      self._maybe_log_example(example)
+      yield example
+
+  @contextlib.contextmanager
+  def stage(self, name: str) -> Iterator[None]:
+    """Context manager adding the wall time of its body to a stage."""
+    start_time = self._clock()
+    try:
+      yield
+    finally:
+      self.stage_secs[name] = (
+          self.stage_secs.get(name, 0.0) + self._clock() - start_time)
+
+  def timed(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Yields from `iterable`, adding the time spent producing items to a stage.
+
+    Args:
+      name: Name of the stage.
+      iterable: Iterable whose items are (lazily) produced by the stage.
+
+    Yields:
+      The items of `iterable`.
+    """
+    iterator = iter(iterable)
+    while True:
+      with self.stage(name):
+        try:
+          item = next(iterator)
+        except StopIteration:
+          return
+      yield item
+
+  def maybe_log(self) -> None:
+    """Logs progress if enough time has passed since the last log."""
+    if self._clock() - self._last_log_time >= self._log_every_secs:
+      self.log_progress()
+
+  def log_progress(self) -> None:
+    """Logs counts, throughput and per-stage timings."""
+    now = self._clock()
+    self._last_log_time = now
+    elapsed = max(now - self._start_time, 1e-9)
+    stages = ', '.join(
+        f'{name}={secs:.1f}s' for name, secs in self.stage_secs.items())
+    logging.info(
+        '%s: %d dialogues (%.1f/s), %d examples (%.1f/s), %.1f MB written '
+        'in %.1fs. Stages: %s', self._name, self.num_dialogues,
+        self.num_dialogues / elapsed, self.num_examples,
+        self.num_examples / elapsed, self.num_bytes / 1e6, elapsed, stages or
+        'none')
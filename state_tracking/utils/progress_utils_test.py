@@ -0,0 +1,70 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for progress_utils."""
+
+from absl.testing import absltest
+from state_tracking.utils import progress_utils
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+class ProgressReporterTest(absltest.TestCase):
+
+  def test_counts_and_stages(self):
+    clock = FakeClock()
+    reporter = progress_utils.ProgressReporter('test', clock=clock)
+    reporter.add_dialogues(2)
+    with reporter.stage('write'):
+      clock.now += 1.5
+      reporter.add_example('a\tb', num_bytes=4)
+      reporter.add_examples(2, num_bytes=10)
+
+    def produce():
+      clock.now += 2.0
+      yield 'x'
+      clock.now += 0.5
+      yield 'y'
+
+    self.assertEqual(list(reporter.timed('convert', produce())), ['x', 'y'])
+    self.assertEqual(reporter.num_dialogues, 2)
+    self.assertEqual(reporter.num_examples, 3)
+    self.assertEqual(reporter.num_bytes, 14)
+    self.assertEqual(dict(reporter.stage_secs), {'write': 1.5, 'convert': 2.5})
+
+  def test_logs_verbose_examples_and_rate_limits(self):
+    clock = FakeClock()
+    reporter = progress_utils.ProgressReporter(
+        'test', log_every_secs=10, num_verbose_examples=1, clock=clock)
+    with self.assertLogs(level='INFO') as logs:
+      reporter.add_example('first')
+      reporter.add_example('second')
+      clock.now = 5
+      reporter.add_dialogues()
+      clock.now = 10
+      reporter.add_dialogues()
+    self.assertLen(logs.output, 2)
+    self.assertIn('test example 0: first', logs.output[0])
+    self.assertIn('2 dialogues', logs.output[1])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -15,53 +15,325 @@
 """Utils for processing schema-guided dialogue data."""
 
 import collections
+from concurrent import futures
+import contextlib
 import copy
+import functools
+import gzip
 import json
 import os
 import re
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple, Optional
 
 from absl import logging
+from state_tracking.utils import cache_utils
 import tensorflow as tf
 
+# Faster JSON parsers are used if installed. All of them parse SGD data into
+# the same Python objects as the json module.
+try:
+  import orjson  # pylint: disable=g-import-not-at-top
+  _json_loads = orjson.loads
+  _compact_json_dumps = orjson.dumps
+except ImportError:
+  _compact_json_dumps = None
+  try:
+    import ujson  # pylint: disable=g-import-not-at-top
+    _json_loads = ujson.loads
+  except ImportError:
+    _json_loads = json.loads
+
+try:
+  import zstandard  # pylint: disable=g-import-not-at-top
+except ImportError:
+  zstandard = None
+
+# Suffix appended to the name of files written with each compression.
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
 DialoguesDict = Dict[str, Any]
 Schema = Dict[str, Any]
 Schemas = List[Schema]
 
 
+def _zstandard() -> Any:
+  if zstandard is None:
+    raise ImportError('zstd compression requires the zstandard package.')
+  return zstandard
+
+
+def _check_compression(compression: Optional[str]) -> None:
+  if compression not in COMPRESSION_SUFFIXES:
+    raise ValueError(f'Unsupported compression: {compression}. Expected one '
+                     f'of {list(COMPRESSION_SUFFIXES)}.')
+
+
+def compress(content: bytes, compression: Optional[str]) -> bytes:
+  """Compresses content with gzip or zstd, or returns it as is if None."""
+  _check_compression(compression)
+  if compression == 'gzip':
+    return gzip.compress(content, mtime=0)
+  if compression == 'zstd':
+    return _zstandard().ZstdCompressor().compress(content)
+  return content
+
+
+def decompress(content: bytes) -> bytes:
+  """Decompresses gzip or zstd content, detected by its magic number.
+
+  JSON never starts with either magic number, so uncompressed JSON is
+  returned as is.
+
+  Args:
+    content: The possibly compressed content.
+
+  Returns:
+    The decompressed content.
+  """
+  if content.startswith(_GZIP_MAGIC):
+    return gzip.decompress(content)
+  if content.startswith(_ZSTD_MAGIC):
+    # Streamed frames don't record their size, which `decompress` requires.
+    return _zstandard().ZstdDecompressor().decompressobj().decompress(content)
+  return content
+
+
+def strip_compression_suffix(path: str) -> str:
+  for suffix in COMPRESSION_SUFFIXES.values():
+    if suffix and path.endswith(suffix):
+      return path[:-len(suffix)]
+  return path
+
+
+@contextlib.contextmanager
+def open_compressed_writer(path: str,
+                           compression: Optional[str]) -> Iterator[BinaryIO]:
+  """Opens a binary file which compresses its content while it is written.
+
+  Args:
+    path: Path of the file, including any compression suffix.
+    compression: None, 'gzip' or 'zstd'.
+
+  Yields:
+    A writable binary file object.
+  """
+  _check_compression(compression)
+  with tf.io.gfile.GFile(path, 'wb') as f:
+    if compression == 'gzip':
+      with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as writer:
+        yield writer
+    elif compression == 'zstd':
+      with _zstandard().ZstdCompressor().stream_writer(
+          f, closefd=False) as writer:
+        yield writer
+    else:
+      yield f
+
+
+def dumps_json(obj: Any, compact: bool = False) -> bytes:
+  """Encodes an object as UTF-8 JSON.
+
+  Args:
+    obj: The object to encode.
+    compact: If True, the JSON has no whitespace and non-ASCII characters
+      aren't escaped, and it is encoded by orjson if installed. Otherwise it
+      is indented by 2 spaces, like the original SGD files.
+
+  Returns:
+    The encoded JSON.
+  """
+  if not compact:
+    return json.dumps(obj, indent=2, separators=(',', ': ')).encode('utf-8')
+  if _compact_json_dumps:
+    return _compact_json_dumps(obj)
+  return json.dumps(
+      obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_json_file(path: str,
+                    obj: Any,
+                    compact: bool = False,
+                    compression: Optional[str] = None) -> str:
+  """Writes an object as a JSON file.
+
+  Args:
+    path: Path of the file, to which the compression suffix is appended.
+    obj: The object to write.
+    compact: Whether to write compact JSON, see `dumps_json`.
+    compression: None, 'gzip' or 'zstd'.
+
+  Returns:
+    The path of the written file.
+  """
+  _check_compression(compression)
+  path += COMPRESSION_SUFFIXES[compression]
+  with tf.io.gfile.GFile(path, 'wb') as f:
+    f.write(compress(dumps_json(obj, compact), compression))
+  return path
+
+
+def _read_bytes(path: str) -> bytes:
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    return f.read()
+
+
+def _parse_json(content: bytes) -> Any:
+  return _json_loads(decompress(content))
+
+
+def read_json_file(path: str) -> Any:
+  """Reads a JSON file, which may be compressed with gzip or zstd."""
+  return _parse_json(_read_bytes(path))
+
+
+def _read_decompressed_bytes(path: str) -> bytes:
+  return decompress(_read_bytes(path))
+
+
+def load_json_files(paths: List[str], num_workers: int = 1) -> List[Any]:
+  """Reads and parses JSON files, optionally reading them concurrently.
+
+  Parsing is done serially in the calling process, with orjson or ujson if
+  installed. It dominates the load time of local files, and doesn't scale
+  with worker processes, since sending the parsed objects back costs about as
+  much as parsing them. Reader threads only help on high-latency filesystems
+  such as GCS, where they read and decompress the next files while the
+  calling process parses each file as soon as it has been read.
+
+  Args:
+    paths: Paths of the JSON files.
+    num_workers: Number of reader threads. If 1, files are read and parsed
+      serially.
+
+  Returns:
+    The parsed content of each file, in the order of `paths`.
+  """
+  num_workers = min(num_workers, len(paths))
+  if num_workers <= 1:
+    return [_parse_json(_read_bytes(path)) for path in paths]
+
+  with futures.ThreadPoolExecutor(num_workers) as read_pool:
+    return [
+        _json_loads(content)
+        for content in read_pool.map(_read_decompressed_bytes, paths)
+    ]
+
+
+def _schema_file(data_dir: str, subdir: str) -> str:
+  """Returns the path of the subdir's schema file, possibly compressed."""
+  schema_file_path = os.path.join(data_dir, subdir, 'schema.json')
+  for suffix in COMPRESSION_SUFFIXES.values():
+    if tf.io.gfile.exists(schema_file_path + suffix):
+      return schema_file_path + suffix
+  return schema_file_path
+
+
 def load_schemas_to_dict(data_dir: str, subdir: str,
                          output_dict: Dict[str, Schemas]) -> None:
   """Loads a schema json from the given subdir into a provided dict."""
-  schema_file_path = os.path.join(data_dir, subdir, 'schema.json')
-  with tf.io.gfile.GFile(schema_file_path) as f:
-    output_dict[subdir] = json.load(f)
-    logging.info('Loaded schema file %s', schema_file_path)
+  schema_file_path = _schema_file(data_dir, subdir)
+  output_dict[subdir] = read_json_file(schema_file_path)
+  logging.info('Loaded schema file %s', schema_file_path)
+
+
+def dialogue_files(data_dir: str, subdir: str) -> List[str]:
+  """Returns the subdir's dialogue files, including compressed ones.
+
+  Args:
+    data_dir: Directory containing the subdir.
+    subdir: Subdir (e.g. train, dev or test) containing dialogue files.
+
+  Returns:
+    Paths of the dialogue files.
+
+  Raises:
+    ValueError: If a dialogue file exists in several variants, e.g. both
+      dialogues_001.json and dialogues_001.json.gz, which would load its
+      dialogues twice.
+  """
+  paths = []
+  for suffix in COMPRESSION_SUFFIXES.values():
+    paths.extend(
+        tf.io.gfile.glob(
+            os.path.join(data_dir, subdir, 'dialogues*.json' + suffix)))
+  filename_to_path = {}
+  for path in paths:
+    filename = strip_compression_suffix(os.path.basename(path))
+    if filename in filename_to_path:
+      raise ValueError(f'Dialogue file {filename} exists in several variants: '
+                       f'{filename_to_path[filename]} and {path}.')
+    filename_to_path[filename] = path
+  return paths
 
 
-def load_dialogues_to_dict(data_dir: str, subdir: str,
+def load_dialogues_to_dict(data_dir: str,
+                           subdir: str,
                            output_dict: Dict[str, DialoguesDict]) -> None:
-  """Loads dialogue jsons from the given subdir into a provided dict."""
+  """Loads dialogue jsons from the given subdir into a provided dict.
+
+  Dialogue files may be compressed with gzip or zstd, see
+  `write_dialogue_dir`.
+
+  Args:
+    data_dir: Directory containing the subdir.
+    subdir: Subdir (e.g. train, dev or test) containing dialogue files.
+    output_dict: Dict to which the subdir's dialogues are added, keyed by
+      filename without any compression suffix.
+  """
   if subdir not in output_dict:
     output_dict[subdir] = {}
-  dialogue_files = tf.io.gfile.glob(
-      os.path.join(data_dir, subdir, 'dialogues*.json'))
-  for dialogue_file in dialogue_files:
-    dialogue_filename = os.path.basename(dialogue_file)
-    with tf.io.gfile.GFile(dialogue_file) as f:
-      output_dict[subdir][dialogue_filename] = json.load(f)
-
+  paths = dialogue_files(data_dir, subdir)
+  for dialogue_file, dialogues in zip(paths, load_json_files(paths)):
+    dialogue_filename = strip_compression_suffix(
+        os.path.basename(dialogue_file))
+    output_dict[subdir][dialogue_filename] = dialogues
     logging.info('Loaded dialogue file %s', dialogue_file)
 
 
+def _load_subdir(data_dir: str,
+                 subdir: str) -> Tuple[Schemas, DialoguesDict]:
+  """Loads the schemas and dialogues of a single subdir."""
+  subdir_to_schema, subdir_to_dialogues = {}, {}
+  load_schemas_to_dict(data_dir, subdir, subdir_to_schema)
+  load_dialogues_to_dict(data_dir, subdir, subdir_to_dialogues)
+  return subdir_to_schema[subdir], subdir_to_dialogues[subdir]
+
+
 def load_dataset(
     data_dir: str,
-    subdirs: List[str]) -> Tuple[Dict[str, Schemas], Dict[str, DialoguesDict]]:
-  """Loads schemas and dialogues into dicts keyed by subdir."""
+    subdirs: List[str],
+    use_cache: bool = False
+) -> Tuple[Dict[str, Schemas], Dict[str, DialoguesDict]]:
+  """Loads schemas and dialogues into dicts keyed by subdir.
+
+  Args:
+    data_dir: Directory containing the subdirs.
+    subdirs: Subdirs (e.g. train, dev or test) to load.
+    use_cache: If True, the parsed data of each subdir is cached in a
+      `cache_utils.CACHE_DIRNAME` directory under `data_dir`, and loaded from
+      there as long as the subdir's files are unchanged.
+
+  Returns:
+    Dicts mapping each subdir to its schemas, and to its dialogues keyed by
+    filename.
+  """
   subdir_to_schema = {}
   subdir_to_dialogues = collections.defaultdict(dict)
   for subdir in subdirs:
-    load_schemas_to_dict(data_dir, subdir, subdir_to_schema)
-    load_dialogues_to_dict(data_dir, subdir, subdir_to_dialogues)
+    if use_cache:
+      source_paths = [_schema_file(data_dir, subdir)
+                     ] + dialogue_files(data_dir, subdir)
+      schemas, dialogues = cache_utils.load_cached(
+          name='sgd_' + subdir.replace('/', '_'),
+          cache_dir=os.path.join(data_dir, cache_utils.CACHE_DIRNAME),
+          source_paths=source_paths,
+          load_fn=functools.partial(_load_subdir, data_dir, subdir))
+    else:
+      schemas, dialogues = _load_subdir(data_dir, subdir)
+    subdir_to_schema[subdir] = schemas
+    subdir_to_dialogues[subdir].update(dialogues)
 
   return subdir_to_schema, subdir_to_dialogues
 
@@ -94,35 +366,51 @@ def dedupe_and_unnest_schemas(
   return deduped_schemas
 
 
-def write_dialogue_dir(data_dir: str, subdir: str,
-                       output_dict: Dict[str, DialoguesDict]) -> None:
-  """Writes dialogues from json object into files."""
+def write_dialogue_dir(data_dir: str,
+                       subdir: str,
+                       output_dict: Dict[str, DialoguesDict],
+                       compact: bool = False,
+                       compression: Optional[str] = None) -> None:
+  """Writes dialogues from json object into files.
+
+  Args:
+    data_dir: Directory to write the subdir to.
+    subdir: Subdir (e.g. train, dev or test) to write.
+    output_dict: Dict mapping each subdir to its dialogues keyed by filename.
+    compact: Whether to write compact JSON, see `dumps_json`.
+    compression: None, 'gzip' or 'zstd'. The compression suffix is appended
+      to each filename.
+  """
   destination_dir = os.path.join(data_dir, subdir)
   tf.io.gfile.makedirs(destination_dir)
   for dialogue_filename in output_dict[subdir]:
-    dialogue_file = os.path.join(destination_dir, dialogue_filename)
-    with tf.io.gfile.GFile(dialogue_file, 'w') as output_dialogue_file:
-      json.dump(
-          output_dict[subdir][dialogue_filename],
-          output_dialogue_file,
-          indent=2,
-          separators=(',', ': '))
-      logging.info('Wrote %s', dialogue_file)
-
-
-def write_schema_dir(data_dir: str, subdir: str,
-                     output_dict: Dict[str, Schema]) -> None:
-  """Writes schemas from json object into files."""
+    dialogue_file = write_json_file(
+        os.path.join(destination_dir, dialogue_filename),
+        output_dict[subdir][dialogue_filename], compact, compression)
+    logging.info('Wrote %s', dialogue_file)
+
+
+def write_schema_dir(data_dir: str,
+                     subdir: str,
+                     output_dict: Dict[str, Schema],
+                     compact: bool = False,
+                     compression: Optional[str] = None) -> None:
+  """Writes schemas from json object into files.
+
+  Args:
+    data_dir: Directory to write the subdir to.
+    subdir: Subdir (e.g. train, dev or test) to write.
+    output_dict: Dict mapping each subdir to its schemas.
+    compact: Whether to write compact JSON, see `dumps_json`.
+    compression: None, 'gzip' or 'zstd'. The compression suffix is appended
+      to the filename.
+  """
   destination_dir = os.path.join(data_dir, subdir)
   tf.io.gfile.makedirs(destination_dir)
-  schema_file = os.path.join(destination_dir, 'schema.json')
-  with tf.io.gfile.GFile(schema_file, 'w') as output_schema_file:
-    json.dump(
-        output_dict[subdir],
-        output_schema_file,
-        indent=2,
-        separators=(',', ': '))
-    logging.info('Wrote %s', schema_file)
+  schema_file = write_json_file(
+      os.path.join(destination_dir, 'schema.json'), output_dict[subdir],
+      compact, compression)
+  logging.info('Wrote %s', schema_file)
 
 
 def space_camel_case(s: str) -> Optional[str]:
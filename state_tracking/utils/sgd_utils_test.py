@@ -0,0 +1,130 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for sgd_utils."""
+
+import json
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from state_tracking.utils import sgd_utils
+
+
+def _make_dialogues(file_idx):
+  return [{
+      'dialogue_id': f'{file_idx}_{i:05d}',
+      'services': ['Restaurants_1'],
+      'turns': [{
+          'speaker': 'USER',
+          'utterance': f'I want to eat at café {i}.',
+          'frames': [],
+      }],
+  } for i in range(3)]
+
+
+class LoadDatasetTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._data_dir = self.create_tempdir().full_path
+    self._schema = [{'service_name': 'Restaurants_1', 'slots': []}]
+    self._dialogues = {}
+    for subdir in ('train', 'dev'):
+      os.makedirs(os.path.join(self._data_dir, subdir))
+      with open(os.path.join(self._data_dir, subdir, 'schema.json'), 'w') as f:
+        json.dump(self._schema, f)
+      for file_idx in range(1, 4):
+        filename = f'dialogues_{file_idx:03d}.json'
+        dialogues = _make_dialogues(file_idx)
+        self._dialogues[(subdir, filename)] = dialogues
+        with open(os.path.join(self._data_dir, subdir, filename), 'w') as f:
+          json.dump(dialogues, f, indent=2)
+
+  @parameterized.named_parameters(('serial', 1), ('parallel', 3))
+  def test_load_json_files(self, num_workers):
+    filenames = [f'dialogues_{file_idx:03d}.json' for file_idx in (3, 1, 2)]
+    self.assertEqual(
+        sgd_utils.load_json_files(
+            [os.path.join(self._data_dir, 'dev', name) for name in filenames],
+            num_workers),
+        [self._dialogues[('dev', name)] for name in filenames])
+
+  def test_load_dataset(self):
+    subdir_to_schema, subdir_to_dialogues = sgd_utils.load_dataset(
+        self._data_dir, ['train', 'dev'])
+
+    self.assertEqual(subdir_to_schema, {
+        'train': self._schema,
+        'dev': self._schema
+    })
+    self.assertEqual(list(subdir_to_dialogues), ['train', 'dev'])
+    for subdir, dfile_to_dialogues in subdir_to_dialogues.items():
+      self.assertCountEqual(
+          dfile_to_dialogues,
+          ['dialogues_001.json', 'dialogues_002.json', 'dialogues_003.json'])
+      for filename, dialogues in dfile_to_dialogues.items():
+        self.assertEqual(dialogues, self._dialogues[(subdir, filename)])
+
+  @parameterized.named_parameters(('indented', False, None),
+                                  ('compact', True, None),
+                                  ('gzip', True, 'gzip'),
+                                  ('zstd', True, 'zstd'))
+  def test_write_and_load_dataset(self, compact, compression):
+    if compression == 'zstd' and sgd_utils.zstandard is None:
+      self.skipTest('zstandard is not installed.')
+    output_dir = self.create_tempdir().full_path
+    subdir_to_schema, subdir_to_dialogues = sgd_utils.load_dataset(
+        self._data_dir, ['dev'])
+    sgd_utils.write_schema_dir(output_dir, 'dev', subdir_to_schema, compact,
+                               compression)
+    sgd_utils.write_dialogue_dir(output_dir, 'dev', subdir_to_dialogues,
+                                 compact, compression)
+
+    suffix = sgd_utils.COMPRESSION_SUFFIXES[compression]
+    self.assertCountEqual(
+        os.listdir(os.path.join(output_dir, 'dev')), [
+            'schema.json' + suffix, 'dialogues_001.json' + suffix,
+            'dialogues_002.json' + suffix, 'dialogues_003.json' + suffix
+        ])
+    self.assertEqual(
+        sgd_utils.load_dataset(output_dir, ['dev']),
+        (subdir_to_schema, subdir_to_dialogues))
+
+  def test_duplicate_dialogue_file_variants(self):
+    sgd_utils.write_json_file(
+        os.path.join(self._data_dir, 'dev', 'dialogues_002.json'),
+        _make_dialogues(2),
+        compression='gzip')
+    with self.assertRaisesRegex(ValueError, 'dialogues_002.json'):
+      sgd_utils.load_dataset(self._data_dir, ['dev'])
+
+  def test_dumps_json(self):
+    obj = {'utterance': 'café', 'slots': [1, 2.5, None]}
+    self.assertEqual(
+        sgd_utils.dumps_json(obj),
+        json.dumps(obj, indent=2, separators=(',', ': ')).encode('utf-8'))
+    self.assertEqual(
+        sgd_utils.dumps_json(obj, compact=True),
+        json.dumps(obj, ensure_ascii=False,
+                   separators=(',', ':')).encode('utf-8'))
+
+  def test_unsupported_compression(self):
+    with self.assertRaises(ValueError):
+      sgd_utils.write_json_file(
+          os.path.join(self._data_dir, 'out.json'), {}, compression='bz2')
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -16,9 +16,11 @@
 
 import dataclasses
 import os
-from typing import Dict, MutableSequence
+from typing import Dict, Iterable, Optional
 
 from absl import logging
+from state_tracking.utils import progress_utils
+from state_tracking.utils import tfrecord_utils
 import tensorflow as tf
 
 
@@ -43,41 +45,42 @@ class TextToTextExample:
   frame: int = 0
 
 
-def write_data(examples: MutableSequence[TextToTextExample],
-               output_path: str) -> None:
+def _to_features(example: TextToTextExample) -> tfrecord_utils.Features:
+  features = {
+      'input': example.src,
+      'value': example.tgt,
+      'dialog_id': example.dialog_id,
+      'turn': example.turn
+  }
+  for key, val in example.metadata.items():
+    assert key not in ('input', 'value', 'dialog_id', 'turn')
+    features[key] = val
+  return features
+
+
+def write_data(examples: Iterable[TextToTextExample],
+               output_path: str,
+               reporter: Optional[progress_utils.ProgressReporter] = None,
+               num_shards: int = 1,
+               num_workers: int = 1) -> None:
   """Writes examples to the given output path.
 
   Args:
     examples: A list of formatted examples to write out
     output_path: The file path to write examples out to
+    reporter: If set, counts the written examples and bytes
+    num_shards: Number of TFRecord shards to write, see
+      `tfrecord_utils.write_examples`
+    num_workers: Number of processes serializing examples
   """
-
-  def _bytes_feature(value):
-    """Returns a bytes_list from a string / byte."""
-    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
-
-  def _int64_feature(value):
-    """Returns an int64_list from a bool / enum / int / uint."""
-    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
-
-  tf.io.gfile.makedirs(os.path.dirname(output_path))
-
-  with tf.io.TFRecordWriter(output_path) as out_file:
-    for example in examples:
-      features = {
-          'input': _bytes_feature(example.src.encode('utf-8')),
-          'value': _bytes_feature(example.tgt.encode('utf-8')),
-          'dialog_id': _bytes_feature(example.dialog_id.encode('utf-8')),
-          'turn': _int64_feature(example.turn)
-      }
-      for key, val in example.metadata.items():
-        assert key not in ('input', 'value', 'dialog_id', 'turn')
-        features[key] = _bytes_feature(val.encode('utf-8'))
-      tf_example = tf.train.Example(
-          features=tf.train.Features(feature=features))
-      out_file.write(tf_example.SerializeToString())
-    logging.info('Wrote %s with %d examples', os.path.basename(output_path),
-                 len(examples))
+  num_examples = tfrecord_utils.write_examples(
+      map(_to_features, examples),
+      output_path,
+      num_shards=num_shards,
+      num_workers=num_workers,
+      reporter=reporter)
+  logging.info('Wrote %s with %d examples', os.path.basename(output_path),
+               num_examples)
 
 
 def decode_fn(record_bytes: tf.Tensor) -> Dict[str, tf.Tensor]:
@@ -0,0 +1,122 @@
+# Copyright 2021 Google Research.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for tfrecord_utils."""
+
+import os
+import threading
+from unittest import mock
+
+from absl.testing import parameterized
+from state_tracking.utils import progress_utils
+from state_tracking.utils import tfrecord_utils
+import tensorflow as tf
+
+
+def _to_proto(features):
+  feature = {}
+  for name, value in features.items():
+    if isinstance(value, int):
+      feature[name] = tf.train.Feature(
+          int64_list=tf.train.Int64List(value=[value]))
+    else:
+      if isinstance(value, str):
+        value = value.encode('utf-8')
+      feature[name] = tf.train.Feature(
+          bytes_list=tf.train.BytesList(value=[value]))
+  return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def _read_records(path):
+  return [r.numpy() for r in tf.data.TFRecordDataset([path])]
+
+
+class TfrecordUtilsTest(tf.test.TestCase, parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      ('empty', {}),
+      ('strings', {
+          'input': 'hello',
+          'value': '',
+          'dialog_id': 'd_0'
+      }),
+      ('unicode', {
+          'input': 'café ☕',
+          'bytes': b'\x00\xff'
+      }),
+      ('ints', {
+          'turn': 0,
+          'big': 2**40,
+          'negative': -1,
+          'min': -2**63
+      }),
+      ('long_string', {
+          'input': 'x' * 100000,
+          'turn': 3
+      }),
+  )
+  def test_serialize_example_matches_proto(self, features):
+    serialized = tfrecord_utils.serialize_example(features)
+    expected = _to_proto(features)
+    self.assertEqual(serialized, expected.SerializeToString(deterministic=True))
+    self.assertProtoEquals(expected, tfrecord_utils.to_tf_example(features))
+
+  def test_serialize_example_bad_type(self):
+    with self.assertRaises(TypeError):
+      tfrecord_utils.serialize_example({'input': 1.5})
+
+  @parameterized.parameters(1, 2)
+  def test_write_examples(self, num_workers):
+    examples = [{'input': f'input {i}', 'turn': i} for i in range(2500)]
+    path = os.path.join(self.get_temp_dir(), f'single_{num_workers}', 'data')
+    reporter = progress_utils.ProgressReporter('test', num_verbose_examples=2)
+    producer_threads = set()
+
+    def _produce():
+      for example in examples:
+        producer_threads.add(threading.current_thread())
+        yield example
+
+    with mock.patch.object(progress_utils.logging, 'info') as mock_info:
+      num_examples = tfrecord_utils.write_examples(
+          _produce(), path, num_workers=num_workers, reporter=reporter)
+    self.assertEqual(producer_threads, {threading.current_thread()})
+    self.assertEqual(num_examples, 2500)
+    self.assertEqual(reporter.num_examples, 2500)
+    self.assertEqual(mock_info.call_count, 2)
+
+    records = _read_records(path)
+    self.assertEqual(records,
+                     [tfrecord_utils.serialize_example(ex) for ex in examples])
+    self.assertEqual(reporter.num_bytes, sum(len(r) for r in records))
+
+  def test_write_sharded_examples(self):
+    examples = [{'input': f'input {i}'} for i in range(2500)]
+    path = os.path.join(self.get_temp_dir(), 'sharded', 'data')
+    tfrecord_utils.write_examples(examples, path, num_shards=2, num_workers=2)
+
+    shard_paths = tfrecord_utils.shard_paths(path, 2)
+    self.assertEqual(shard_paths,
+                     [f'{path}-00000-of-00002', f'{path}-00001-of-00002'])
+    records = [_read_records(shard_path) for shard_path in shard_paths]
+    # Batches of 1024 examples alternate between shards.
+    self.assertLen(records[0], 1024 + 452)
+    self.assertLen(records[1], 1024)
+    self.assertCountEqual(
+        records[0] + records[1],
+        [tfrecord_utils.serialize_example(ex) for ex in examples])
+
+
+if __name__ == '__main__':
+  tf.test.main()